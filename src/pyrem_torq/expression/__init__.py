@@ -4,3 +4,7 @@ from node_expression import *
 from tricky_expression import *
 from holder import *
 from subapply import *
+from memo import *
+from packrat import *
+from codegen import *
+from vm import *
@@ -1,6 +1,8 @@
 #coding: utf-8
 
 from itertools import chain as _chain
+from bisect import bisect_left as _bisect_left
+import threading as _threading
 
 
 def inner_expr_iter(expr):
@@ -40,44 +42,61 @@ class MatchCandidateForLookAhead:
         assert items is ANY_ITEM or ANY_ITEM not in items
         return ANY_ITEM if items is ANY_ITEM else frozenset(items)
 
-    def __init__(self, nodes=(), literals=(), emptyseq=False):
-        """ MatchCandidateForLookAhead(nodes=(), literals=(), emptyseq=False).
+    def __init__(self, nodes=(), literals=(), emptyseq=False, literalHeads=None):
+        """ MatchCandidateForLookAhead(nodes=(), literals=(), emptyseq=False, literalHeads=None).
             nodes are the labels that an expression may match to.
             when nodes=ANY_ITEM, it means that an expression may match any labeled nodes.
             literals are the strings that an expression may match to.
             when literals=ANY_ITEM, it means that an expression may match any strings.
             emptyseq specifies an expression may match to an empty seq or not.
+            literalHeads narrows literals=ANY_ITEM down to the strings whose first character
+            (s[:1]) is one of literalHeads. None means no such narrowing.
+            When literals is not ANY_ITEM, literalHeads is derived from literals.
         """
 
         self.__nodes = MatchCandidateForLookAhead.__normalize_items(nodes)
         self.__literals = MatchCandidateForLookAhead.__normalize_items(literals)
         self.__emptyseq = not not emptyseq
+        if self.__literals is not ANY_ITEM:
+            self.__literalHeads = frozenset(s[:1] for s in self.__literals)
+        else:
+            self.__literalHeads = frozenset(literalHeads) if literalHeads is not None else None
 
     def modified(self, nodes=None, literals=None, emptyseq=None):
         return MatchCandidateForLookAhead(nodes=nodes if nodes is not None else self.__nodes,
             literals=literals if literals is not None else self.__literals,
-            emptyseq=emptyseq if emptyseq is not None else self.__emptyseq)
+            emptyseq=emptyseq if emptyseq is not None else self.__emptyseq,
+            literalHeads=self.__literalHeads)
 
     def _getnodes(self): return self.__nodes
     def _getliterals(self): return self.__literals
     def _getemptyseq(self): return self.__emptyseq
+    def _getliteralheads(self): return self.__literalHeads
 
     nodes = property(_getnodes)
     literals = property(_getliterals)
     emptyseq = property(_getemptyseq)
+    literalHeads = property(_getliteralheads)
 
     def __eq__(self, right):
         return right.__class__ == MatchCandidateForLookAhead and \
-            self.__nodes == right.__nodes and self.__literals == right.__literals and self.__emptyseq == right.__emptyseq
+            self.__nodes == right.__nodes and self.__literals == right.__literals and self.__emptyseq == right.__emptyseq and \
+            self.__literalHeads == right.__literalHeads
 
     def __repr__(self):
-        return "MatchCandiateForLookAhead(nodes=%s,literals=%s,emptyseq=%s)" % \
+        return "MatchCandiateForLookAhead(nodes=%s,literals=%s,emptyseq=%s%s)" % \
             ((repr(tuple(sorted(self.__nodes))) if self.__nodes.__class__ is not _AnyItem else "ANY_ITEM"),
             (repr(tuple(sorted(self.__literals)))  if self.__literals.__class__ is not _AnyItem else "ANY_ITEM"),
-            repr(self.__emptyseq))
+            repr(self.__emptyseq),
+            (",literalHeads=%s" % repr(tuple(sorted(self.__literalHeads)))) \
+                if self.__literals.__class__ is _AnyItem and self.__literalHeads is not None else "")
 
     def __hash__(self):
-        return hash("MatchCandiateForLookAhead") + sum(map(hash, _chain(self.__nodes, self.__literals, self.__emptyseq)))
+        return hash(("MatchCandiateForLookAhead", self.__nodes, self.__literals, self.__emptyseq, self.__literalHeads))
+
+
+def _union_heads(h1, h2):
+    return h1 | h2 if h1 is not None and h2 is not None else None
 
 
 class LeftRecursionUndecided(ValueError): pass
@@ -117,9 +136,20 @@ class TorqExpression(object):
             Otherwise, returns a tuple (0, []).
         '''
         
+        outerIndexes = getattr(_positionIndexScope, "indexes", None)
+        outerDropLabel = _dropLabelScope.label
+        _positionIndexScope.indexes = {}
+        _dropLabelScope.label = _dropLabelScope.pending; _dropLabelScope.pending = None
+        try:
+            return self.__match_i(inpSeq, inpPos)
+        finally:
+            _positionIndexScope.indexes = outerIndexes
+            _dropLabelScope.label = outerDropLabel
+
+    def __match_i(self, inpSeq, inpPos):
         assert inpPos >= 1
         len_inpSeq = len(inpSeq)
-        assert inpSeq.__class__ is list and len_inpSeq >= 1
+        assert (inpSeq.__class__ is list or hasattr(inpSeq, "__getitem__")) and len_inpSeq >= 1
         if inpPos == len_inpSeq:
             r = self._match_eon(inpSeq, inpPos, None)
         else:
@@ -134,20 +164,69 @@ class TorqExpression(object):
         if o.__class__ is not list: o = list(o)
         return p, o
 
-    def parse(self, inpSeq):
+    def parse(self, inpSeq, dropLabel=None):
         ''' Do matching of the expression and input sequence.
             If the entire inpSeq is matched by the expression (self),
             returns list of output nodes. Otherwise, returns None.
+            When inpSeq is a TreeSeq (of pyrem_torq.treeseq), returns a TreeSeq.
+            When dropLabel is given, the nodes of dropLabel which BuildToNode expressions build are dropped
+            from the output, as seq_split_nodes_of_label(output, dropLabel)[0] does, without rebuilding the output.
         '''
 
-        p, o = self.match(inpSeq, 1)
+        if hasattr(inpSeq, "to_nested"):
+            newSeq = self.parse(inpSeq.to_nested(), dropLabel)
+            return inpSeq.from_nested(newSeq) if newSeq is not None else None
+        _dropLabelScope.pending = dropLabel
+        try:
+            p, o = self.match(inpSeq, 1)
+        finally:
+            _dropLabelScope.pending = None
         if 1 + p != len(inpSeq): return None
         newSeq = [inpSeq[0]]; newSeq.extend(o)
         return newSeq
 
+    def recognize(self, inpSeq, inpPos):
+        ''' Do matching of the expression and input sequence, without building output nodes.
+            If a substring inpSeq[inpPos:x] is matched by the expression (self),
+            returns length of the matching substring. Otherwise, returns None.
+        '''
+
+        outerIndexes = getattr(_positionIndexScope, "indexes", None)
+        _positionIndexScope.indexes = {}
+        try:
+            return self.__recognize_i(inpSeq, inpPos)
+        finally:
+            _positionIndexScope.indexes = outerIndexes
+
+    def __recognize_i(self, inpSeq, inpPos):
+        assert inpPos >= 1
+        len_inpSeq = len(inpSeq)
+        assert (inpSeq.__class__ is list or hasattr(inpSeq, "__getitem__")) and len_inpSeq >= 1
+        if inpPos == len_inpSeq:
+            return self._recognize_eon(inpSeq, inpPos, None)
+        lookAhead = inpSeq[inpPos]
+        if lookAhead.__class__ is list:
+            return self._recognize_node(inpSeq, inpPos, lookAhead)
+        return self._recognize_lit(inpSeq, inpPos, (lookAhead, inpSeq[inpPos + 1]))
+
     def _match_node(self, inpSeq, inpPos, lookAhead): pass  # return None
     _match_lit = _match_eon = _match_node
 
+    # _recognize_* methods return the length which the corresponding _match_* method returns, or None.
+    # a derived class overrides them when it can do so without building output nodes.
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        r = self._match_node(inpSeq, inpPos, lookAheadNode)
+        if r is not None: return r[0]
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        r = self._match_lit(inpSeq, inpPos, lookAheadString)
+        if r is not None: return r[0]
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        r = self._match_eon(inpSeq, inpPos, lookAheadDummy)
+        if r is not None: return r[0]
+
     def getMatchCandidateForLookAhead(self):
         ''' Returns the possible first items that self matches.
             If such items are unknown, returns None.
@@ -157,6 +236,14 @@ class TorqExpression(object):
         return None 
     
     def updateMatchCandidateForLookAhead(self): pass
+
+    def _get_item_preds(self):
+        ''' Returns (nodePred, literalPred), when the expression matches just one item and outputs it as it is,
+            and whether it matches or not is decided by nodePred(label of node) or literalPred(string of literal).
+            A pred of None means that the expression does not match such items.
+            Otherwise, returns None. (intended to be used internally.)
+        '''
+        return None
         
     @staticmethod
     def __call_extract_exprs_if_having(self):
@@ -205,6 +292,17 @@ class TorqExpressionSingleton(TorqExpression):
         return right.__class__ == self.__class__
 
 
+def _anyItemPred(item): return True
+
+
+def _or_preds(preds):
+    preds = [p for p in preds if p is not None]
+    if not preds: return None
+    if len(preds) == 1: return preds[0]
+    if _anyItemPred in preds: return _anyItemPred
+    return lambda item: any(p(item) for p in preds)
+
+
 def _target_expr_flatener(exprs, targetExprClz):
     r = []
     for e in exprs:
@@ -215,13 +313,47 @@ def _target_expr_flatener(exprs, targetExprClz):
     return r
 
 
+def _collapse_literal_runs(exprs):
+    ''' Replaces each run of adjacent Literal/LiteralSet expressions with a LiteralSet.
+        Only adjacent ones are merged, so that the other alternatives keep their priorities.
+    '''
+    from literal_expression import Literal, LiteralSet  # literal_expression imports this module
+    
+    r = []
+    run = []
+    def flush_run():
+        if len(run) == 1 and run[0].__class__ is Literal:
+            r.append(run[0])
+        elif run:
+            r.append(LiteralSet(_chain(*[e.extract_strings() for e in run])))
+        del run[:]
+    for e in exprs:
+        if e.__class__ is Literal or e.__class__ is LiteralSet:
+            run.append(e)
+        else:
+            flush_run()
+            r.append(e)
+    flush_run()
+    return r
+
+
 class Or(TorqExpression):
-    ''' Or expression matches a sequence, iff the sequence is matched by one of the internal expressions. '''
+    ''' Or expression matches a sequence, iff the sequence is matched by one of the internal expressions. 
+        Adjacent Literal alternatives are merged into a LiteralSet, and 
+        Or of only Literal alternatives, e.g. Or(Literal('+'), Literal('-')), returns a LiteralSet.
+    '''
 
-    __slots__ = ['__exprs', '__ntbl_get', '__unknown_nlst', '__ltbl_get', '__unknown_llst', '__elst', '__mc4la']
+    __slots__ = ['__exprs', '__ntbl_get', '__unknown_nlst', '__ltbl_get', '__htbl_get', '__unknown_llst', '__elst', '__mc4la']
+
+    def __new__(cls, *exprs):
+        if len(exprs) >= 2:
+            collapsed = _collapse_literal_runs(_target_expr_flatener(exprs, Or))
+            if len(collapsed) == 1 and collapsed[0].__class__ is not cls:
+                return collapsed[0]
+        return TorqExpression.__new__(cls)
 
     def __init__(self, *exprs):
-        self._set_exprs(_target_expr_flatener(exprs, Or))
+        self._set_exprs(_collapse_literal_runs(_target_expr_flatener(exprs, Or)))
     
     def getexprs(self): return self.__exprs
     exprs = property(getexprs)
@@ -237,32 +369,39 @@ class Or(TorqExpression):
         self._calc_mc4la()
     
     def _calc_mc4la(self):
-        ntbl, self.__unknown_nlst, ltbl, self.__unknown_llst, self.__elst, including_unknown_req = Or._make_tables(self.__exprs)
+        ntbl, self.__unknown_nlst, ltbl, htbl, self.__unknown_llst, self.__elst, including_unknown_req = Or._make_tables(self.__exprs)
         if including_unknown_req:
             self.__mc4la = None
         else:
             self.__mc4la = MatchCandidateForLookAhead(
                     nodes=ANY_ITEM if self.__unknown_nlst else ntbl.keys(),
-                    literals=ANY_ITEM if self.__unknown_llst else ltbl.keys(),
-                    emptyseq=not not self.__elst) 
+                    literals=ANY_ITEM if self.__unknown_llst or htbl else ltbl.keys(),
+                    emptyseq=not not self.__elst,
+                    literalHeads=None if self.__unknown_llst else set(htbl.iterkeys()).union(s[:1] for s in ltbl)) 
         self.__ntbl_get = ntbl.get
         self.__ltbl_get = ltbl.get
+        self.__htbl_get = htbl.get
     
     @staticmethod
     def _make_tables(exprs):
         def append_to_all_values(tbl, item):
             for L in tbl.itervalues(): L.append(item)
+        def append_to_values_of_heads(tbl, heads, item):
+            for k, L in tbl.iteritems():
+                if k[:1] in heads: L.append(item)
         includingUnknownReq = any(e is None for e in exprs)
         exprAndReqs = [(expr, expr.getMatchCandidateForLookAhead()) for expr in exprs]
 
-        ns, ls = [], []
+        ns, ls, hs = [], [], []
         for r in filter(None, (r for _, r in exprAndReqs)):
             if r.nodes is not ANY_ITEM: ns.extend(r.nodes)
             if r.literals is not ANY_ITEM: ls.extend(r.literals)
+            elif r.literalHeads is not None: hs.extend(r.literalHeads)
 
         ntbl = dict((lbl, []) for lbl in ns)
         unknown_nlst = []
         ltbl = dict((s, []) for s in ls)
+        htbl = dict((c, []) for c in hs)  # for the strings missing in ltbl, indexed by the first character
         unknown_llst = []
         elst = []
         for expr, r in exprAndReqs:
@@ -274,16 +413,32 @@ class Or(TorqExpression):
                     unknown_nlst.append(expr)
                 if r.literals is not ANY_ITEM:
                     for s in r.literals: ltbl[s].append(expr)
+                elif r.literalHeads is not None:
+                    append_to_values_of_heads(ltbl, r.literalHeads, expr)
+                    append_to_values_of_heads(htbl, r.literalHeads, expr)
                 else:
                     append_to_all_values(ltbl, expr)
+                    append_to_all_values(htbl, expr)
                     unknown_llst.append(expr)
                 if r.emptyseq: elst.append(expr)
             else:
-                for L in _chain(ntbl.itervalues(), ltbl.itervalues(), [unknown_nlst, unknown_llst, elst]):
+                for L in _chain(ntbl.itervalues(), ltbl.itervalues(), htbl.itervalues(), [unknown_nlst, unknown_llst, elst]):
                     L.append(expr)
-        return ntbl, unknown_nlst, ltbl, unknown_llst, elst, includingUnknownReq
+        return ntbl, unknown_nlst, ltbl, htbl, unknown_llst, elst, includingUnknownReq
     
     def extract_exprs(self): return list(self.__exprs)
+
+    def _get_item_preds(self):
+        preds = [expr._get_item_preds() for expr in self.__exprs]
+        if not preds or None in preds: return None
+        return _or_preds([np for np, _ in preds]), _or_preds([lp for _, lp in preds])
+
+    def _get_tables(self):
+        ''' Returns the dispatch tables, (ntbl, unknown_nlst, ltbl, htbl, unknown_llst, elst). (intended to be used internally.)
+            A string s is dispatched with ltbl, then with htbl by s[:1], then to unknown_llst.
+        '''
+        return self.__ntbl_get.__self__, self.__unknown_nlst, self.__ltbl_get.__self__, self.__htbl_get.__self__, \
+            self.__unknown_llst, self.__elst
         
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
         for expr in self.__ntbl_get(lookAheadNode[0], self.__unknown_nlst):
@@ -294,7 +449,8 @@ class Or(TorqExpression):
         
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         #assert len(lookAheadString) == 2
-        for expr in self.__ltbl_get(lookAheadString[1], self.__unknown_llst):
+        s = lookAheadString[1]
+        for expr in self.__ltbl_get(s) or self.__htbl_get(s[:1], self.__unknown_llst):
             r = expr._match_lit(inpSeq, inpPos, lookAheadString)
             if r is not None:
                 return r
@@ -307,6 +463,25 @@ class Or(TorqExpression):
                 return r
         #else: return None
 
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        for expr in self.__ntbl_get(lookAheadNode[0], self.__unknown_nlst):
+            r = expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+            if r is not None:
+                return r
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        s = lookAheadString[1]
+        for expr in self.__ltbl_get(s) or self.__htbl_get(s[:1], self.__unknown_llst):
+            r = expr._recognize_lit(inpSeq, inpPos, lookAheadString)
+            if r is not None:
+                return r
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        for expr in self.__elst:
+            r = expr._recognize_eon(inpSeq, inpPos, lookAheadDummy)
+            if r is not None:
+                return r
+
     def getMatchCandidateForLookAhead(self): 
         return self.__mc4la
      
@@ -344,7 +519,7 @@ class Seq(TorqExpression):
     def extract_exprs(self): return list(self.__exprs)
         
     def _calc_mc4la(self):
-        ns, ls = set(), set()
+        ns, ls, hs = set(), set(), frozenset()
         acceptEmpty = True
         for r in (expr.getMatchCandidateForLookAhead() for expr in self.__exprs):
             if r is None: 
@@ -352,11 +527,12 @@ class Seq(TorqExpression):
                 return
             ns = ns | r.nodes
             ls = ls | r.literals
+            hs = _union_heads(hs, r.literalHeads)
             if not r.emptyseq:
                 acceptEmpty = False
                 break  # for r
         self.__mc4la = MatchCandidateForLookAhead(
-                nodes=ns, literals=ls, emptyseq=acceptEmpty)
+                nodes=ns, literals=ls, emptyseq=acceptEmpty, literalHeads=hs)
     
     def updateMatchCandidateForLookAhead(self):
         for expr in self.__exprs:
@@ -401,6 +577,34 @@ class Seq(TorqExpression):
             outSeq.extend(r[1])
         return 0, outSeq
 
+    def __recognize_tail(self, inpSeq, inpPos, p):
+        if p is None: return None
+        len_inpSeq = len(inpSeq)
+        curInpPos = inpPos + p
+        for expr in self.__exprs[1:]:
+            if curInpPos == len_inpSeq:
+                p = expr._recognize_eon(inpSeq, curInpPos, None)
+            else:
+                lookAhead = inpSeq[curInpPos]
+                if lookAhead.__class__ is list:
+                    p = expr._recognize_node(inpSeq, curInpPos, lookAhead)
+                else:
+                    p = expr._recognize_lit(inpSeq, curInpPos, (lookAhead, inpSeq[curInpPos + 1]))
+            if p is None: return None
+            curInpPos += p
+        return curInpPos - inpPos
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self.__recognize_tail(inpSeq, inpPos, self.__expr0._recognize_node(inpSeq, inpPos, lookAheadNode))
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        return self.__recognize_tail(inpSeq, inpPos, self.__expr0._recognize_lit(inpSeq, inpPos, lookAheadString))
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        for expr in self.__exprs:
+            if expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None: return None
+        return 0
+
     def getMatchCandidateForLookAhead(self): 
         return self.__mc4la
         
@@ -441,11 +645,22 @@ class Repeat(TorqExpressionWithExpr):
 
     __slots__ = ['__lowerLimit', '__upperLimit', '__mc4la']
 
+    def __new__(cls, expr=None, lowerLimit=0, upperLimit=None):
+        if cls is Repeat and expr is not None and expr._get_item_preds() is not None:
+            cls = _RepeatOfItem
+        return TorqExpressionWithExpr.__new__(cls)
+
     def __init__(self, expr, lowerLimit, upperLimit):
         assert lowerLimit >= 0
         assert upperLimit is None or upperLimit >= lowerLimit
         self.__lowerLimit, self.__upperLimit = lowerLimit, upperLimit
         self._set_expr(expr)
+
+    def getlowerlimit(self): return self.__lowerLimit
+    lowerLimit = property(getlowerlimit)
+
+    def getupperlimit(self): return self.__upperLimit
+    upperLimit = property(getupperlimit)
     
     def _calc_mc4la(self):
         mc4la = self._expr.getMatchCandidateForLookAhead()
@@ -502,9 +717,38 @@ class Repeat(TorqExpressionWithExpr):
             if o.__class__ is not list: o = list(o)
             return 0, o * self.__lowerLimit
         return _zeroLengthReturnValue
+
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        len_inpSeq = len(inpSeq)
+        curInpPos = inpPos
+        ul = self.__upperLimit if self.__upperLimit is not None else (len_inpSeq - inpPos)
+        count = 0 - self.__lowerLimit
+        ul -= self.__lowerLimit
+        while count < ul and curInpPos < len_inpSeq:
+            lookAhead = inpSeq[curInpPos]
+            if lookAhead.__class__ is list:
+                p = self._expr._recognize_node(inpSeq, curInpPos, lookAhead)
+            else:
+                p = self._expr._recognize_lit(inpSeq, curInpPos, (lookAhead, inpSeq[curInpPos + 1]))
+            if p is None:
+                if count < 0: return None
+                break  # for count
+            if p == 0 and count >= 0: break  # in order to avoid infinite loop
+            curInpPos += p
+            count += 1
+        if curInpPos == len_inpSeq and count < 0:
+            if self._expr._recognize_eon(inpSeq, inpPos, None) is None: return None
+        return curInpPos - inpPos
+
+    _recognize_lit = _recognize_node
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        if self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None:
+            return 0 if self.__lowerLimit == 0 else None
+        return 0
     
     def _eq_i(self, right, alreadyComparedExprs):
-        return right.__class__ is Repeat and \
+        return isinstance(right, Repeat) and \
                 self.__lowerLimit == right.__lowerLimit and self.__upperLimit == right.__upperLimit and \
                 self._expr._eq_i(right._expr, alreadyComparedExprs)
 
@@ -533,6 +777,54 @@ class Repeat(TorqExpressionWithExpr):
         return self.expr is target or self.expr._isLeftRecursive_i(target, visitedExprIdSet)
 
 
+class _RepeatOfItem(Repeat):
+    ''' Repeat of an expression which matches just one item, e.g. Repeat(Rex(r"^\s$"), 1, None).
+        Tests the items with the predicates of the expression directly, and outputs the matched items with a slice.
+        Repeat(expr, ...) returns an object of this class, when expr._get_item_preds() is available.
+    '''
+
+    __slots__ = ['__nodePred', '__literalPred', '__lowerLimit', '__upperLimit']
+
+    def __init__(self, expr, lowerLimit, upperLimit):
+        Repeat.__init__(self, expr, lowerLimit, upperLimit)
+        self.__nodePred, self.__literalPred = expr._get_item_preds()
+        self.__lowerLimit = lowerLimit
+        self.__upperLimit = upperLimit if upperLimit is not None else -1  # count never reaches -1
+
+    def __match_end(self, inpSeq, inpPos):
+        # returns the position where the repetition ends, or None.
+        nodePred, literalPred = self.__nodePred, self.__literalPred
+        len_inpSeq = len(inpSeq)
+        ul = self.__upperLimit
+        curInpPos = inpPos
+        count = 0
+        while count != ul and curInpPos < len_inpSeq:
+            item = inpSeq[curInpPos]
+            if item.__class__ is list:
+                if nodePred is None or not nodePred(item[0]): break  # while
+                curInpPos += 1
+            else:
+                if literalPred is None or not literalPred(inpSeq[curInpPos + 1]): break  # while
+                curInpPos += 2
+            count += 1
+        if count < self.__lowerLimit: return None
+        return curInpPos
+
+    def _match_node(self, inpSeq, inpPos, lookAhead):
+        end = self.__match_end(inpSeq, inpPos)
+        if end is not None:
+            return end - inpPos, inpSeq[inpPos:end]
+
+    _match_lit = _match_node
+
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        end = self.__match_end(inpSeq, inpPos)
+        if end is not None:
+            return end - inpPos
+
+    _recognize_lit = _recognize_node
+
+
 class _RepeatZeroOrOne(Repeat):
     __slots__ = []
 
@@ -548,19 +840,110 @@ class _RepeatZeroOrOne(Repeat):
     def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
         return self._expr._match_eon(inpSeq, inpPos, lookAheadDummy) or _zeroLengthReturnValue
 
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        p = self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+        return p if p is not None else 0
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        p = self._expr._recognize_lit(inpSeq, inpPos, lookAheadString)
+        return p if p is not None else 0
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy)
+        return 0
+
 _searchingMc4la = MatchCandidateForLookAhead(nodes=ANY_ITEM, literals=ANY_ITEM, emptyseq=True)
 
 
+class _PositionIndex(object):
+    ''' Positions of the items of an input sequence, by label of node and by string of literal.
+        Built lazily, and valid while the sequence is not modified.
+    '''
+
+    __slots__ = ['__seq', '__labelPositions', '__stringPositions', '__candidates']
+
+    def __init__(self, seq):
+        self.__seq = seq
+        self.__labelPositions = None
+        self.__stringPositions = {}
+        self.__candidates = {}
+
+    def __label_positions(self):
+        if self.__labelPositions is None:
+            seq = self.__seq
+            tbl = self.__labelPositions = {}
+            for i in [i for i, item in enumerate(seq) if item.__class__ is list]:
+                tbl.setdefault(seq[i][0], []).append(i)
+        return self.__labelPositions
+
+    def __string_positions(self, s):
+        poss = self.__stringPositions.get(s)
+        if poss is None:
+            poss = self.__stringPositions[s] = []
+            find = self.__seq.index  # scans in C. a string item is always preceded by its position (an int).
+            i = 1
+            try:
+                while True:
+                    i = find(s, i)
+                    poss.append(i - 1)
+                    i += 1
+            except ValueError: pass
+        return poss
+
+    def candidates(self, labels, strings):
+        ''' Returns a sorted list of positions of the nodes of labels and the literals of strings. '''
+        key = labels, strings
+        cands = self.__candidates.get(key)
+        if cands is None:
+            cands = self.__candidates[key] = []
+            if labels:
+                lp = self.__label_positions()
+                for lbl in labels: cands.extend(lp.get(lbl, ()))
+            for s in strings: cands.extend(self.__string_positions(s))
+            cands.sort()
+        return cands
+
+# indexes (id(seq) -> _PositionIndex) shared in a call of TorqExpression.match()/recognize().
+# a nested call (e.g. from a function of SubApply) has its own indexes, because it may modify sequences.
+_positionIndexScope = _threading.local()
+
+# the label of nodes to be dropped from the output, in a call of TorqExpression.parse().
+# parse() passes it as pending to the match() it calls, so that a nested match() doesn't drop nodes.
+class _DropLabelScope(_threading.local):
+    label = None
+    pending = None
+_dropLabelScope = _DropLabelScope()
+
+_INDEXED_SEARCH_MIN_LENGTH = 64
+_INDEXED_SEARCH_MAX_DENSITY = 4  # candidates should be less than 1/4 of the items
+
+
+def _get_position_index(inpSeq):
+    indexes = getattr(_positionIndexScope, "indexes", None)
+    if indexes is None: return None
+    idx = indexes.get(id(inpSeq))
+    if idx is None:
+        idx = indexes[id(inpSeq)] = _PositionIndex(inpSeq)
+    return idx
+
+
 def _toPred(laSet):
     if laSet is ANY_ITEM: return lambda la: True
     elif len(laSet) == 0: return lambda la: False
     else: return laSet.__contains__
 
 
+def _toLiteralPred(laSet, heads):
+    if laSet is ANY_ITEM and heads is not None:
+        heads_contains = heads.__contains__
+        return lambda s: heads_contains(s[:1])
+    return _toPred(laSet)
+
+
 class Search(TorqExpressionWithExpr):
     ''' Search(expr) is identical to Repeat(Or(expr, Any()), 0, None). '''
 
-    __slots__ = ['__nodeLAPred', '__literalLAPred']
+    __slots__ = ['__nodeLAPred', '__literalLAPred', '__nodeLASet', '__literalLASet', '__literalLAHeads', '__selective']
 
     def __init__(self, expr):
         self._set_expr(expr)
@@ -568,43 +951,103 @@ class Search(TorqExpressionWithExpr):
     def _calc_mc4la(self):
         exprMc4la = self.expr.getMatchCandidateForLookAhead()
         if exprMc4la is None:
-            self.__nodeLAPred = \
-                    self.__literalLAPred = lambda la: True
+            self.__nodeLASet = self.__literalLASet = ANY_ITEM
+            self.__literalLAHeads = None
         else:
-            self.__nodeLAPred = _toPred(exprMc4la.nodes)
-            self.__literalLAPred = _toPred(exprMc4la.literals)
+            self.__nodeLASet, self.__literalLASet = exprMc4la.nodes, exprMc4la.literals
+            self.__literalLAHeads = exprMc4la.literalHeads if self.__literalLASet is ANY_ITEM else None
+        self.__nodeLAPred = _toPred(self.__nodeLASet)
+        self.__literalLAPred = _toLiteralPred(self.__literalLASet, self.__literalLAHeads)
+        self.__selective = self.__nodeLASet is not ANY_ITEM and self.__literalLASet is not ANY_ITEM
+
+    def _get_lookahead_sets(self):
+        ''' Returns (labels, strings, heads) of items, from which the internal expression is tried.
+            heads is not None only when strings is ANY_ITEM, and then narrows it by s[:1]. (intended to be used internally.) 
+        '''
+        return self.__nodeLASet, self.__literalLASet, self.__literalLAHeads
     
     def updateMatchCandidateForLookAhead(self):
         self.expr.updateMatchCandidateForLookAhead()
         self._calc_mc4la()
         
+    def __candidates(self, inpSeq, inpPos):
+        # when the lookahead is selective, returns positions from which the internal expression is tried.
+        if self.__selective and inpSeq.__class__ is list and len(inpSeq) - inpPos >= _INDEXED_SEARCH_MIN_LENGTH:
+            idx = _get_position_index(inpSeq)
+            if idx is not None:
+                cands = idx.candidates(self.__nodeLASet, self.__literalLASet)
+                if len(cands) * _INDEXED_SEARCH_MAX_DENSITY < len(inpSeq) - inpPos:
+                    return cands
+                # else, scanning items is faster than jumping to so many candidates.
+
+    def __match_with_candidates(self, inpSeq, inpPos, cands):
+        len_inpSeq = len(inpSeq)
+        curInpPos = inpPos
+        runStart = inpPos
+        outSeq = []; o_xt = outSeq.extend
+        len_cands = len(cands)
+        k = _bisect_left(cands, inpPos)
+        while k < len_cands:
+            pos = cands[k]
+            if pos < curInpPos:
+                k = _bisect_left(cands, curInpPos, k)
+                continue  # while
+            lookAhead = inpSeq[pos]
+            if lookAhead.__class__ is list:
+                r = self._expr._match_node(inpSeq, pos, lookAhead)
+            else:
+                r = self._expr._match_lit(inpSeq, pos, (lookAhead, inpSeq[pos + 1]))
+            if r is not None:
+                if runStart < pos: o_xt(inpSeq[runStart:pos])
+                p, o = r
+                o_xt(o)
+                runStart = pos
+                curInpPos = pos + p
+                if p != 0: runStart = curInpPos
+            k += 1
+        curInpPos = len_inpSeq
+        if runStart < curInpPos: o_xt(inpSeq[runStart:curInpPos])
+        r = self._expr._match_eon(inpSeq, curInpPos, None)
+        if r is not None:
+            o_xt(r[1])
+        return curInpPos - inpPos, outSeq
+
     def _match_node(self, inpSeq, inpPos, lookAhead):
+        cands = self.__candidates(inpSeq, inpPos)
+        if cands is not None:
+            return self.__match_with_candidates(inpSeq, inpPos, cands)
         len_inpSeq = len(inpSeq)
         curInpPos = inpPos
-        outSeq = []; o_xt = outSeq.extend; o_ap = outSeq.append
+        runStart = inpPos  # items inpSeq[runStart:curInpPos] are not matched, and will be copied to output with a slice.
+        outSeq = []; o_xt = outSeq.extend
         while curInpPos < len_inpSeq:
             lookAhead = inpSeq[curInpPos]
-            r = None
             if lookAhead.__class__ is list:
                 if self.__nodeLAPred(lookAhead[0]):
                     r = self._expr._match_node(inpSeq, curInpPos, lookAhead)
                     if r is not None:
+                        if runStart < curInpPos: o_xt(inpSeq[runStart:curInpPos])
                         p, o = r
-                        curInpPos += p; o_xt(o)
-                if r is None or p == 0:
-                    o_ap(lookAhead)
-                    curInpPos += 1
+                        o_xt(o)
+                        if p != 0:
+                            curInpPos += p; runStart = curInpPos
+                            continue  # while
+                        runStart = curInpPos
+                curInpPos += 1
             else:
                 #assert lookAhead.__class__ is int #debug
-                lookAheadLiteral = (lookAhead, inpSeq[curInpPos + 1])
-                if self.__literalLAPred(lookAheadLiteral[1]):
-                    r = self._expr._match_lit(inpSeq, curInpPos, lookAheadLiteral)
+                if self.__literalLAPred(inpSeq[curInpPos + 1]):
+                    r = self._expr._match_lit(inpSeq, curInpPos, (lookAhead, inpSeq[curInpPos + 1]))
                     if r is not None:
+                        if runStart < curInpPos: o_xt(inpSeq[runStart:curInpPos])
                         p, o = r
-                        curInpPos += p; o_xt(o)
-                if r is None or p == 0:
-                    o_xt(lookAheadLiteral)
-                    curInpPos += 2
+                        o_xt(o)
+                        if p != 0:
+                            curInpPos += p; runStart = curInpPos
+                            continue  # while
+                        runStart = curInpPos
+                curInpPos += 2
+        if runStart < curInpPos: o_xt(inpSeq[runStart:curInpPos])
         if curInpPos == len_inpSeq:
             r = self._expr._match_eon(inpSeq, curInpPos, None)
             if r is not None:
@@ -617,6 +1060,41 @@ class Search(TorqExpressionWithExpr):
         
     def _match_eon(self, inpSeq, inpPos, lookAhead):
         return self._expr._match_eon(inpSeq, inpPos, lookAhead)
+
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        # a search always reaches the end of the sequence. the internal expression is matched, however,
+        # because it may raise an InterpretError.
+        len_inpSeq = len(inpSeq)
+        cands = self.__candidates(inpSeq, inpPos)
+        if cands is not None:
+            curInpPos = inpPos
+            for pos in cands[_bisect_left(cands, inpPos):]:
+                if pos < curInpPos: continue  # for pos
+                lookAhead = inpSeq[pos]
+                if lookAhead.__class__ is list:
+                    p = self._expr._recognize_node(inpSeq, pos, lookAhead)
+                else:
+                    p = self._expr._recognize_lit(inpSeq, pos, (lookAhead, inpSeq[pos + 1]))
+                if p: curInpPos = pos + p
+            self._expr._recognize_eon(inpSeq, len_inpSeq, None)
+            return len_inpSeq - inpPos
+        curInpPos = inpPos
+        while curInpPos < len_inpSeq:
+            lookAhead = inpSeq[curInpPos]
+            if lookAhead.__class__ is list:
+                p = self._expr._recognize_node(inpSeq, curInpPos, lookAhead) if self.__nodeLAPred(lookAhead[0]) else None
+                curInpPos += p or 1
+            else:
+                lookAheadLiteral = (lookAhead, inpSeq[curInpPos + 1])
+                p = self._expr._recognize_lit(inpSeq, curInpPos, lookAheadLiteral) if self.__literalLAPred(lookAheadLiteral[1]) else None
+                curInpPos += p or 2
+        self._expr._recognize_eon(inpSeq, curInpPos, None)
+        return curInpPos - inpPos
+
+    _recognize_lit = _recognize_node
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAhead):
+        return self._expr._recognize_eon(inpSeq, inpPos, lookAhead)
     
     def getMatchCandidateForLookAhead(self): 
         return _searchingMc4la
@@ -674,6 +1152,8 @@ class Epsilon(TorqExpressionSingleton):
 
     def _match_node(self, inpSeq, inpPos, lookAhead): return _zeroLengthReturnValue
     _match_lit = _match_eon = _match_node
+    def _recognize_node(self, inpSeq, inpPos, lookAhead): return 0
+    _recognize_lit = _recognize_eon = _recognize_node
     def getMatchCandidateForLookAhead(self): return _emptyMc4la
 
 
@@ -684,7 +1164,11 @@ class Any(TorqExpressionSingleton):
     def _match_node(self, inpSeq, inpPos, lookAhead): return 1, [inpSeq[inpPos]]
 
     def _match_lit(self, inpSeq, inpPos, lookAheadString): return 2, lookAheadString
+    def _recognize_node(self, inpSeq, inpPos, lookAhead): return 1
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString): return 2
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy): return None
     def getMatchCandidateForLookAhead(self): return _anyMc4la
+    def _get_item_preds(self): return _anyItemPred, _anyItemPred
 
 
 class Never(TorqExpressionSingleton):
@@ -692,5 +1176,5 @@ class Never(TorqExpressionSingleton):
     __slots__ = []
 
     def _match_node(self, inpSeq, inpPos, lookAhead): return None
-    _match_lit = _match_eon = _match_node
+    _match_lit = _match_eon = _recognize_node = _recognize_lit = _recognize_eon = _match_node
     
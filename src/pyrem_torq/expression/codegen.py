@@ -0,0 +1,508 @@
+#coding: utf-8
+
+from base_expression import *
+from base_expression import _RepeatZeroOrOne, _RepeatOfItem, _zeroLengthReturnValue, _dropLabelScope
+from literal_expression import Literal, LiteralSet, AnyLiteral, Rex
+from node_expression import Relabeled, Flattened, Node, AnyNode, NodeMatch, AnyNodeMatch, InsertNode, BuildToNode, _node_of
+from tricky_expression import Require, RequireBut, EndOfNode, BeginOfNode, AnyBut, Join, _JoinOfItems, BuildToNodeIfYet
+from holder import Holder
+
+
+def _raise_error_expr(message, inpPos):
+    e = InterpretErrorByErrorExpr(message)
+    e.stack.insert(0, inpPos)
+    raise e
+
+
+def _enclose_if_not(newLabel, r):
+    # the same to BuildToNodeIfYet.__enclose_if_not()
+    p, o = r
+    if o.__class__ is not list:
+        o = list(o)
+    if len(o) == 1 and o[0].__class__ is list and len(o[0]) == 2 and o[0][0] == newLabel:
+        return r
+    else:
+        newNode = [newLabel]; newNode.extend(o)
+        return p, [newNode]
+
+
+def _resolve_holder(expr):
+    visitedExprIdSet = set()
+    while expr.__class__ is Holder and expr.memo is None and expr.expr is not None and not expr._needs_seed_growing():
+        if id(expr) in visitedExprIdSet: break  # a cycle made of Holders only
+        visitedExprIdSet.add(id(expr))
+        expr = expr.expr
+    return expr
+
+_inlinableConstTypes = (str, unicode, int, long, bool, type(None))
+
+
+class _PythonCodeGenerator(object):
+    ''' Generates a Python module, which has three functions n<i>, l<i>, e<i> for each expression
+        (corresponding to its methods _match_node, _match_lit, _match_eon).
+        Arguments of the functions are inpSeq (s), inpPos (p) and lookahead (la).
+    '''
+
+    def __init__(self):
+        self.__indexOf = {}
+        self.__exprs = []
+        self.__queue = []
+        self.__lines = []
+        self.__postActions = []
+        self.__namespace = {
+            'InterpretError': InterpretError,
+            'Z': _zeroLengthReturnValue,
+            'RAISE': _raise_error_expr,
+            'ENCLOSE': _enclose_if_not,
+            'NODE_OF': _node_of,
+            'DROP_SCOPE': _dropLabelScope,
+        }
+
+    def index(self, expr):
+        expr = _resolve_holder(expr)
+        i = self.__indexOf.get(id(expr))
+        if i is None:
+            i = len(self.__exprs)
+            self.__indexOf[id(expr)] = i
+            self.__exprs.append(expr)
+            self.__queue.append(expr)
+        return i
+
+    def const(self, value):
+        if value.__class__ in _inlinableConstTypes:
+            return repr(value)
+        name = "K%d" % len(self.__namespace)
+        self.__namespace[name] = value
+        return name
+
+    def emit(self, *lines):
+        self.__lines.extend(lines)
+
+    def post(self, action):
+        self.__postActions.append(action)
+
+    def call(self, kind, expr, s, p, la):
+        ''' Returns a Python expression, which is equivalent to a call expr._match_<kind>(s, p, la).
+            Arguments s, p, la must be names of variables (or constants).
+        '''
+        expr = _resolve_holder(expr)
+        clz = expr.__class__
+        if clz is Epsilon: return "Z"
+        elif clz is Never: return "None"
+        elif clz is Any:
+            return {'n': "(1, [%s[%s]])" % (s, p), 'l': "(2, %s)" % la, 'e': "None"}[kind]
+        elif clz is AnyLiteral:
+            return "(2, %s)" % la if kind == 'l' else "None"
+        elif clz is AnyNode:
+            return "(1, [%s])" % la if kind == 'n' else "None"
+        elif clz is Literal:
+            if kind != 'l': return "None"
+            return "((2, %s) if %s[1] == %s else None)" % (la, la, self.const(expr.string))
+        elif clz is LiteralSet:
+            if kind != 'l': return "None"
+            return "((2, %s) if %s[1] in %s else None)" % (la, la, self.const(expr.strings))
+        elif clz is Rex:
+            if kind != 'l': return "None"
+            return "((2, %s) if %s(%s[1]) else None)" % (la, self.const(expr.pattern.match), la)
+        elif clz is Node:
+            if kind != 'n': return "None"
+            return "((1, [%s]) if %s[0] == %s else None)" % (la, la, self.const(expr.label))
+        elif clz is InsertNode:
+            return "(0, [[%s]])" % self.const(expr.newLabel)
+        elif clz is EndOfNode:
+            return "Z" if kind == 'e' else "None"
+        elif clz is BeginOfNode:
+            return "(Z if %s == 1 else None)" % p if kind != 'e' else "None"
+        return "%s%d(%s, %s, %s)" % (kind, self.index(expr), s, p, la)
+
+    def dispatch(self, indent, expr, s, pos, r, withEon=True):
+        ''' Emits a code, which matches expr at s[pos] and assigns the result to r.
+            The code uses a variable la and, when withEon is True, a variable L (the length of s).
+        '''
+        if withEon:
+            self.emit(indent + "if %s == L: %s = %s" % (pos, r, self.call('e', expr, s, pos, "None")),
+                    indent + "else:")
+            indent += "    "
+        self.emit(indent + "la = %s[%s]" % (s, pos),
+                indent + "if la.__class__ is list: %s = %s" % (r, self.call('n', expr, s, pos, "la")),
+                indent + "else:",
+                indent + "    la = (la, %s[%s + 1])" % (s, pos),
+                indent + "    %s = %s" % (r, self.call('l', expr, s, pos, "la")))
+
+    def generate(self, expr):
+        topIndex = self.index(expr)
+        while self.__queue:
+            e = self.__queue.pop(0)
+            i = self.__indexOf[id(e)]
+            gen = _generators.get(e.__class__)
+            if gen is None:
+                _gen_fallback(self, i, e)
+            else:
+                gen(self, i, e)
+        source = "\n".join(self.__lines) + "\n"
+        ns = self.__namespace
+        exec compile(source, "<pyrem_torq.compile_to_python>", "exec") in ns
+        for action in self.__postActions:
+            action(ns)
+        return source, ns['n%d' % topIndex], ns['l%d' % topIndex], ns['e%d' % topIndex]
+
+
+def _gen_fallback(g, i, expr):
+    # bound when the module is executed, i.e. before the post actions (such as the setup of Or tables) read them
+    k = g.const(expr)
+    g.emit("n%d = %s._match_node" % (i, k),
+            "l%d = %s._match_lit" % (i, k),
+            "e%d = %s._match_eon" % (i, k))
+
+
+def _gen_leaf(g, i, expr):
+    for kind in "nle":
+        g.emit("def %s%d(s, p, la): return %s" % (kind, i, g.call(kind, expr, "s", "p", "la")))
+
+
+def _gen_error_expr(g, i, expr):
+    g.emit("def n%d(s, p, la): RAISE(%s, p)" % (i, g.const(expr.message)),
+            "l%d = e%d = n%d" % (i, i, i))
+
+
+def _gen_or(g, i, expr):
+    ntbl, unknown_nlst, ltbl, htbl, unknown_llst, elst = expr._get_tables()
+
+    def to_indices(exprs): return tuple(g.index(e) for e in exprs)
+    nIndices = dict((k, to_indices(v)) for k, v in ntbl.iteritems())
+    nuIndices = to_indices(unknown_nlst)
+    lIndices = dict((k, to_indices(v)) for k, v in ltbl.iteritems())
+    hIndices = dict((k, to_indices(v)) for k, v in htbl.iteritems())
+    luIndices = to_indices(unknown_llst)
+
+    def setup(ns):
+        def to_funcs(kind, indices): return tuple(ns['%s%d' % (kind, j)] for j in indices)
+        ns['NG%d' % i] = dict((k, to_funcs('n', v)) for k, v in nIndices.iteritems()).get
+        ns['NU%d' % i] = to_funcs('n', nuIndices)
+        ns['LG%d' % i] = dict((k, to_funcs('l', v)) for k, v in lIndices.iteritems()).get
+        ns['HG%d' % i] = dict((k, to_funcs('l', v)) for k, v in hIndices.iteritems()).get
+        ns['LU%d' % i] = to_funcs('l', luIndices)
+    g.post(setup)
+
+    g.emit("def n%d(s, p, la):" % i,
+            "    for f in NG%d(la[0], NU%d):" % (i, i),
+            "        r = f(s, p, la)",
+            "        if r is not None: return r",
+            "def l%d(s, p, la):" % i,
+            "    for f in LG%d(la[1]) or HG%d(la[1][:1], LU%d):" % (i, i, i),
+            "        r = f(s, p, la)",
+            "        if r is not None: return r",
+            "def e%d(s, p, la):" % i)
+    for e in elst:
+        g.emit("    r = %s" % g.call('e', e, "s", "p", "la"),
+                "    if r is not None: return r")
+    g.emit("    return None")
+
+
+def _gen_seq(g, i, expr):
+    exprs = expr.exprs
+    expr0 = exprs[0] if exprs else Epsilon()
+    for kind in "nl":
+        g.emit("def %s%d(s, p, la):" % (kind, i),
+                "    r = %s" % g.call(kind, expr0, "s", "p", "la"),
+                "    if r is None: return None",
+                "    c = p + r[0]; o = r[1]",
+                "    out = o if o.__class__ is list else list(o)")
+        if len(exprs) >= 2:
+            g.emit("    L = len(s)")
+        for e in exprs[1:]:
+            g.dispatch("    ", e, "s", "c", "r")
+            g.emit("    if r is None: return None",
+                    "    c += r[0]; out.extend(r[1])")
+        g.emit("    return c - p, out")
+    g.emit("def e%d(s, p, la):" % i,
+            "    out = []")
+    for e in exprs:
+        g.emit("    r = %s" % g.call('e', e, "s", "p", "la"),
+                "    if r is None: return None",
+                "    out.extend(r[1])")
+    g.emit("    return 0, out")
+
+
+def _gen_repeat(g, i, expr):
+    e = expr.expr
+    lower, upper = expr.lowerLimit, expr.upperLimit
+    g.emit("def n%d(s, p, la):" % i,
+            "    L = len(s)",
+            "    c = p",
+            "    out = []; xt = out.extend",
+            "    ul = %s" % (repr(upper - lower) if upper is not None else "L - p - %d" % lower),
+            "    count = %d" % -lower,
+            "    while count < ul and c < L:")
+    g.dispatch("        ", e, "s", "c", "r", withEon=False)
+    g.emit("        if r is None:",
+            "            if count < 0: return None",
+            "            break",
+            "        q = r[0]",
+            "        if q == 0 and count >= 0: break",
+            "        c += q; xt(r[1])",
+            "        count += 1",
+            "    if c == L and count < 0:",
+            "        r = %s" % g.call('e', e, "s", "p", "None"),
+            "        if r is None: return None",
+            "        o = r[1]",
+            "        if o.__class__ is not list: o = list(o)",
+            "        xt(o * -count)",
+            "    return c - p, out",
+            "l%d = n%d" % (i, i),
+            "def e%d(s, p, la):" % i,
+            "    r = %s" % g.call('e', e, "s", "p", "la"),
+            "    if r is None: return %s" % ("Z" if lower == 0 else "None"))
+    if lower != 0:
+        g.emit("    o = r[1]",
+                "    if o.__class__ is not list: o = list(o)",
+                "    return 0, o * %d" % lower)
+    else:
+        g.emit("    return Z")
+
+
+def _gen_repeat_zero_or_one(g, i, expr):
+    for kind in "nle":
+        g.emit("def %s%d(s, p, la): return %s or Z" % (kind, i, g.call(kind, expr.expr, "s", "p", "la")))
+
+
+def _gen_search(g, i, expr):
+    e = expr.expr
+    nodeSet, literalSet, literalHeads = expr._get_lookahead_sets()
+
+    def pred(laSet, value, heads=None):
+        if laSet is ANY_ITEM and heads is not None: return "%s[:1] in %s" % (value, g.const(heads))
+        elif laSet is ANY_ITEM: return "True"
+        elif len(laSet) == 0: return "False"
+        return "%s in %s" % (value, g.const(laSet))
+    g.emit("def n%d(s, p, la):" % i,
+            "    L = len(s)",
+            "    c = b = p",  # s[b:c] is a run of unmatched items
+            "    out = []; xt = out.extend",
+            "    while c < L:",
+            "        la = s[c]",
+            "        if la.__class__ is list:",
+            "            if %s:" % pred(nodeSet, "la[0]"),
+            "                r = %s" % g.call('n', e, "s", "c", "la"),
+            "                if r is not None:",
+            "                    if b < c: xt(s[b:c])",
+            "                    xt(r[1]); q = r[0]",
+            "                    if q != 0:",
+            "                        c += q; b = c",
+            "                        continue",
+            "                    b = c",
+            "            c += 1",
+            "        else:",
+            "            if %s:" % pred(literalSet, "s[c + 1]", literalHeads),
+            "                la = (la, s[c + 1])",
+            "                r = %s" % g.call('l', e, "s", "c", "la"),
+            "                if r is not None:",
+            "                    if b < c: xt(s[b:c])",
+            "                    xt(r[1]); q = r[0]",
+            "                    if q != 0:",
+            "                        c += q; b = c",
+            "                        continue",
+            "                    b = c",
+            "            c += 2",
+            "    if b < c: xt(s[b:c])",
+            "    if c == L:",
+            "        r = %s" % g.call('e', e, "s", "c", "None"),
+            "        if r is not None: xt(r[1])",
+            "    return c - p, out",
+            "l%d = n%d" % (i, i),
+            "def e%d(s, p, la): return %s" % (i, g.call('e', e, "s", "p", "la")))
+
+
+def _gen_node_match(g, i, expr):
+    e = expr.expr
+    g.emit("def n%d(s, p, la):" % i)
+    if expr.__class__ is NodeMatch:
+        g.emit("    if la[0] != %s: return None" % g.const(expr.label))
+    g.emit("    n = len(la)",
+            "    try:",
+            "        if n == 1: r = %s" % g.call('e', e, "la", "1", "None"),
+            "        else:",
+            "            h = la[1]",
+            "            if h.__class__ is list: r = %s" % g.call('n', e, "la", "1", "h"),
+            "            else:",
+            "                h = (h, la[2])",
+            "                r = %s" % g.call('l', e, "la", "1", "h"),
+            "    except InterpretError, ex:",
+            "        ex.stack.insert(0, p); raise ex",
+            "    if r is None: return None",
+            "    if 1 + r[0] != n: return None",
+            "    return 1, [NODE_OF(la, r[1])]",
+            "def l%d(s, p, la): return None" % i,
+            "e%d = l%d" % (i, i))
+
+
+def _gen_build_to_node(g, i, expr):
+    label = g.const(expr.newLabel)
+    for kind in "nle":
+        g.emit("def %s%d(s, p, la):" % (kind, i),
+                "    r = %s" % g.call(kind, expr.expr, "s", "p", "la"),
+                "    if r:")
+        if expr.drop:
+            g.emit("        return r[0], []")
+        else:
+            g.emit("        if DROP_SCOPE.label == %s: return r[0], []" % label,
+                    "        nn = [%s]; nn.extend(r[1])" % label,
+                    "        return r[0], [nn]")
+
+
+def _gen_build_to_node_if_yet(g, i, expr):
+    label = g.const(expr.newLabel)
+    for kind in "nle":
+        g.emit("def %s%d(s, p, la):" % (kind, i),
+                "    r = %s" % g.call(kind, expr.expr, "s", "p", "la"),
+                "    if r: return ENCLOSE(%s, r)" % label)
+
+
+def _gen_relabeled(g, i, expr):
+    g.emit("def n%d(s, p, la):" % i,
+            "    r = %s" % g.call('n', expr.expr, "s", "p", "la"),
+            "    if r is not None:",
+            "        nn = list(r[1][0])",
+            "        nn[0] = %s" % g.const(expr.newLabel),
+            "        return r[0], [nn]",
+            "def l%d(s, p, la): return None" % i,
+            "e%d = l%d" % (i, i))
+
+
+def _gen_flattened(g, i, expr):
+    g.emit("def n%d(s, p, la):" % i,
+            "    r = %s" % g.call('n', expr.expr, "s", "p", "la"),
+            "    if r is not None:",
+            "        it = iter(r[1][0]); it.next()",
+            "        return r[0], it",
+            "def l%d(s, p, la): return None" % i,
+            "e%d = l%d" % (i, i))
+
+
+def _gen_require(g, i, expr):
+    op = "is not" if expr.__class__ is Require else "is"
+    for kind in "nle":
+        g.emit("def %s%d(s, p, la): return Z if %s %s None else None" % (kind, i, g.call(kind, expr.expr, "s", "p", "la"), op))
+
+
+def _gen_any_but(g, i, expr):
+    e = expr.expr
+    g.emit("def n%d(s, p, la): return (1, (la, )) if %s is None else None" % (i, g.call('n', e, "s", "p", "la")),
+            "def l%d(s, p, la): return (2, la) if %s is None else None" % (i, g.call('l', e, "s", "p", "la")),
+            "def e%d(s, p, la): return None" % i)
+
+
+def _gen_join(g, i, expr):
+    item, sep = expr.itemExpr, expr.sepExpr
+    lower, upper = expr.lowerLimit, expr.upperLimit
+    tail = Seq(sep, item)
+    ii, ti = g.index(item), g.index(tail)
+    g.emit("def n%d(s, p, la):" % i,
+            "    L = len(s)",
+            "    c = p",
+            "    out = []; xt = out.extend",
+            "    ul = %s" % (repr(upper - lower) if upper is not None else "L - p - %d" % lower),
+            "    fn, fl = n%d, l%d" % (ii, ii),
+            "    count = %d" % -lower,
+            "    while count < ul and c < L:",
+            "        la = s[c]",
+            "        if la.__class__ is list: r = fn(s, c, la)",
+            "        else:",
+            "            la = (la, s[c + 1])",
+            "            r = fl(s, c, la)",
+            "        if r is None:",
+            "            if count < 0: return None",
+            "            break",
+            "        q = r[0]",
+            "        if q == 0 and count >= 0: break",
+            "        c += q; xt(r[1])",
+            "        count += 1",
+            "        fn, fl = n%d, l%d" % (ti, ti),
+            "    if c == L and count < 0:",
+            "        r = e%d(s, p, None)" % ti,
+            "        if r is None: return None",
+            "        o = r[1]",
+            "        if o.__class__ is not list: o = list(o)",
+            "        xt(o * -count)",
+            "    return c - p, out",
+            "l%d = n%d" % (i, i),
+            "def e%d(s, p, la):" % i,
+            "    r = e%d(s, p, la)" % ii,
+            "    if r is None: return %s" % ("Z" if lower == 0 else "None"),
+            "    t = e%d(s, p, la)" % ti,
+            "    if t is None: return %s" % ("Z" if lower == 0 else "None"))
+    if lower != 0:
+        g.emit("    o = r[1]; ot = t[1]",
+                "    if o.__class__ is not list: o = list(o)",
+                "    if ot.__class__ is not list: ot = list(ot)",
+                "    return 0, o + ot * %d" % (lower - 1))
+    else:
+        g.emit("    return Z")
+
+_generators = {
+    Epsilon: _gen_leaf, Never: _gen_leaf, Any: _gen_leaf,
+    Literal: _gen_leaf, LiteralSet: _gen_leaf, AnyLiteral: _gen_leaf, Rex: _gen_leaf,
+    Node: _gen_leaf, AnyNode: _gen_leaf, InsertNode: _gen_leaf,
+    EndOfNode: _gen_leaf, BeginOfNode: _gen_leaf,
+    ErrorExpr: _gen_error_expr,
+    Or: _gen_or,
+    Seq: _gen_seq,
+    Repeat: _gen_repeat, _RepeatOfItem: _gen_repeat,
+    _RepeatZeroOrOne: _gen_repeat_zero_or_one,
+    Search: _gen_search,
+    NodeMatch: _gen_node_match, AnyNodeMatch: _gen_node_match,
+    BuildToNode: _gen_build_to_node,
+    BuildToNodeIfYet: _gen_build_to_node_if_yet,
+    Relabeled: _gen_relabeled,
+    Flattened: _gen_flattened,
+    Require: _gen_require, RequireBut: _gen_require,
+    AnyBut: _gen_any_but,
+    Join: _gen_join, _JoinOfItems: _gen_join,
+}
+
+
+class CompiledExpression(TorqExpressionWithExpr):
+    ''' An expression compiled into Python functions by compile_to_python().
+        A CompiledExpression object matches input sequences in the same way as its original expression.
+        The compilation takes a snapshot of the original expression,
+        so modifications of the original expression (e.g. Holder.setexpr()) after the compilation are not reflected.
+    '''
+
+    __slots__ = ['__source', '__match_node_func', '__match_lit_func', '__match_eon_func']
+
+    def __init__(self, expr):
+        self._set_expr(expr)
+        self.__source, self.__match_node_func, self.__match_lit_func, self.__match_eon_func = \
+                _PythonCodeGenerator().generate(expr)
+
+    def getsource(self): return self.__source
+    source = property(getsource)
+
+    def _calc_mc4la(self): pass
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        return self.__match_node_func(inpSeq, inpPos, lookAheadNode)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        return self.__match_lit_func(inpSeq, inpPos, lookAheadString)
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self.__match_eon_func(inpSeq, inpPos, lookAheadDummy)
+
+    def _eq_i(self, right, alreadyComparedExprs):
+        return right.__class__ is CompiledExpression and self.expr._eq_i(right.expr, alreadyComparedExprs)
+
+    def __repr__(self): return "CompiledExpression(%s)" % repr(self.expr)
+    def __hash__(self): return hash("CompiledExpression") + hash(self.expr)
+
+    def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
+
+    def _isLeftRecursive_i(self, target, visitedExprIdSet):
+        return self.expr is target or self.expr._isLeftRecursive_i(target, visitedExprIdSet)
+
+
+def compile_to_python(expr):
+    ''' Compiles an expression (graph) into specialized Python functions, and returns
+        a CompiledExpression object, which can be used in place of the expression.
+    '''
+    return CompiledExpression(expr)
@@ -1,6 +1,11 @@
 #coding: utf-8
 
-from base_expression import TorqExpression, InterpretError, LeftRecursionUndecided
+from base_expression import TorqExpression, TorqExpressionWithExpr, InterpretError, LeftRecursionUndecided
+from memo import Memoized, _to_memo_value
+
+
+# incremented whenever the expr of any Holder is set, since it may change the left recursion of other Holders.
+_exprGeneration = [ 0 ]
 
 
 class _UninterpretableNode(TorqExpression):
@@ -12,6 +17,72 @@ class _UninterpretableNode(TorqExpression):
     def _match_node(self, inpSeq, inpPos, lookAheadNode): self.__raise_error(inpPos)
     _match_lit = _match_eon = _match_node
 
+
+class _TargetDecider(TorqExpression):
+    __slots__ = ['__decide_target']
+
+    def __init__(self, decide_target):
+        self.__decide_target = decide_target
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        return self.__decide_target()._match_node(inpSeq, inpPos, lookAheadNode)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        return self.__decide_target()._match_lit(inpSeq, inpPos, lookAheadString)
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self.__decide_target()._match_eon(inpSeq, inpPos, lookAheadDummy)
+
+
+class _SeedGrower(TorqExpressionWithExpr):
+    ''' Matches the internal expression with seed growing (Warth et al.), in order to accept left recursion.
+        When the expression calls itself at the same position, the inner call fails at first.
+        If such a call is detected, the expression is matched again and again, where the inner call
+        returns the previous result (seed), while the result gets longer.
+    '''
+
+    __slots__ = ['__memo', '__seeds']
+
+    def __init__(self, expr, memo):
+        self.__memo = memo
+        self.__seeds = {}
+        self._set_expr(expr)
+
+    def _calc_mc4la(self): pass
+
+    def __grow(self, match, inpSeq, inpPos, lookAhead):
+        key = id(inpSeq), inpPos
+        seeds = self.__seeds
+        g = seeds.get(key)
+        if g is not None:  # left recursion
+            if not g[1]:
+                g[1] = True
+                # results at this position may depend on the seed from now on.
+                if self.__memo is not None: self.__memo._suspend(key)
+            return g[0]
+        seeds[key] = g = [None, False]  # [seed, left recursion detected]
+        try:
+            r = match(inpSeq, inpPos, lookAhead)
+            if g[1] and r is not None:
+                while True:
+                    g[0] = seed = _to_memo_value(r)
+                    r = match(inpSeq, inpPos, lookAhead)
+                    if r is None or r[0] <= seed[0]: return seed
+            return r
+        finally:
+            del seeds[key]
+            if g[1] and self.__memo is not None: self.__memo._resume(key)
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        return self.__grow(self._expr._match_node, inpSeq, inpPos, lookAheadNode)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        return self.__grow(self._expr._match_lit, inpSeq, inpPos, lookAheadString)
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self.__grow(self._expr._match_eon, inpSeq, inpPos, lookAheadDummy)
+
+
 class Holder(TorqExpression):
     ''' A special expression, which is used as a place holder of an expression.
         A Holder object has two properties: name and expr.
@@ -19,14 +90,23 @@ class Holder(TorqExpression):
         The expr property is an internal expression of the object.
         When evaluated an expression, the object behaves as if it were the internal expression.
         If no internal expression is set, the object raises InterpreterError.
+        When a MemoTable is set to the memo property, results of the internal expression
+        are memoized in the table.
+        A Holder object accepts left recursion (e.g. h.expr = h + Literal('+') + t | t) by seed growing.
+        Whether the seed growing is needed or not is decided when the object is evaluated first
+        after the internal expression of it (or of any Holder) is set.
     '''
 
-    __slots__ = ['__name', '__expr', '__mc4la']
+    __slots__ = ['__name', '__expr', '__mc4la', '__memo', '__target', '__seedGrowing', '__generation']
 
     def __init__(self, name=None):
         self.__name = name
         self.__expr = _UninterpretableNode(self.__raise_error)
         self.__mc4la = None
+        self.__memo = None
+        self.__target = self.__expr
+        self.__seedGrowing = None
+        self.__generation = _exprGeneration[0]
     
     def __repr__(self): return "Holder(name=%s)" % repr(self.__name)
 
@@ -54,14 +134,48 @@ class Holder(TorqExpression):
     
     def setexpr(self, expr):
         if expr is None:
-            self.__expr = _UninterpretableNode(self)
+            self.__expr = _UninterpretableNode(self.__raise_error)
         elif isinstance(expr, TorqExpression):
             self.__expr = expr
         else:
             raise TypeError("Holder.setexpr()'s argument must be an TorqExpression")
+        _exprGeneration[0] += 1
+        self.__update_target()
         self.updateMatchCandidateForLookAhead()
     expr = property(getexpr, setexpr, None)
 
+    def getmemo(self): return self.__memo
+
+    def setmemo(self, memoTable):
+        self.__memo = memoTable
+        self.__update_target()
+    memo = property(getmemo, setmemo, None)
+
+    def __update_target(self):
+        self.__seedGrowing = None
+        self.__generation = _exprGeneration[0]
+        if isinstance(self.__expr, _UninterpretableNode):
+            self.__target = self.__expr
+        else:
+            self.__target = _TargetDecider(self.__decide_target)
+
+    def __decide_target(self):
+        t = self.__expr
+        if self._needs_seed_growing(): t = _SeedGrower(t, self.__memo)
+        if self.__memo is not None: t = Memoized(t, self.__memo)
+        self.__target = t
+        return t
+
+    def _needs_seed_growing(self):
+        ''' Returns True when the internal expression may be left recursive. (intended to be used internally.) '''
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        if self.__seedGrowing is None:
+            try:
+                self.__seedGrowing = not not self.isLeftRecursive()
+            except LeftRecursionUndecided:
+                self.__seedGrowing = True
+        return self.__seedGrowing
+
     def extract_exprs(self): return [self.__expr]
 
     def extract_labels(self):
@@ -86,13 +200,28 @@ class Holder(TorqExpression):
         raise e
     
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
-        return self.__expr._match_node(inpSeq, inpPos, lookAheadNode)
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._match_node(inpSeq, inpPos, lookAheadNode)
     
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
-        return self.__expr._match_lit(inpSeq, inpPos, lookAheadString)
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._match_lit(inpSeq, inpPos, lookAheadString)
 
     def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
-        return self.__expr._match_eon(inpSeq, inpPos, lookAheadDummy)
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._match_eon(inpSeq, inpPos, lookAheadDummy)
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._recognize_node(inpSeq, inpPos, lookAheadNode)
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._recognize_lit(inpSeq, inpPos, lookAheadString)
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        if self.__generation != _exprGeneration[0]: self.__update_target()
+        return self.__target._recognize_eon(inpSeq, inpPos, lookAheadDummy)
 
     def _isLeftRecursive_i(self, target, visitedExprIdSet):
         id_self = id(self)
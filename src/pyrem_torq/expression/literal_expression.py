@@ -1,8 +1,11 @@
 #coding: utf-8
 
 import re
+import sre_parse
+import sre_constants as _sc
 
 from base_expression import TorqExpression, TorqExpressionSingleton, MatchCandidateForLookAhead, ANY_ITEM
+from base_expression import _anyItemPred
 
 
 class Literal(TorqExpression):
@@ -16,11 +19,17 @@ class Literal(TorqExpression):
         self.__string = s
         self.__mc4la = MatchCandidateForLookAhead(literals=(self.__string, ))
 
+    def getstring(self): return self.__string
+    string = property(getstring)
+
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         #assert len(lookAheadString) == 2
         if self.__string == lookAheadString[1]:
             return 2, lookAheadString
         #return None
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self.__string == lookAheadString[1]: return 2
     
     def __repr__(self): return "Literal(%s)" % repr(self.__string)
     def __hash__(self): return hash("Literal") + hash(self.__string)
@@ -29,10 +38,50 @@ class Literal(TorqExpression):
         return [self.__string]
 
     def getMatchCandidateForLookAhead(self): return self.__mc4la
+    def _get_item_preds(self): return None, frozenset([self.__string]).__contains__
 
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is Literal and self.__string == right.__string
 
+
+
+class LiteralSet(TorqExpression):
+    ''' LiteralSet expression matches a sequence of characters, 
+        which is the same to one of the internal strings.
+        LiteralSet(strs) is identical to Or(*map(Literal, strs)).
+    '''
+
+    __slots__ = ['__strings', '__contains', '__mc4la']
+
+    def __init__(self, strs):
+        self.__strings = frozenset(strs)
+        self.__contains = self.__strings.__contains__
+        self.__mc4la = MatchCandidateForLookAhead(literals=self.__strings)
+
+    def getstrings(self): return self.__strings
+    strings = property(getstrings)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        #assert len(lookAheadString) == 2
+        if self.__contains(lookAheadString[1]):
+            return 2, lookAheadString
+        #return None
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self.__contains(lookAheadString[1]): return 2
+    
+    def __repr__(self): return "LiteralSet(%s)" % repr(tuple(sorted(self.__strings)))
+    def __hash__(self): return hash("LiteralSet") + hash(self.__strings)
+    
+    def extract_strings(self):
+        return sorted(self.__strings)
+
+    def getMatchCandidateForLookAhead(self): return self.__mc4la
+    def _get_item_preds(self): return None, self.__contains
+
+    def _eq_i(self, right, alreadyComparedExprs):
+        return right.__class__ is LiteralSet and self.__strings == right.__strings
+
 _anyLiteralMc4la = MatchCandidateForLookAhead(literals=ANY_ITEM)
 
 
@@ -44,21 +93,103 @@ class AnyLiteral(TorqExpressionSingleton):
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         #assert len(lookAheadString) == 2
         return 2, lookAheadString
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString): return 2
     
     def __repr__(self): return "AnyLiteral()"
     def __hash__(self): return hash("AnyLiteral")
     
     def getMatchCandidateForLookAhead(self): return _anyLiteralMc4la
+    def _get_item_preds(self): return None, _anyItemPred
 
 
 class RexCompilationUnable(ValueError):
     pass
 
 
+class _UnknownHeads(Exception):
+    pass
+
+_categoryChars = {
+    _sc.CATEGORY_DIGIT: "0123456789",
+    _sc.CATEGORY_SPACE: " \t\n\r\f\v",
+    _sc.CATEGORY_WORD: "0123456789_abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ",
+}
+_MAX_HEAD_RANGE = 256
+
+
+def _heads_of_items(items):
+    ''' Returns (code points of the characters items may begin with, whether items may match an empty string). '''
+    heads = set()
+    for op, av in items:
+        h, nullable = _heads_of_item(op, av)
+        heads.update(h)
+        if not nullable: return heads, False
+    return heads, True
+
+
+def _heads_of_item(op, av):
+    if op == _sc.LITERAL:
+        return (av,), False
+    elif op == _sc.IN:
+        heads = set()
+        for op2, av2 in av:
+            if op2 == _sc.LITERAL: heads.add(av2)
+            elif op2 == _sc.RANGE:
+                lo, hi = av2
+                if hi - lo >= _MAX_HEAD_RANGE: raise _UnknownHeads()
+                heads.update(xrange(lo, hi + 1))
+            elif op2 == _sc.CATEGORY and av2 in _categoryChars:
+                heads.update(ord(c) for c in _categoryChars[av2])
+            else: raise _UnknownHeads()  # NEGATE, etc.
+        return heads, False
+    elif op == _sc.AT:
+        return (), True
+    elif op == _sc.SUBPATTERN:
+        return _heads_of_items(av[1])
+    elif op == _sc.BRANCH:
+        heads, nullable = set(), False
+        for alt in av[1]:
+            h, n = _heads_of_items(alt)
+            heads.update(h)
+            nullable = nullable or n
+        return heads, nullable
+    elif op in (_sc.MAX_REPEAT, _sc.MIN_REPEAT):
+        lo, hi, sub = av
+        heads, nullable = _heads_of_items(sub)
+        return heads, nullable or lo == 0
+    raise _UnknownHeads()
+
+
+def _rex_literal_heads(exprStr, flags):
+    ''' Returns a set of first characters (s[:1]) of the strings the regex may match, or None if unknown. 
+        Conservative; a regex which may match an empty string may match any string.
+    '''
+    try:
+        p = sre_parse.parse(exprStr, flags)
+        codes, nullable = _heads_of_items(p)
+    except (_UnknownHeads, ValueError, sre_parse.error):
+        return None
+    flags = p.pattern.flags  # including inline flags, e.g. (?i)
+    if nullable or flags & (re.LOCALE | re.UNICODE): return None
+    if flags & re.IGNORECASE:
+        if any(c >= 128 for c in codes): return None
+        codes = set(codes)
+        codes.update([ord(unichr(c).swapcase()) for c in codes])
+    heads = set()
+    for c in codes:
+        if c < 128: heads.add(chr(c))
+        elif c < 256: return None  # would be ambiguous between a byte and a unicode character
+        else:
+            try: heads.add(unichr(c))
+            except ValueError: return None
+    return heads
+
+
 class Rex(TorqExpression):
     ''' Rex expression matches a sequence of characters with the internal regular expression. '''
 
-    __slots__ = ['__expression_match', '__expressionstr', '__ignoreCase']
+    __slots__ = ['__pattern', '__expression_match', '__expressionstr', '__ignoreCase', '__mc4la']
 
     def __init__(self, exprStr, ignoreCase=False):
         try:
@@ -67,9 +198,15 @@ class Rex(TorqExpression):
             pat = re.compile(exprStr, flags)
         except Exception:
             raise RexCompilationUnable("invalid regex string: %s" % repr(exprStr))
+        self.__pattern = pat
         self.__expression_match = pat.match
         self.__expressionstr = exprStr
         self.__ignoreCase = ignoreCase
+        heads = _rex_literal_heads(exprStr, flags)
+        self.__mc4la = MatchCandidateForLookAhead(literals=ANY_ITEM, literalHeads=heads) if heads is not None else _anyLiteralMc4la
+
+    def getpattern(self): return self.__pattern
+    pattern = property(getpattern)
         
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         #assert len(lookAheadString) == 2
@@ -77,11 +214,15 @@ class Rex(TorqExpression):
             return 2, lookAheadString
         #return None
 
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self.__expression_match(lookAheadString[1]): return 2
+
     def __repr__(self): return "Rex(%s,ignoreCase=%s)" % (repr(self.__expressionstr), repr(self.__ignoreCase))
 
     def __hash__(self): return hash("Rex") + hash(self.__expressionstr)
     
-    def getMatchCandidateForLookAhead(self): return _anyLiteralMc4la
+    def getMatchCandidateForLookAhead(self): return self.__mc4la
+    def _get_item_preds(self): return None, self.__expression_match
             
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is Rex and \
@@ -0,0 +1,142 @@
+#coding: utf-8
+
+from collections import deque
+
+from base_expression import TorqExpressionWithExpr, _dropLabelScope
+
+_notFound = object()
+
+
+class MemoTable(object):
+    ''' A table of matching results, which is shared by Memoized expressions.
+        A key of the table is a tuple (expression, kind of lookahead, id of input sequence, input position,
+        dropLabel of the parse).
+        When maxSize is given, the table holds at most maxSize results
+        and evicts the oldest stored results first.
+    '''
+
+    __slots__ = ['__results', '__order', '__seqs', '__maxSize', '__suspended', 'hits', 'misses', 'evictions']
+
+    def __init__(self, maxSize=None):
+        assert maxSize is None or maxSize >= 1
+        self.__maxSize = maxSize
+        self.__results = {}
+        self.__order = deque()
+        self.__seqs = {}
+        self.__suspended = {}
+        self.hits = self.misses = self.evictions = 0
+
+    def getmaxsize(self): return self.__maxSize
+    maxSize = property(getmaxsize)
+
+    def __len__(self): return len(self.__results)
+
+    def clear(self):
+        self.__results.clear()
+        self.__order.clear()
+        self.__seqs.clear()
+        # counters are kept. they are statistics of the table's whole lifetime.
+
+    def lookup(self, key):
+        ''' Returns a result stored with key, or _notFound. '''
+        r = self.__results.get(key, _notFound)
+        if r is _notFound:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return r
+
+    def _suspend(self, seqPos):
+        ''' Stops storing results at a position seqPos = (id(inpSeq), inpPos), till _resume(seqPos) is called. '''
+        suspended = self.__suspended
+        suspended[seqPos] = suspended.get(seqPos, 0) + 1
+
+    def _resume(self, seqPos):
+        suspended = self.__suspended
+        count = suspended[seqPos] - 1
+        if count: suspended[seqPos] = count
+        else: del suspended[seqPos]
+
+    def store(self, key, inpSeq, r):
+        if self.__suspended and key[2:4] in self.__suspended: return
+        results = self.__results
+        if key not in results:
+            # the table refers inpSeq while it has a result of inpSeq,
+            # in order to prevent the id of inpSeq from being reused by other sequence.
+            seqs = self.__seqs
+            sc = seqs.get(key[2])
+            if sc is None: seqs[key[2]] = [inpSeq, 1]
+            else: sc[1] += 1
+            self.__order.append(key)
+            if self.__maxSize is not None and len(results) >= self.__maxSize:
+                oldKey = self.__order.popleft()
+                del results[oldKey]
+                sc = seqs[oldKey[2]]
+                sc[1] -= 1
+                if sc[1] == 0: del seqs[oldKey[2]]
+                self.evictions += 1
+        results[key] = r
+
+    def __repr__(self): return "MemoTable(maxSize=%s)" % repr(self.__maxSize)
+
+
+def _to_memo_value(r):
+    if r is None: return None
+    p, o = r
+    # outputs are stored as tuples, because a caller may extend an output list in place.
+    return p, (o if o.__class__ is tuple else tuple(o))
+
+
+class Memoized(TorqExpressionWithExpr):
+    ''' Memoized(expr, memoTable) behaves as expr, but stores each result of expr in memoTable,
+        and reuses the result when expr is evaluated again at the same position of the same input sequence.
+        Note that memoTable must be cleared whenever an input sequence is modified.
+    '''
+
+    __slots__ = ['__memoTable']
+
+    def __init__(self, expr, memoTable):
+        assert isinstance(memoTable, MemoTable)
+        self.__memoTable = memoTable
+        self._set_expr(expr)
+
+    def getmemotable(self): return self.__memoTable
+    memoTable = property(getmemotable)
+
+    def _calc_mc4la(self): pass
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        key = (id(self), 'n', id(inpSeq), inpPos, _dropLabelScope.label)
+        r = self.__memoTable.lookup(key)
+        if r is _notFound:
+            r = _to_memo_value(self._expr._match_node(inpSeq, inpPos, lookAheadNode))
+            self.__memoTable.store(key, inpSeq, r)
+        return r
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        key = (id(self), 'l', id(inpSeq), inpPos, _dropLabelScope.label)
+        r = self.__memoTable.lookup(key)
+        if r is _notFound:
+            r = _to_memo_value(self._expr._match_lit(inpSeq, inpPos, lookAheadString))
+            self.__memoTable.store(key, inpSeq, r)
+        return r
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        key = (id(self), 'e', id(inpSeq), inpPos, _dropLabelScope.label)
+        r = self.__memoTable.lookup(key)
+        if r is _notFound:
+            r = _to_memo_value(self._expr._match_eon(inpSeq, inpPos, lookAheadDummy))
+            self.__memoTable.store(key, inpSeq, r)
+        return r
+
+    def _eq_i(self, right, alreadyComparedExprs):
+        return right.__class__ is Memoized and self.expr._eq_i(right.expr, alreadyComparedExprs)
+
+    def __repr__(self): return "Memoized(%s)" % repr(self.expr)
+    def __hash__(self): return hash("Memoized") + hash(self.expr)
+
+    def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
+    def updateMatchCandidateForLookAhead(self): self._expr.updateMatchCandidateForLookAhead()
+
+    def _isLeftRecursive_i(self, target, visitedExprIdSet):
+        return self.expr is target or self.expr._isLeftRecursive_i(target, visitedExprIdSet)
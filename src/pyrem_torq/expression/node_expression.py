@@ -1,6 +1,18 @@
 #coding: utf-8
 
 from base_expression import *
+from base_expression import _anyItemPred, _dropLabelScope
+
+
+def _node_of(node, items):
+    ''' Returns a node of node's label and items. When items are equal to node's internal sequence,
+        returns node itself, so that an unchanged subtree is shared between the input and the output.
+    '''
+    if items.__class__ is not list: items = list(items)
+    if len(items) == len(node) - 1 and items == node[1:]:  # shared subtrees are compared by identity
+        return node
+    newNode = [node[0]]; newNode.extend(items)
+    return newNode
 
 
 class EnsuredAcceptSingleNode: pass
@@ -32,11 +44,13 @@ class Relabeled(TorqExpressionWithExpr, NodeModifier):
         if r is not None:
             p, o = r
             assert p == 1
-            newNode = o[0]
-            if not isinstance(newNode, list): newNode = list(newNode)
+            newNode = list(o[0])  # copy, o[0] may be a node of the input
             newNode[0] = self.__newLabel
             return p, [newNode]
 
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is Relabeled and self.expr._eq_i(right.expr, alreadyComparedExprs) and \
                 self.__newLabel == right.__newLabel
@@ -72,6 +86,9 @@ class Flattened(TorqExpressionWithExpr, NodeModifier):
             assert p == 1
             nodeContentIter = iter(o[0]); nodeContentIter.next()
             return p, nodeContentIter
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
         
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is Flattened and self.expr._eq_i(right.expr, alreadyComparedExprs)
@@ -107,6 +124,9 @@ class Node(TorqExpression, EnsuredAcceptSingleNode):
         if lookAheadNode[0] == self.__label:
             return 1, [lookAheadNode]
         #return None
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if lookAheadNode[0] == self.__label: return 1
     
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is Node and self.__label == right.label
@@ -115,6 +135,7 @@ class Node(TorqExpression, EnsuredAcceptSingleNode):
     def __hash__(self): return hash("Node") + hash(self.__label)
     
     def getMatchCandidateForLookAhead(self): return self.__mc4la
+    def _get_item_preds(self): return frozenset([self.__label]).__contains__, None
 
 _anyNodeMc4la = MatchCandidateForLookAhead(nodes=ANY_ITEM)
 
@@ -129,11 +150,30 @@ class AnyNode(TorqExpressionSingleton, EnsuredAcceptSingleNode):
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
         return 1, [lookAheadNode]
 
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode): return 1
+
     def __repr__(self): return "AnyNode()"
     def __hash__(self): return hash("AnyNode")
     
     def getMatchCandidateForLookAhead(self): return _anyNodeMc4la
+    def _get_item_preds(self): return _anyItemPred, None
     
+def _recognize_node_content(expr, inpPos, node):
+    len_node = len(node)
+    try:
+        if len_node == 1:
+            p = expr._recognize_eon(node, 1, None)
+        else:
+            lah = node[1]
+            if lah.__class__ is list:
+                p = expr._recognize_node(node, 1, lah)
+            else:
+                p = expr._recognize_lit(node, 1, (lah, node[2]))
+    except InterpretError, e:
+        e.stack.insert(0, inpPos); raise e
+    if p is not None and 1 + p == len_node: return 1
+
+
 class NodeMatch(TorqExpressionWithExpr, EnsuredAcceptSingleNode):
     ''' NodeMatch expression matches to a length-1 sequence of a node iff 
        - the label of the node is the same to the internal label, and 
@@ -174,9 +214,12 @@ class NodeMatch(TorqExpressionWithExpr, EnsuredAcceptSingleNode):
             e.stack.insert(0, inpPos); raise e
         if r is None: return None
         if 1 + r[0] != len_node: return None
-        newNode = [lookAheadNode[0]]
-        newNode.extend(r[1])
-        return 1, [newNode]
+        return 1, [_node_of(lookAheadNode, r[1])]
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if lookAheadNode[0] != self.__label: 
+            return None
+        return _recognize_node_content(self._expr, inpPos, lookAheadNode)
 
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is NodeMatch and self.__label == right.label and self.expr._eq_i(right.expr, alreadyComparedExprs)
@@ -220,9 +263,10 @@ class AnyNodeMatch(TorqExpressionWithExpr, EnsuredAcceptSingleNode):
             e.stack.insert(0, inpPos); raise e
         if r is None: return None
         if 1 + r[0] != len_node: return None
-        newNode = [lookAheadNode[0]]
-        newNode.extend(r[1])
-        return 1, [newNode]
+        return 1, [_node_of(lookAheadNode, r[1])]
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return _recognize_node_content(self._expr, inpPos, lookAheadNode)
 
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is AnyNodeMatch and self.expr._eq_i(right.expr, alreadyComparedExprs)
@@ -256,6 +300,9 @@ class InsertNode(TorqExpression):
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
         return 0, [[self.__newLabel]]
     _match_lit = _match_eon = _match_node
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode): return 0
+    _recognize_lit = _recognize_eon = _recognize_node
     
     def getMatchCandidateForLookAhead(self): return _insertingMc4la
             
@@ -269,18 +316,23 @@ class BuildToNode(TorqExpressionWithExpr):
     ''' BuildToNode expression matches to a sequence which the internal expression matches.
        When matches, inserts a node at the current position in the output sequence and
        makes the matched sequence to internal sequence of the inserted node. 
+       When drop is True (or newLabel is the dropLabel of parse()), the node is dropped from the output.
     '''
 
-    __slots__ = ['__newLabel']
+    __slots__ = ['__newLabel', '__drop']
 
-    def __init__(self, newLabel, expr):
+    def __init__(self, newLabel, expr, drop=False):
         #assert expr is not None # use Node, instead!
         self._set_expr(expr)
         assert newLabel
         self.__newLabel = newLabel
+        self.__drop = drop
     
     def getnewlabel(self): return self.__newLabel
     newLabel = property(getnewlabel)
+
+    def getdrop(self): return self.__drop
+    drop = property(getdrop)
     
     def _calc_mc4la(self): pass
 
@@ -289,28 +341,42 @@ class BuildToNode(TorqExpressionWithExpr):
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
         r = self._expr._match_node(inpSeq, inpPos, lookAheadNode)
         if r:
+            if self.__drop or self.__newLabel == _dropLabelScope.label: return r[0], []
             newNode = [self.__newLabel]; newNode.extend(r[1])
             return r[0], [newNode]
 
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         r = self._expr._match_lit(inpSeq, inpPos, lookAheadString)
         if r:
+            if self.__drop or self.__newLabel == _dropLabelScope.label: return r[0], []
             newNode = [self.__newLabel]; newNode.extend(r[1])
             return r[0], [newNode]
 
     def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
         r = self._expr._match_eon(inpSeq, inpPos, lookAheadDummy)
         if r:
+            if self.__drop or self.__newLabel == _dropLabelScope.label: return r[0], []
             newNode = [self.__newLabel]; newNode.extend(r[1])
             return r[0], [newNode]
 
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        return self._expr._recognize_lit(inpSeq, inpPos, lookAheadString)
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy)
+
     def _eq_i(self, right, alreadyComparedExprs):
-        return right.__class__ is BuildToNode and self.__newLabel == right.__newLabel and \
+        return right.__class__ is BuildToNode and self.__newLabel == right.__newLabel and self.__drop == right.__drop and \
                 self.expr._eq_i(right.expr, alreadyComparedExprs)
 
-    def __repr__(self): return "BuildToNode(%s,%s)" % (repr(self.__newLabel), repr(self.expr))
+    def __repr__(self):
+        if self.__drop: return "BuildToNode(%s,%s,drop=True)" % (repr(self.__newLabel), repr(self.expr))
+        return "BuildToNode(%s,%s)" % (repr(self.__newLabel), repr(self.expr))
 
-    def __hash__(self): return hash("BuildToNode") + hash(self.__newLabel) + hash(self.expr)
+    def __hash__(self): return hash("BuildToNode") + hash(self.__newLabel) + hash(self.expr) + hash(self.__drop)
 
     def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
     def updateMatchCandidateForLookAhead(self): self._expr.updateMatchCandidateForLookAhead()
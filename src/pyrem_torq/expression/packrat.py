@@ -0,0 +1,86 @@
+#coding: utf-8
+
+from base_expression import TorqExpressionWithExpr, inner_expr_iter
+from holder import Holder
+from memo import MemoTable
+
+
+class Packrat(TorqExpressionWithExpr):
+    ''' Packrat(expr, holders=None, maxSize=None) behaves as expr, but does packrat parsing,
+        that is, memoizes results of Holder objects in expr.
+        holders specifies the Holder objects to be memoized.
+        If holders is None, all Holder objects reachable from expr will be memoized.
+        maxSize is a max number of results stored in the memo table (None means unlimited).
+        The memoization is active only while match(), recognize() or parse() of the Packrat object is running,
+        and the memo table is cleared at each call of them.
+    '''
+
+    __slots__ = ['__holders', '__memoTable']
+
+    def __init__(self, expr, holders=None, maxSize=None):
+        self._set_expr(expr)
+        if holders is None:
+            holders = []
+            holderIds = set()
+            for e in ([expr] + list(inner_expr_iter(expr))):
+                if e.__class__ is Holder and id(e) not in holderIds:
+                    holderIds.add(id(e))
+                    holders.append(e)
+        for h in holders:
+            if not isinstance(h, Holder): raise TypeError("Packrat()'s argument holders must be Holder objects")
+        self.__holders = tuple(holders)
+        self.__memoTable = MemoTable(maxSize)
+
+    def getholders(self): return list(self.__holders)
+    holders = property(getholders)
+
+    def getmemotable(self): return self.__memoTable
+    memoTable = property(getmemotable)
+
+    def _calc_mc4la(self): pass
+
+    def __call_with_memo(self, func, inpSeq, inpPos):
+        holders = self.__holders
+        savedMemos = [h.memo for h in holders]
+        for h in holders: h.memo = self.__memoTable
+        try:
+            return func(self, inpSeq, inpPos)
+        finally:
+            for h, m in zip(holders, savedMemos): h.memo = m
+            self.__memoTable.clear()
+
+    def match(self, inpSeq, inpPos):
+        return self.__call_with_memo(TorqExpressionWithExpr.match, inpSeq, inpPos)
+
+    def recognize(self, inpSeq, inpPos):
+        return self.__call_with_memo(TorqExpressionWithExpr.recognize, inpSeq, inpPos)
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._match_node(inpSeq, inpPos, lookAheadNode)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        return self._expr._match_lit(inpSeq, inpPos, lookAheadString)
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self._expr._match_eon(inpSeq, inpPos, lookAheadDummy)
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        return self._expr._recognize_lit(inpSeq, inpPos, lookAheadString)
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy)
+
+    def _eq_i(self, right, alreadyComparedExprs):
+        return right.__class__ is Packrat and self.expr._eq_i(right.expr, alreadyComparedExprs)
+
+    def __repr__(self): return "Packrat(%s)" % repr(self.expr)
+    def __hash__(self): return hash("Packrat") + hash(self.expr)
+
+    def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
+    def updateMatchCandidateForLookAhead(self): self._expr.updateMatchCandidateForLookAhead()
+
+    def _isLeftRecursive_i(self, target, visitedExprIdSet):
+        return self.expr is target or self.expr._isLeftRecursive_i(target, visitedExprIdSet)
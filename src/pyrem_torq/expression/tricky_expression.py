@@ -1,6 +1,7 @@
 #coding: utf-8
 
 from base_expression import *
+from base_expression import _union_heads, _anyItemPred
 
 _zeroLengthReturnValue = 0, ()
 _emptyMc4la = MatchCandidateForLookAhead(emptyseq=True)
@@ -19,13 +20,22 @@ class Require(TorqExpressionWithExpr):
     def _calc_mc4la(self): pass
     
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
-        if self._expr._match_node(inpSeq, inpPos, lookAheadNode) is not None: return _zeroLengthReturnValue
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is not None: return _zeroLengthReturnValue
 
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
-        if self._expr._match_lit(inpSeq, inpPos, lookAheadString) is not None: return _zeroLengthReturnValue
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is not None: return _zeroLengthReturnValue
 
     def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
-        if self._expr._match_eon(inpSeq, inpPos, lookAheadDummy) is not None: return _zeroLengthReturnValue
+        if self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is not None: return _zeroLengthReturnValue
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is not None: return 0
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is not None: return 0
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        if self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is not None: return 0
     
     def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
     def updateMatchCandidateForLookAhead(self): self._expr.updateMatchCandidateForLookAhead()
@@ -50,13 +60,22 @@ class RequireBut(TorqExpressionWithExpr):
         self._set_expr(expr)
     
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
-        if self._expr._match_node(inpSeq, inpPos, lookAheadNode) is None: return _zeroLengthReturnValue
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is None: return _zeroLengthReturnValue
 
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
-        if self._expr._match_lit(inpSeq, inpPos, lookAheadString) is None: return _zeroLengthReturnValue
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is None: return _zeroLengthReturnValue
     
     def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
-        if self._expr._match_eon(inpSeq, inpPos, lookAheadDummy) is None: return _zeroLengthReturnValue
+        if self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None: return _zeroLengthReturnValue
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is None: return 0
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is None: return 0
+    
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        if self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None: return 0
 
     def getMatchCandidateForLookAhead(self): return _emptyMc4la
     def updateMatchCandidateForLookAhead(self): pass
@@ -80,6 +99,7 @@ class EndOfNode(TorqExpressionSingleton):
     __slots__ = []
 
     def _match_eon(self, inpSeq, curInpPos, lookAheadDummy): return _zeroLengthReturnValue
+    def _recognize_eon(self, inpSeq, curInpPos, lookAheadDummy): return 0
 
     def getMatchCandidateForLookAhead(self): return _emptyMc4la
 
@@ -98,6 +118,11 @@ class BeginOfNode(TorqExpressionSingleton):
         
     _match_lit = _match_node
 
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        if inpPos == 1: return 0
+
+    _recognize_lit = _recognize_node
+
     def getMatchCandidateForLookAhead(self): 
         return _insertingMc4la
 
@@ -115,15 +140,26 @@ class AnyBut(TorqExpressionWithExpr):
     def _calc_mc4la(self): pass
     
     def _match_node(self, inpSeq, inpPos, lookAheadNode):
-        if self._expr._match_node(inpSeq, inpPos, lookAheadNode) is None:
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is None:
             return 1, (lookAheadNode, )
 
     def _match_lit(self, inpSeq, inpPos, lookAheadString):
         #assert len(lookAheadString) == 2
-        if self._expr._match_lit(inpSeq, inpPos, lookAheadString) is None: 
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is None: 
             return 2, lookAheadString
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        if self._expr._recognize_node(inpSeq, inpPos, lookAheadNode) is None: return 1
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        if self._expr._recognize_lit(inpSeq, inpPos, lookAheadString) is None: return 2
         
     def getMatchCandidateForLookAhead(self): return _atLeastOneItemMc4la
+
+    def _get_item_preds(self):
+        preds = self._expr._get_item_preds()
+        if preds is not None:
+            return tuple(_anyItemPred if pred is None else (lambda item, pred=pred: not pred(item)) for pred in preds)
     
     def _isLeftRecursive_i(self, target, visitedExprIdSet):
         id_self = id(self)
@@ -143,6 +179,12 @@ class Join(TorqExpression):
 
     __slots__ = ['__lowerLimit', '__upperLimit', '__mc4la', '_itemExpr', '__sepExpr', '__tailExpr']
 
+    def __new__(cls, sepExpr=None, itemExpr=None, lowerLimit=0, upperLimit=None):
+        if cls is Join and sepExpr is not None and itemExpr is not None and \
+                sepExpr._get_item_preds() is not None and itemExpr._get_item_preds() is not None:
+            cls = _JoinOfItems
+        return TorqExpression.__new__(cls)
+
     def __init__(self, sepExpr, itemExpr, lowerLimit, upperLimit):
         assert lowerLimit >= 0
         assert upperLimit is None or upperLimit >= lowerLimit
@@ -154,6 +196,18 @@ class Join(TorqExpression):
     def extract_exprs(self):
         return [self._itemExpr, self.__sepExpr]
 
+    def getitemexpr(self): return self._itemExpr
+    itemExpr = property(getitemexpr)
+
+    def getsepexpr(self): return self.__sepExpr
+    sepExpr = property(getsepexpr)
+
+    def getlowerlimit(self): return self.__lowerLimit
+    lowerLimit = property(getlowerlimit)
+
+    def getupperlimit(self): return self.__upperLimit
+    upperLimit = property(getupperlimit)
+
     def _calc_mc4la(self):
         self.__tailExpr = Seq(self.__sepExpr, self._itemExpr)
         mc4laItem = self._itemExpr.getMatchCandidateForLookAhead()
@@ -169,7 +223,8 @@ class Join(TorqExpression):
                 else:
                     m = MatchCandidateForLookAhead(nodes=mc4laItem.nodes | mc4laSep.nodes,
                         literals=mc4laItem.literals | mc4laSep.literals,
-                        emptyseq=mc4laItem.emptyseq or mc4laSep.emptyseq)
+                        emptyseq=mc4laItem.emptyseq or mc4laSep.emptyseq,
+                        literalHeads=_union_heads(mc4laItem.literalHeads, mc4laSep.literalHeads))
                     self.__mc4la = m.modified(emptyseq=self.__lowerLimit == 0)
     
     def updateMatchCandidateForLookAhead(self):
@@ -233,12 +288,44 @@ class Join(TorqExpression):
             if oTail.__class__ is not list: oTail = list(oTail)
             return 0, oItem + oTail * (self.__lowerLimit - 1)
         return _zeroLengthReturnValue
+
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        len_inpSeq = len(inpSeq)
+        curInpPos = inpPos
+        ul = self.__upperLimit if self.__upperLimit is not None else (len_inpSeq - inpPos)
+        expr = self._itemExpr
+        count = 0 - self.__lowerLimit
+        ul -= self.__lowerLimit
+        while count < ul and curInpPos < len_inpSeq:
+            lookAhead = inpSeq[curInpPos]
+            if lookAhead.__class__ is list:
+                p = expr._recognize_node(inpSeq, curInpPos, lookAhead)
+            else:
+                p = expr._recognize_lit(inpSeq, curInpPos, (lookAhead, inpSeq[curInpPos + 1]))
+            if p is None:
+                if count < 0: return None
+                break  # for count
+            if p == 0 and count >= 0: break  # in order to avoid infinite loop
+            curInpPos += p
+            count += 1
+            expr = self.__tailExpr
+        if curInpPos == len_inpSeq and count < 0:
+            if self.__tailExpr._recognize_eon(inpSeq, inpPos, None) is None: return None
+        return curInpPos - inpPos
+
+    _recognize_lit = _recognize_node
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        if self._itemExpr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None or \
+                self.__tailExpr._recognize_eon(inpSeq, inpPos, lookAheadDummy) is None:
+            return 0 if self.__lowerLimit == 0 else None
+        return 0
     
     def _eq_i(self, right, alreadyComparedExprs):
-        return right.__class__ is Join and \
+        return isinstance(right, Join) and \
                 self.__lowerLimit == right.__lowerLimit and self.__upperLimit == right.__upperLimit and \
                 self._itemExpr._eq_i(right._itemExpr, alreadyComparedExprs) and \
-                self.__seqExpr._eq_i(right.__seqExpr, alreadyComparedExprs)
+                self.__sepExpr._eq_i(right.__sepExpr, alreadyComparedExprs)
 
     def __repr__(self):
         return "Join(%s,%s,%s,%s)" % (repr(self.__sepExpr), (self._itemExpr), repr(self.__lowerLimit), repr(self.__upperLimit))
@@ -262,11 +349,79 @@ class Join(TorqExpression):
         if id_self in visitedExprIdSet:
             return False
         visitedExprIdSet.add(id_self)
-        if self._itemExpr.getMatchCandidateForLookAhead().emptyseq:
+        mc4laItem = self._itemExpr.getMatchCandidateForLookAhead()
+        if mc4laItem is None:
+            raise LeftRecursionUndecided(repr(self._itemExpr))
+        if mc4laItem.emptyseq:
             return self._itemExpr is target or self.__sepExpr is target or \
-                    self._itemExpr._isLeftRecursive_i(target, visitedExprIdSet) or self.__seqExpr._isLeftRecursive_i(target, visitedExprIdSet)
+                    self._itemExpr._isLeftRecursive_i(target, visitedExprIdSet) or self.__sepExpr._isLeftRecursive_i(target, visitedExprIdSet)
+        else:
+            return self._itemExpr is target or self._itemExpr._isLeftRecursive_i(target, visitedExprIdSet)
+
+
+def _item_length(inpSeq, pos, len_inpSeq, preds):
+    # returns the length of the item at pos, if the item satisfies preds. otherwise, returns 0.
+    if pos < len_inpSeq:
+        item = inpSeq[pos]
+        if item.__class__ is list:
+            nodePred = preds[0]
+            if nodePred is not None and nodePred(item[0]): return 1
         else:
-            return self._itemExpr is target or self.__expr._isLeftRecursive_i(target, visitedExprIdSet)
+            literalPred = preds[1]
+            if literalPred is not None and literalPred(inpSeq[pos + 1]): return 2
+    return 0
+
+
+class _JoinOfItems(Join):
+    ''' Join of expressions which match just one item, e.g. Join(Literal(','), Rex(r"^\d"), 1, None).
+        Tests the items with the predicates of the expressions directly, and outputs the matched items with a slice.
+        Join(sepExpr, itemExpr, ...) returns an object of this class, when both _get_item_preds() are available.
+    '''
+
+    __slots__ = ['__sepPreds', '__itemPreds', '__lowerLimit', '__upperLimit']
+
+    def __init__(self, sepExpr, itemExpr, lowerLimit, upperLimit):
+        Join.__init__(self, sepExpr, itemExpr, lowerLimit, upperLimit)
+        self.__sepPreds = sepExpr._get_item_preds()
+        self.__itemPreds = itemExpr._get_item_preds()
+        self.__lowerLimit = lowerLimit
+        self.__upperLimit = upperLimit if upperLimit is not None else -1  # count never reaches -1
+
+    def __match_end(self, inpSeq, inpPos):
+        # returns the position where the join ends, or None.
+        sepPreds, itemPreds = self.__sepPreds, self.__itemPreds
+        len_inpSeq = len(inpSeq)
+        ul = self.__upperLimit
+        curInpPos = inpPos
+        count = 0
+        if count != ul:
+            q = _item_length(inpSeq, curInpPos, len_inpSeq, itemPreds)
+            if q:
+                curInpPos += q
+                count += 1
+                while count != ul:
+                    s = _item_length(inpSeq, curInpPos, len_inpSeq, sepPreds)
+                    if not s: break  # while
+                    q = _item_length(inpSeq, curInpPos + s, len_inpSeq, itemPreds)
+                    if not q: break  # while
+                    curInpPos += s + q
+                    count += 1
+        if count < self.__lowerLimit: return None
+        return curInpPos
+
+    def _match_node(self, inpSeq, inpPos, lookAhead):
+        end = self.__match_end(inpSeq, inpPos)
+        if end is not None:
+            return end - inpPos, inpSeq[inpPos:end]
+
+    _match_lit = _match_node
+
+    def _recognize_node(self, inpSeq, inpPos, lookAhead):
+        end = self.__match_end(inpSeq, inpPos)
+        if end is not None:
+            return end - inpPos
+
+    _recognize_lit = _recognize_node
 
 
 class BuildToNodeIfYet(TorqExpressionWithExpr):
@@ -315,6 +470,15 @@ class BuildToNodeIfYet(TorqExpressionWithExpr):
         r = self._expr._match_eon(inpSeq, inpPos, lookAheadDummy)
         if r:
             return self.__enclose_if_not(r)
+
+    def _recognize_node(self, inpSeq, inpPos, lookAheadNode):
+        return self._expr._recognize_node(inpSeq, inpPos, lookAheadNode)
+
+    def _recognize_lit(self, inpSeq, inpPos, lookAheadString):
+        return self._expr._recognize_lit(inpSeq, inpPos, lookAheadString)
+
+    def _recognize_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self._expr._recognize_eon(inpSeq, inpPos, lookAheadDummy)
     
     def _eq_i(self, right, alreadyComparedExprs):
         return right.__class__ is BuildToNodeIfYet and self.__newLabel == right.__newLabel and \
@@ -0,0 +1,507 @@
+#coding: utf-8
+
+from array import array
+
+from base_expression import *
+from base_expression import _RepeatZeroOrOne, _zeroLengthReturnValue, _toPred, _toLiteralPred, _dropLabelScope
+from literal_expression import Literal, LiteralSet, AnyLiteral, Rex
+from node_expression import Relabeled, Flattened, Node, AnyNode, NodeMatch, AnyNodeMatch, InsertNode, BuildToNode, _node_of
+from tricky_expression import Require, RequireBut, EndOfNode, BeginOfNode, AnyBut, Join, BuildToNodeIfYet
+from codegen import _resolve_holder, _raise_error_expr, _enclose_if_not
+
+# kinds of a lookahead. the same order to the arguments of a fallback (_match_node, _match_lit, _match_eon).
+_NODE, _LIT, _EON = 0, 1, 2
+
+# a frame is a list [step function, operand, kind, inpSeq, inpPos, lookahead, state, outSeq, curInpPos, count/runStart]
+_FRAME_STEP, _FRAME_STATE = 0, 6
+
+#
+# leaf instructions. each of them returns a result of matching immediately.
+#
+
+def _leaf_epsilon(operand, kind, s, p, la): return _zeroLengthReturnValue
+def _leaf_never(operand, kind, s, p, la): return None
+
+def _leaf_any(operand, kind, s, p, la):
+    if kind == _NODE: return 1, [s[p]]
+    elif kind == _LIT: return 2, la
+
+def _leaf_any_literal(operand, kind, s, p, la):
+    if kind == _LIT: return 2, la
+
+def _leaf_literal(string, kind, s, p, la):
+    if kind == _LIT and la[1] == string: return 2, la
+
+def _leaf_literal_set(contains, kind, s, p, la):
+    if kind == _LIT and contains(la[1]): return 2, la
+
+def _leaf_rex(match, kind, s, p, la):
+    if kind == _LIT and match(la[1]): return 2, la
+
+def _leaf_node(label, kind, s, p, la):
+    if kind == _NODE and la[0] == label: return 1, [la]
+
+def _leaf_any_node(operand, kind, s, p, la):
+    if kind == _NODE: return 1, [la]
+
+def _leaf_insert_node(label, kind, s, p, la): return 0, [[label]]
+
+def _leaf_end_of_node(operand, kind, s, p, la):
+    if kind == _EON: return _zeroLengthReturnValue
+
+def _leaf_begin_of_node(operand, kind, s, p, la):
+    if kind != _EON and p == 1: return _zeroLengthReturnValue
+
+def _leaf_error(message, kind, s, p, la): _raise_error_expr(message, p)
+
+def _leaf_fallback(matchFuncs, kind, s, p, la): return matchFuncs[kind](s, p, la)
+
+#
+# composite instructions. each of them runs as a frame, and is resumed with a result of the child.
+# a step function returns a new frame to call a child, or a result of matching.
+#
+
+def _step_unary(vm, f, r):
+    child, kinds, post, postOperand = f[1]
+    if f[6] == 0:
+        kind = f[2]
+        if kinds is not None and kind not in kinds: return None
+        r = vm.enter(child, kind, f[3], f[4], f[5])
+        if r.__class__ is list:
+            f[6] = 1; return r
+    return post(postOperand, f, r)
+
+def _post_build_to_node(newLabel, f, r):
+    if r:
+        if newLabel == _dropLabelScope.label: return r[0], []
+        newNode = [newLabel]; newNode.extend(r[1])
+        return r[0], [newNode]
+
+def _post_drop(operand, f, r):
+    if r: return r[0], []
+
+def _post_build_to_node_if_yet(newLabel, f, r):
+    if r: return _enclose_if_not(newLabel, r)
+
+def _post_relabeled(newLabel, f, r):
+    if r is not None:
+        newNode = list(r[1][0])
+        newNode[0] = newLabel
+        return r[0], [newNode]
+
+def _post_flattened(operand, f, r):
+    if r is not None:
+        nodeContentIter = iter(r[1][0]); nodeContentIter.next()
+        return r[0], nodeContentIter
+
+def _post_require(operand, f, r):
+    if r is not None: return _zeroLengthReturnValue
+
+def _post_require_but(operand, f, r):
+    if r is None: return _zeroLengthReturnValue
+
+def _post_zero_or_one(operand, f, r): return r or _zeroLengthReturnValue
+
+def _post_any_but(operand, f, r):
+    if r is None:
+        return (1, (f[5], )) if f[2] == _NODE else (2, f[5])
+
+def _step_or(vm, f, r):
+    # candidates have been picked by _StackMachine.enter().
+    k = f[6]
+    if k != 0 and r is not None: return r
+    candidates, kind, s, p, la = f[7], f[2], f[3], f[4], f[5]
+    enter = vm.enter
+    len_candidates = len(candidates)
+    while k < len_candidates:
+        r = enter(candidates[k], kind, s, p, la)
+        k += 1
+        if r.__class__ is list:
+            f[6] = k; return r
+        if r is not None: return r
+    return None
+
+def _step_seq(vm, f, r):
+    exprs = f[1]
+    len_exprs = len(exprs)
+    if len_exprs == 0: return 0, []
+    kind, s, p = f[2], f[3], f[4]
+    k = f[6]
+    if k == 0:
+        r = vm.enter(exprs[0], kind, s, p, f[5])
+        k = 1
+        if r.__class__ is list:
+            f[6] = 1; return r
+    else:
+        outSeq, curInpPos = f[7], f[8]
+    len_inpSeq = len(s)
+    while True:
+        # here, r is a result of exprs[k - 1]
+        if r is None: return None
+        if k == 1:
+            o = r[1]
+            outSeq = o if o.__class__ is list else list(o)
+            curInpPos = p + r[0]
+        else:
+            curInpPos += r[0]; outSeq.extend(r[1])
+        if k == len_exprs: return curInpPos - p, outSeq
+        r = vm.enter(exprs[k], _EON, s, p, None) if kind == _EON else vm.enter_at(exprs[k], s, curInpPos, len_inpSeq)
+        k += 1
+        if r.__class__ is list:
+            f[6] = k; f[7] = outSeq; f[8] = curInpPos; return r
+
+# states of a repetition frame
+_REP_START, _REP_LOOP, _REP_TAIL_EON, _EON_FIRST, _EON_REST = 0, 1, 2, 3, 4
+
+def _step_repetition(vm, f, r):
+    # Repeat(expr, lower, upper) is run as a repetition of (expr, expr, lower, upper),
+    # Join(sep, item, lower, upper) as (item, Seq(sep, item), lower, upper).
+    first, rest, lowerLimit, upperLimit = f[1]
+    s, p = f[3], f[4]
+    state = f[6]
+    if f[2] == _EON:
+        if state == _REP_START:
+            r = vm.enter(first, _EON, s, p, f[5])
+            if r.__class__ is list:
+                f[6] = _EON_FIRST; return r
+            state = _EON_FIRST
+        if state == _EON_FIRST:
+            if r is None: return _zeroLengthReturnValue if lowerLimit == 0 else None
+            f[7] = r
+            if rest != first:
+                r = vm.enter(rest, _EON, s, p, f[5])
+                if r.__class__ is list:
+                    f[6] = _EON_REST; return r
+        # state == _EON_REST
+        if r is None: return _zeroLengthReturnValue if lowerLimit == 0 else None
+        if lowerLimit != 0:
+            oFirst, oRest = f[7][1], r[1]
+            if oFirst.__class__ is not list: oFirst = list(oFirst)
+            if oRest.__class__ is not list: oRest = list(oRest)
+            return 0, oFirst + oRest * (lowerLimit - 1)
+        return _zeroLengthReturnValue
+
+    len_inpSeq = len(s)
+    if state == _REP_START:
+        outSeq = []; curInpPos = p; count = 0 - lowerLimit
+    else:
+        outSeq, curInpPos, count = f[7], f[8], f[9]
+    if state == _REP_TAIL_EON:
+        if r is None: return None
+        o = r[1]
+        if o.__class__ is not list: o = list(o)
+        outSeq.extend(o * -count)
+        return curInpPos - p, outSeq
+
+    ul = (upperLimit if upperLimit is not None else (len_inpSeq - p)) - lowerLimit
+    looping = True
+    if state == _REP_LOOP:
+        if r is None:
+            if count < 0: return None
+            looping = False
+        else:
+            q = r[0]
+            if q == 0 and count >= 0:
+                looping = False
+            else:
+                curInpPos += q; outSeq.extend(r[1])
+                count += 1
+    if looping:
+        enter = vm.enter
+        while count < ul and curInpPos < len_inpSeq:
+            expr = first if count == -lowerLimit else rest
+            la = s[curInpPos]
+            if la.__class__ is list:
+                r = enter(expr, _NODE, s, curInpPos, la)
+            else:
+                r = enter(expr, _LIT, s, curInpPos, (la, s[curInpPos + 1]))
+            if r.__class__ is list:
+                f[6] = _REP_LOOP; f[7] = outSeq; f[8] = curInpPos; f[9] = count; return r
+            if r is None:
+                if count < 0: return None
+                break  # while
+            q = r[0]
+            if q == 0 and count >= 0: break  # in order to avoid infinite loop
+            curInpPos += q; outSeq.extend(r[1])
+            count += 1
+    if curInpPos == len_inpSeq and count < 0:
+        r = vm.enter(rest, _EON, s, p, None)
+        if r.__class__ is list:
+            f[6] = _REP_TAIL_EON; f[7] = outSeq; f[8] = curInpPos; f[9] = count; return r
+        if r is None: return None
+        o = r[1]
+        if o.__class__ is not list: o = list(o)
+        outSeq.extend(o * -count)
+    return curInpPos - p, outSeq
+
+# states of a search frame
+_SEARCH_START, _SEARCH_NODE, _SEARCH_LIT, _SEARCH_EON = 0, 1, 2, 3
+
+def _step_search(vm, f, r):
+    expr, nodeLAPred, literalLAPred = f[1]
+    s, p = f[3], f[4]
+    state = f[6]
+    if f[2] == _EON:
+        if state == _SEARCH_START:
+            r = vm.enter(expr, _EON, s, p, f[5])
+            if r.__class__ is list:
+                f[6] = _SEARCH_EON; return r
+        return r
+
+    len_inpSeq = len(s)
+    if state == _SEARCH_START:
+        outSeq = []; curInpPos = runStart = p
+    else:
+        outSeq, curInpPos, runStart = f[7], f[8], f[9]
+        if state == _SEARCH_EON:
+            if r is not None: outSeq.extend(r[1])
+            return curInpPos - p, outSeq
+        step = 1 if state == _SEARCH_NODE else 2
+        if r is not None:
+            if runStart < curInpPos: outSeq.extend(s[runStart:curInpPos])
+            outSeq.extend(r[1])
+            q = r[0]
+            if q != 0:
+                curInpPos += q; runStart = curInpPos
+            else:
+                runStart = curInpPos; curInpPos += step
+        else:
+            curInpPos += step
+    enter = vm.enter
+    while curInpPos < len_inpSeq:
+        la = s[curInpPos]
+        if la.__class__ is list:
+            if nodeLAPred(la[0]):
+                r = enter(expr, _NODE, s, curInpPos, la)
+                if r.__class__ is list:
+                    f[6] = _SEARCH_NODE; f[7] = outSeq; f[8] = curInpPos; f[9] = runStart; return r
+                if r is not None:
+                    if runStart < curInpPos: outSeq.extend(s[runStart:curInpPos])
+                    outSeq.extend(r[1])
+                    q = r[0]
+                    if q != 0:
+                        curInpPos += q; runStart = curInpPos
+                        continue  # while
+                    runStart = curInpPos
+            curInpPos += 1
+        else:
+            if literalLAPred(s[curInpPos + 1]):
+                r = enter(expr, _LIT, s, curInpPos, (la, s[curInpPos + 1]))
+                if r.__class__ is list:
+                    f[6] = _SEARCH_LIT; f[7] = outSeq; f[8] = curInpPos; f[9] = runStart; return r
+                if r is not None:
+                    if runStart < curInpPos: outSeq.extend(s[runStart:curInpPos])
+                    outSeq.extend(r[1])
+                    q = r[0]
+                    if q != 0:
+                        curInpPos += q; runStart = curInpPos
+                        continue  # while
+                    runStart = curInpPos
+            curInpPos += 2
+    if runStart < curInpPos: outSeq.extend(s[runStart:curInpPos])
+    if curInpPos == len_inpSeq:
+        r = enter(expr, _EON, s, curInpPos, None)
+        if r.__class__ is list:
+            f[6] = _SEARCH_EON; f[7] = outSeq; f[8] = curInpPos; return r
+        if r is not None: outSeq.extend(r[1])
+    return curInpPos - p, outSeq
+
+def _step_node_match(vm, f, r):
+    label, expr = f[1]
+    node = f[5]
+    if f[6] == 0:
+        if f[2] != _NODE: return None
+        if label is not ANY_ITEM and node[0] != label: return None
+        f[6] = 1  # marks that errors raised from now on pass through this node
+        if len(node) == 1:
+            r = vm.enter(expr, _EON, node, 1, None)
+        else:
+            h = node[1]
+            if h.__class__ is list:
+                r = vm.enter(expr, _NODE, node, 1, h)
+            else:
+                r = vm.enter(expr, _LIT, node, 1, (h, node[2]))
+        if r.__class__ is list: return r
+    if r is None: return None
+    if 1 + r[0] != len(node): return None
+    return 1, [_node_of(node, r[1])]
+
+# opcodes. leaf instructions come first.
+(_OP_EPSILON, _OP_NEVER, _OP_ANY, _OP_ANY_LITERAL, _OP_LITERAL, _OP_LITERAL_SET, _OP_REX, _OP_NODE, _OP_ANY_NODE,
+        _OP_INSERT_NODE, _OP_END_OF_NODE, _OP_BEGIN_OF_NODE, _OP_ERROR, _OP_FALLBACK,
+        _OP_UNARY, _OP_OR, _OP_SEQ, _OP_REPETITION, _OP_SEARCH, _OP_NODE_MATCH) = range(20)
+_OP_FIRST_COMPOSITE = _OP_UNARY
+
+_opFuncs = [ _leaf_epsilon, _leaf_never, _leaf_any, _leaf_any_literal, _leaf_literal, _leaf_literal_set, _leaf_rex, _leaf_node, _leaf_any_node,
+        _leaf_insert_node, _leaf_end_of_node, _leaf_begin_of_node, _leaf_error, _leaf_fallback,
+        _step_unary, _step_or, _step_seq, _step_repetition, _step_search, _step_node_match ]
+
+_opNames = [ "epsilon", "never", "any", "any_literal", "literal", "literal_set", "rex", "node", "any_node",
+        "insert_node", "end_of_node", "begin_of_node", "error", "fallback",
+        "unary", "or", "seq", "repetition", "search", "node_match" ]
+
+_leafOpcodes = { Epsilon: _OP_EPSILON, Never: _OP_NEVER, Any: _OP_ANY, AnyLiteral: _OP_ANY_LITERAL,
+        AnyNode: _OP_ANY_NODE, EndOfNode: _OP_END_OF_NODE, BeginOfNode: _OP_BEGIN_OF_NODE }
+
+_unaryPosts = { BuildToNode: (None, _post_build_to_node), BuildToNodeIfYet: (None, _post_build_to_node_if_yet),
+        Relabeled: ((_NODE, ), _post_relabeled), Flattened: ((_NODE, ), _post_flattened),
+        Require: (None, _post_require), RequireBut: (None, _post_require_but),
+        _RepeatZeroOrOne: (None, _post_zero_or_one), AnyBut: ((_NODE, _LIT), _post_any_but) }
+
+
+class _StackMachine(object):
+    ''' A program of the stack machine. The i-th instruction is (opcodes[i], operands[i]). '''
+
+    __slots__ = ['__indexOf', '__exprs', 'opcodes', 'operands', '__funcs']
+
+    def __init__(self, expr):
+        self.__indexOf = {}
+        self.__exprs = []
+        self.opcodes = array('B')
+        self.operands = []
+        self.index(expr)
+        i = 0
+        while i < len(self.__exprs):  # the list will grow while lowering
+            opcode, operand = self.__lower(self.__exprs[i])
+            self.opcodes.append(opcode)
+            self.operands.append(operand)
+            i += 1
+        self.__funcs = [ _opFuncs[opcode] for opcode in self.opcodes ]
+
+    def index(self, expr):
+        expr = _resolve_holder(expr)
+        i = self.__indexOf.get(id(expr))
+        if i is None:
+            i = len(self.__exprs)
+            self.__indexOf[id(expr)] = i
+            self.__exprs.append(expr)
+        return i
+
+    def __lower(self, expr):
+        clz = expr.__class__
+        index = self.index
+        if clz in _leafOpcodes: return _leafOpcodes[clz], None
+        elif clz is Literal: return _OP_LITERAL, expr.string
+        elif clz is LiteralSet: return _OP_LITERAL_SET, expr.strings.__contains__
+        elif clz is Rex: return _OP_REX, expr.pattern.match
+        elif clz is Node: return _OP_NODE, expr.label
+        elif clz is InsertNode: return _OP_INSERT_NODE, expr.newLabel
+        elif clz is ErrorExpr: return _OP_ERROR, expr.message
+        elif clz in _unaryPosts:
+            kinds, post = _unaryPosts[clz]
+            if clz is BuildToNode and expr.drop: post = _post_drop
+            return _OP_UNARY, (index(expr.expr), kinds, post, getattr(expr, "newLabel", None))
+        elif clz is Or:
+            ntbl, unknown_nlst, ltbl, htbl, unknown_llst, elst = expr._get_tables()
+            def to_indices(exprs): return tuple(index(e) for e in exprs)
+            return _OP_OR, (dict((k, to_indices(v)) for k, v in ntbl.iteritems()).get, to_indices(unknown_nlst),
+                    dict((k, to_indices(v)) for k, v in ltbl.iteritems()).get, 
+                    dict((k, to_indices(v)) for k, v in htbl.iteritems()).get, to_indices(unknown_llst), to_indices(elst))
+        elif clz is Seq: return _OP_SEQ, tuple(index(e) for e in expr.exprs)
+        elif clz is Repeat:
+            i = index(expr.expr)
+            return _OP_REPETITION, (i, i, expr.lowerLimit, expr.upperLimit)
+        elif clz is Join:
+            return _OP_REPETITION, (index(expr.itemExpr), index(Seq(expr.sepExpr, expr.itemExpr)), expr.lowerLimit, expr.upperLimit)
+        elif clz is Search:
+            nodeLASet, literalLASet, literalLAHeads = expr._get_lookahead_sets()
+            return _OP_SEARCH, (index(expr.expr), _toPred(nodeLASet), _toLiteralPred(literalLASet, literalLAHeads))
+        elif clz is NodeMatch: return _OP_NODE_MATCH, (expr.label, index(expr.expr))
+        elif clz is AnyNodeMatch: return _OP_NODE_MATCH, (ANY_ITEM, index(expr.expr))
+        # others, including _RepeatOfItem and _JoinOfItems (whose items are flat), are called directly.
+        return _OP_FALLBACK, (expr._match_node, expr._match_lit, expr._match_eon)
+
+    def enter(self, i, kind, s, p, la):
+        ''' Calls the i-th instruction. Returns a result of a leaf instruction, or a new frame of a composite instruction. '''
+        opcode = self.opcodes[i]
+        if opcode < _OP_FIRST_COMPOSITE:
+            return self.__funcs[i](self.operands[i], kind, s, p, la)
+        if opcode == _OP_OR:
+            ntbl_get, unknown_nlst, ltbl_get, htbl_get, unknown_llst, elst = self.operands[i]
+            if kind == _NODE: candidates = ntbl_get(la[0], unknown_nlst)
+            elif kind == _LIT: candidates = ltbl_get(la[1]) or htbl_get(la[1][:1], unknown_llst)
+            else: candidates = elst
+            if len(candidates) <= 1:
+                # no need to make a frame. the depth of this recursion is limited by the size of the expression.
+                return self.enter(candidates[0], kind, s, p, la) if candidates else None
+            return [_step_or, None, kind, s, p, la, 0, candidates, None, None]
+        return [self.__funcs[i], self.operands[i], kind, s, p, la, 0, None, None, None]
+
+    def enter_at(self, i, s, curInpPos, len_inpSeq):
+        if curInpPos == len_inpSeq:
+            return self.enter(i, _EON, s, curInpPos, None)
+        la = s[curInpPos]
+        if la.__class__ is list:
+            return self.enter(i, _NODE, s, curInpPos, la)
+        return self.enter(i, _LIT, s, curInpPos, (la, s[curInpPos + 1]))
+
+    def run(self, kind, s, p, la):
+        f = self.enter(0, kind, s, p, la)
+        if f.__class__ is not list: return f
+        stack = []; push = stack.append; pop = stack.pop
+        r = None
+        try:
+            while True:
+                x = f[_FRAME_STEP](self, f, r)
+                if x.__class__ is list:
+                    push(f); f = x; r = None
+                elif stack:
+                    f = pop(); r = x
+                else:
+                    return x
+        except InterpretError, e:
+            # the same to the recursive engine, where each NodeMatch pushes its position to the error's stack.
+            for g in [ f ] + stack[::-1]:
+                if g[_FRAME_STEP] is _step_node_match and g[_FRAME_STATE] != 0:
+                    e.stack.insert(0, g[4])
+            raise
+
+    def dump(self):
+        return [ (i, _opNames[opcode], self.__exprs[i]) for i, opcode in enumerate(self.opcodes) ]
+
+
+class VMExpression(TorqExpressionWithExpr):
+    ''' An expression lowered into an instruction list of a stack machine by compile_to_vm().
+        A VMExpression object matches input sequences in the same way as its original expression,
+        but uses an explicit stack instead of Python's call stack,
+        so a depth of nested nodes is not limited by sys.getrecursionlimit().
+        As compile_to_python(), the lowering takes a snapshot of the original expression.
+    '''
+
+    __slots__ = ['__machine']
+
+    def __init__(self, expr):
+        self._set_expr(expr)
+        self.__machine = _StackMachine(expr)
+
+    def _calc_mc4la(self): pass
+
+    def getinstructions(self): return self.__machine.dump()
+    instructions = property(getinstructions)
+
+    def _match_node(self, inpSeq, inpPos, lookAheadNode):
+        return self.__machine.run(_NODE, inpSeq, inpPos, lookAheadNode)
+
+    def _match_lit(self, inpSeq, inpPos, lookAheadString):
+        return self.__machine.run(_LIT, inpSeq, inpPos, lookAheadString)
+
+    def _match_eon(self, inpSeq, inpPos, lookAheadDummy):
+        return self.__machine.run(_EON, inpSeq, inpPos, lookAheadDummy)
+
+    def _eq_i(self, right, alreadyComparedExprs):
+        return right.__class__ is VMExpression and self.expr._eq_i(right.expr, alreadyComparedExprs)
+
+    def __repr__(self): return "VMExpression(%s)" % repr(self.expr)
+    def __hash__(self): return hash("VMExpression") + hash(self.expr)
+
+    def getMatchCandidateForLookAhead(self): return self._expr.getMatchCandidateForLookAhead()
+
+    def _isLeftRecursive_i(self, target, visitedExprIdSet):
+        return self.expr is target or self.expr._isLeftRecursive_i(target, visitedExprIdSet)
+
+
+def compile_to_vm(expr):
+    ''' Lowers an expression (graph) into an instruction list of a stack machine, and returns
+        a VMExpression object, which can be used in place of the expression.
+    '''
+    return VMExpression(expr)
@@ -5,7 +5,7 @@ import re
 import string
 
 import pyrem_torq.expression as _pte
-from pyrem_torq.treeseq import seq_pretty, seq_split_nodes_of_label
+from pyrem_torq.treeseq import seq_pretty
 from pyrem_torq.utility import split_to_strings
 
 # Priority of operators
@@ -19,7 +19,7 @@ from pyrem_torq.utility import split_to_strings
 # reserved words
 # any any_node req
 
-_newLineExpr = _pte.Or(*map(_pte.Literal, ['\r', '\n', '\r\n']))
+_newLineExpr = _pte.LiteralSet(['\r', '\n', '\r\n'])
 
 
 def __fill(itemExpr, errorMessage):
@@ -39,7 +39,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
     IN = _pte.InsertNode
     L = _pte.Literal
 
-    def LC(strs): return _pte.Or(*map(_pte.Literal, strs))  # LC = _pte.LiteralClass
+    LC = _pte.LiteralSet
     N = _pte.Node
     NM = _pte.NodeMatch
     R = _pte.Rex
@@ -104,8 +104,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                     | L('@') + _pte.ErrorExpr('Invalid marker name')
             )
             return __fill(tokenExpr, "Can't extract a token")
-        seq[:] = parseTokenExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseTokenExpr().parse(seq, dropLabel="null")
     
     with verbose_print_step_title_and_result_seq('parseReservedWords'):
         def parseReservedWordsExpr():
@@ -135,8 +134,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                 | BtN('apply', IN('insert_subtree') + markNull(N('LP')) + (N('id') | N('null')) + markNull(N('insert_subtree')) + markNull(N('RP'))) \
                 | BtN('param', markNull(N('LP')) + [0, ] * parenExpr + markNull(N('RP')))
             return __fill(parenExpr.expr, "Can't parse parens")
-        seq[:] = parseParenExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseParenExpr().parse(seq, dropLabel="null")
 
     def recurseApplyAndParam(marker): return NM('apply', A() + [0, ] * marker) | NM('param', [0, ] * marker)
 
@@ -153,8 +151,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                 N('diamond') + _pte.ErrorExpr('operator [] only applicable to a node'),
                 A())
             return _pte.Search(unaryOperatorExpr.expr)
-        seq[:] = parseUnaryOperatorsExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseUnaryOperatorsExpr().parse(seq, dropLabel="null")
     
     with verbose_print_step_title_and_result_seq('parseBinaryOperatorJoin'):
         def parseBinaryOperatorJoinExpr():
@@ -164,8 +161,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                 | BtN('apply', IN('joinstar') + term + markNull(N('joinstar')) + joinExpr) \
                 | term
             return __fill(joinExpr.expr, "Can't parse binary operator join (++, **)")
-        seq[:] = parseBinaryOperatorJoinExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseBinaryOperatorJoinExpr().parse(seq, dropLabel="null")
     
     with verbose_print_step_title_and_result_seq('parseBinaryOperatorSeq'):
         def parseBinaryOperatorSeqExpr():
@@ -174,8 +170,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
             seqExpr.expr = BtN('apply', IN('seq') + term + [1, ] * (markNull(N('comma')) + term)) \
                 | term
             return __fill(seqExpr, "Can't parse binary operator Seq (,)")
-        seq[:] = parseBinaryOperatorSeqExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseBinaryOperatorSeqExpr().parse(seq, dropLabel="null")
     
     with verbose_print_step_title_and_result_seq('parseBinaryOperatorOr'):
         def parseBinaryOperatorOrExpr():
@@ -185,8 +180,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                 IN('or') + term + [1, ] * (markNull(N('or')) + term)) \
                 | term
             return __fill(orExpr.expr, "Can't parse binary operator Or (|)")
-        seq[:] = parseBinaryOperatorOrExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseBinaryOperatorOrExpr().parse(seq, dropLabel="null")
     
     with verbose_print_step_title_and_result_seq('parseBinaryOperatorMatch'):
         def parseBinaryOperatorMatchExpr():
@@ -198,8 +192,7 @@ def parse_to_ast(inputSeq, verboseOutput=None):
                 | BtN('apply', IN('insert_subtree') + (N('id') | N('null')) + markNull(N('insert_subtree')) + matchExpr) \
                 | term
             return __fill(matchExpr.expr, "Can't parse binary operator match (::)")
-        seq[:] = parseBinaryOperatorMatchExpr().parse(seq)
-        seq[:] = seq_split_nodes_of_label(seq, "null")[0]
+        seq[:] = parseBinaryOperatorMatchExpr().parse(seq, dropLabel="null")
         
     with verbose_print_step_title_and_result_seq('parseReduceRedundantParen'):
         def parseReduceRedundantParenExpr():
@@ -304,7 +297,7 @@ def convert_literal_to_expression_object(s):
         if len(s) != 1:
             return _pte.Rex("^" + s + "$", ignoreCase=True)
         else:
-            return _pte.Or(_pte.Literal(s.lower()), _pte.Literal(s.upper()))
+            return _pte.LiteralSet([s.lower(), s.upper()])
     else:
         return _pte.Literal(__unescape(s))
 
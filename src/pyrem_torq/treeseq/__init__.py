@@ -1 +1,6 @@
 from treeseq_funcs import *
+from treeseq_array import *
+from label_registry import *
+from treeseq_dump import *
+from treeseq_index import *
+from treeseq_cache import *
@@ -0,0 +1,63 @@
+#coding: utf-8
+
+
+class LabelRegistry(object):
+    ''' A registry which maps label names (strings) to small integers (label ids), and vice versa.
+        Label ids start from 1, so that every id is a true value as a label string is.
+        Label ids can be used in place of label names in expressions (e.g. Node(reg.intern('id')))
+        and in tree sequences.
+    '''
+
+    __slots__ = ['__names', '__ids']
+
+    def __init__(self, names=()):
+        self.__names = [None]  # id 0 is not used
+        self.__ids = {}
+        for name in names: self.intern(name)
+
+    def intern(self, name):
+        ''' Returns the label id of name, registering name if it is new. '''
+        labelId = self.__ids.get(name)
+        if labelId is None:
+            labelId = self.__ids[name] = len(self.__names)
+            self.__names.append(name)
+        return labelId
+
+    __getitem__ = intern
+
+    def id_of(self, name):
+        ''' Returns the label id of name. Raises KeyError if name is not registered. '''
+        return self.__ids[name]
+
+    def name_of(self, labelId):
+        ''' Returns the label name of labelId. Raises KeyError if labelId is not registered. '''
+        if not(0 < labelId < len(self.__names)): raise KeyError(labelId)
+        return self.__names[labelId]
+
+    def getnames(self): return self.__names[1:]
+    names = property(getnames)
+
+    def __len__(self): return len(self.__names) - 1
+    def __contains__(self, name): return name in self.__ids
+
+    def seq_to_ids(self, seq):
+        ''' Returns a copy of seq, whose labels are replaced with label ids. New names are registered. '''
+        intern = self.intern
+
+        def seq_to_ids_i(seq):
+            r = [intern(seq[0])]; r_append = r.append
+            for item in seq[1:]:
+                r_append(seq_to_ids_i(item) if item.__class__ is list else item)
+            return r
+        return seq_to_ids_i(seq)
+
+    def seq_to_names(self, seq):
+        ''' Returns a copy of seq, whose label ids are replaced with label names. '''
+        name_of = self.name_of
+
+        def seq_to_names_i(seq):
+            r = [name_of(seq[0])]; r_append = r.append
+            for item in seq[1:]:
+                r_append(seq_to_names_i(item) if item.__class__ is list else item)
+            return r
+        return seq_to_names_i(seq)
@@ -0,0 +1,155 @@
+#coding: utf-8
+
+from array import array as _array
+
+NODE, LITERAL = 0, 1
+
+
+class _InternTable(object):
+    ''' A table of strings (labels or tokens), each of which is stored once and referred by an id. '''
+
+    __slots__ = ['items', '__ids']
+
+    def __init__(self, items=()):
+        self.items = []
+        self.__ids = {}
+        for item in items: self.intern(item)
+
+    def intern(self, s):
+        ids = self.__ids
+        i = ids.get(s)
+        if i is not None and self.items[i].__class__ is s.__class__:
+            return i
+        key = s if i is None else (s.__class__, s)  # such as 'a' and u'a', which are equal but of different types
+        i = ids.get(key)
+        if i is None:
+            i = ids[key] = len(self.items)
+            self.items.append(s)
+        return i
+
+
+class TreeSeq(object):
+    ''' A tree sequence stored in parallel arrays, instead of nested lists.
+        Each node and each literal (a pair of position and string) of a nested-list seq is an entry, in pre-order.
+        An entry i has kinds[i] (NODE or LITERAL), labelIds[i] (id in labels, or -1 for a literal),
+        offsets[i] (position of a literal, or 0 for a node), stringIds[i] (id in strings, or -1 for a node),
+        and ends[i] (the entry next to the subtree of a node, or i + 1 for a literal).
+        The entry 0 is the root node.
+    '''
+
+    __slots__ = ['kinds', 'labelIds', 'offsets', 'stringIds', 'ends', '__labels', '__strings']
+
+    def __init__(self):
+        self.kinds = _array('B')
+        self.labelIds = _array('i')
+        self.offsets = _array('l')
+        self.stringIds = _array('i')
+        self.ends = _array('i')
+        self.__labels = _InternTable()
+        self.__strings = _InternTable()
+
+    def getlabels(self): return self.__labels.items
+    labels = property(getlabels)
+
+    def getstrings(self): return self.__strings.items
+    strings = property(getstrings)
+
+    def __len__(self): return len(self.kinds)
+
+    def __eq__(self, right):
+        return right.__class__ is TreeSeq and self.to_nested() == right.to_nested()
+
+    def __ne__(self, right): return not self.__eq__(right)
+
+    def __repr__(self): return "TreeSeq.from_nested(%s)" % repr(self.to_nested())
+
+    def append_node(self, label):
+        ''' Appends a node entry and returns its index. The node is open until close_node() is called. '''
+        i = len(self.kinds)
+        self.kinds.append(NODE)
+        self.labelIds.append(self.__labels.intern(label))
+        self.offsets.append(0)
+        self.stringIds.append(-1)
+        self.ends.append(-1)
+        return i
+
+    def close_node(self, i):
+        self.ends[i] = len(self.kinds)
+
+    def append_literal(self, pos, s):
+        i = len(self.kinds)
+        self.kinds.append(LITERAL)
+        self.labelIds.append(-1)
+        self.offsets.append(pos)
+        self.stringIds.append(self.__strings.intern(s))
+        self.ends.append(i + 1)
+        return i
+
+    def label_at(self, i):
+        ''' Returns the label of a node entry, or None for a literal entry. '''
+        lid = self.labelIds[i]
+        return self.__labels.items[lid] if lid >= 0 else None
+
+    def string_at(self, i):
+        ''' Returns the string of a literal entry, or None for a node entry. '''
+        sid = self.stringIds[i]
+        return self.__strings.items[sid] if sid >= 0 else None
+
+    @staticmethod
+    def from_nested(seq):
+        ''' Builds a TreeSeq from a nested-list seq, e.g. [ 'code', 0, 'a', [ 'id', 1, 'b' ] ]. '''
+        assert seq.__class__ is list and len(seq) >= 1
+        ts = TreeSeq()
+        append_node, close_node, append_literal = ts.append_node, ts.close_node, ts.append_literal
+        stack = [(append_node(seq[0]), seq, 1)]
+        while stack:
+            i, node, p = stack.pop()
+            len_node = len(node)
+            while p < len_node:
+                item = node[p]
+                if item.__class__ is list:
+                    stack.append((i, node, p + 1))
+                    i, node, p = append_node(item[0]), item, 1
+                    len_node = len(node)
+                else:
+                    append_literal(item, node[p + 1])
+                    p += 2
+            close_node(i)
+        return ts
+
+    @staticmethod
+    def from_columns(columns, labels, strings):
+        ''' Builds a TreeSeq from arrays ( kinds, labelIds, offsets, stringIds, ends ) and lists of labels and strings. '''
+        ts = TreeSeq()
+        for a, b in zip(( ts.kinds, ts.labelIds, ts.offsets, ts.stringIds, ts.ends ), columns):
+            if a.typecode != b.typecode or len(b) != len(columns[0]): raise ValueError("invalid columns")
+        ts.kinds, ts.labelIds, ts.offsets, ts.stringIds, ts.ends = columns
+        ts.__labels = _InternTable(labels)
+        ts.__strings = _InternTable(strings)
+        if len(ts.__labels.items) != len(labels) or len(ts.__strings.items) != len(strings):
+            raise ValueError("duplicated labels or strings")
+        return ts
+
+    def to_nested(self, index=0):
+        ''' Returns the subtree of a node entry (the entire tree, by default) as a nested-list seq. '''
+        assert self.kinds[index] == NODE
+        kinds, labelIds, offsets, stringIds, ends = self.kinds, self.labelIds, self.offsets, self.stringIds, self.ends
+        labels, strings = self.__labels.items, self.__strings.items
+        root = [labels[labelIds[index]]]
+        stack = [(root, ends[index])]
+        node, end = root, ends[index]
+        i = index + 1
+        while True:
+            while i == end:
+                stack.pop()
+                if not stack: return root
+                node, end = stack[-1]
+            if kinds[i] == NODE:
+                child = [labels[labelIds[i]]]
+                node.append(child)
+                node, end = child, ends[i]
+                stack.append((node, end))
+            else:
+                node.append(offsets[i])
+                node.append(strings[stringIds[i]])
+            i += 1
@@ -0,0 +1,139 @@
+#coding: utf-8
+
+import os
+import time
+import hashlib
+import tempfile
+from cStringIO import StringIO
+
+from treeseq_array import TreeSeq
+from treeseq_dump import dump, load, DumpFormatError
+
+_SUFFIX = ".tqs"
+_DIGEST_SIZE = 20  # of sha1
+_TEMP_SUFFIX = ".tmp"
+_STALE_TEMP_SECONDS = 3600  # a temporary file older than this is regarded as left by an interrupted write
+
+
+class TreeSeqCache(object):
+    ''' An on-disk cache of seqs (such as results of split_to_strings() and parse()),
+        keyed by key_of(text, grammarFingerprint, stage). An entry is a file of a sha1 digest and data written by dump().
+        An entry whose digest doesn't match the data is regarded as missing.
+        Writes are atomic (a temporary file is renamed), so processes can share a directory.
+        When maxBytes is given, the least recently used entries are removed to keep the total size under it.
+        The total size is counted by put() and the directory is scanned only when the count exceeds maxBytes,
+        so entries written by other processes are counted at the next scan.
+    '''
+
+    __slots__ = ['__directory', '__maxBytes', '__totalBytes']
+
+    def __init__(self, directory, maxBytes=None):
+        if not os.path.isdir(directory): os.makedirs(directory)
+        self.__directory = directory
+        self.__maxBytes = maxBytes
+        self.__totalBytes = None  # counted at the first put()
+
+    def getdirectory(self): return self.__directory
+    directory = property(getdirectory)
+
+    def getmaxBytes(self): return self.__maxBytes
+    maxBytes = property(getmaxBytes)
+
+    @staticmethod
+    def key_of(text, grammarFingerprint, stage):
+        ''' Returns a key of a seq made from text by a grammar (identified by a string grammarFingerprint,
+            such as a version or the source of the grammar) at a stage (a string) of a pipeline.
+        '''
+        h = hashlib.sha1()
+        for part in ( text, grammarFingerprint, stage ):
+            data = part.encode('utf-8') if part.__class__ is unicode else part
+            h.update("%s%d:" % ( 'u' if part.__class__ is unicode else 's', len(data) ))
+            h.update(data)
+        return h.hexdigest()
+
+    def __path_of(self, key): return os.path.join(self.__directory, key + _SUFFIX)
+
+    def get(self, key):
+        ''' Returns the seq (nested-list) of key, or None when it is not in the cache. '''
+        path = self.__path_of(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        digest, payload = data[:_DIGEST_SIZE], data[_DIGEST_SIZE:]
+        if hashlib.sha1(payload).digest() != digest: return None  # broken
+        try:
+            seq = load(StringIO(payload)).to_nested()
+        except DumpFormatError:
+            return None
+        try: os.utime(path, None)  # marks as recently used
+        except OSError: pass
+        return seq
+
+    def put(self, key, seq):
+        ''' Stores seq (a nested-list seq or a TreeSeq) as the entry of key. '''
+        fd, tempPath = tempfile.mkstemp(suffix=_TEMP_SUFFIX, dir=self.__directory)
+        try:
+            buf = StringIO()
+            dump(seq, buf)
+            payload = buf.getvalue()
+            with os.fdopen(fd, "wb") as f:
+                f.write(hashlib.sha1(payload).digest())
+                f.write(payload)
+            try:
+                os.rename(tempPath, self.__path_of(key))
+            except OSError:  # on Windows, rename fails when the entry exists (written by another process)
+                os.remove(tempPath)
+        except:
+            if os.path.exists(tempPath): os.remove(tempPath)
+            raise
+        if self.__maxBytes is not None:
+            if self.__totalBytes is None: self.__totalBytes = sum(size for _, size, _ in self.__entries(removeStaleTemps=True))
+            else: self.__totalBytes += _DIGEST_SIZE + len(payload)  # may over-count an overwritten entry
+            if self.__totalBytes > self.__maxBytes:
+                self.evict(self.__maxBytes * 9 // 10)  # with a margin, not to scan at every put() to a full cache
+
+    def get_or_build(self, key, build):
+        ''' Returns the seq (nested-list) of key, calling build() to make (and put) it when it is not in the cache.
+            build() may return a nested-list seq or a TreeSeq.
+        '''
+        seq = self.get(key)
+        if seq is None:
+            seq = build()
+            self.put(key, seq)
+            if seq.__class__ is TreeSeq: seq = seq.to_nested()
+        return seq
+
+    def __entries(self, removeStaleTemps=False):
+        # returns a list of ( mtime, size, path ) of the entries.
+        r = []
+        staleTime = time.time() - _STALE_TEMP_SECONDS
+        for name in os.listdir(self.__directory):
+            isTemp = name.endswith(_TEMP_SUFFIX)
+            if not (name.endswith(_SUFFIX) or isTemp and removeStaleTemps): continue
+            path = os.path.join(self.__directory, name)
+            try:
+                st = os.stat(path)
+                if not isTemp: r.append(( st.st_mtime, st.st_size, path ))
+                elif st.st_mtime < staleTime: os.remove(path)
+            except OSError: pass  # removed by another process
+        return r
+
+    def total_bytes(self): return sum(size for _, size, _ in self.__entries())
+
+    def evict(self, maxBytes):
+        ''' Removes the least recently used entries until the total size is not greater than maxBytes.
+            Also removes temporary files left by interrupted writes.
+        '''
+        entries = self.__entries(removeStaleTemps=True)
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        for _, size, path in entries:
+            if total <= maxBytes: break
+            try: os.remove(path)
+            except OSError: pass
+            total -= size
+        self.__totalBytes = total
+
+    def clear(self): self.evict(0)
@@ -0,0 +1,209 @@
+#coding: utf-8
+
+import sys
+import zlib
+from array import array as _array
+
+from treeseq_array import TreeSeq, NODE, LITERAL
+
+# A dumped seq is:
+#   magic, flags (a byte),
+#   varint: number of entries, label table, string table,
+#   columns: kinds, labelIds, offsets, stringIds, ends (see TreeSeq).
+# A table is a varint count and items. An item is a tag ('s' str, 'u' unicode in utf-8, 'i' int),
+# and a varint length and bytes (for 's' and 'u'), or a zigzag varint (for 'i').
+# A column is a typecode of array, varints of the item size and the length of data, and the data,
+# i.e. items in little endian, zlib-compressed when flags has _COMPRESSED.
+# A reader converts a column when its item size differs from the reader's (e.g. 'l' on 64-bit Linux and on Windows).
+
+_MAGIC = "TQS1"
+_COMPRESSED = 0x01
+
+_columnTypecodes = ( 'B', 'i', 'l', 'i', 'i' )  # kinds, labelIds, offsets, stringIds, ends of TreeSeq
+
+
+class DumpFormatError(ValueError):
+    pass
+
+
+def _write_varint(write, value):
+    assert value >= 0
+    b = []
+    while value >= 0x80:
+        b.append(chr(value & 0x7f | 0x80))
+        value >>= 7
+    b.append(chr(value))
+    write("".join(b))
+
+
+def _read_varint(read):
+    value = 0; shift = 0
+    while True:
+        c = read(1)
+        if not c: raise DumpFormatError("unexpected end of data")
+        b = ord(c)
+        value |= (b & 0x7f) << shift
+        if b < 0x80: return value
+        shift += 7
+
+
+def _read_exactly(read, size):
+    data = read(size)
+    if len(data) != size: raise DumpFormatError("unexpected end of data")
+    return data
+
+
+def _write_table(write, items):
+    _write_varint(write, len(items))
+    for item in items:
+        if item.__class__ is str:
+            write('s'); _write_varint(write, len(item)); write(item)
+        elif item.__class__ is unicode:
+            data = item.encode('utf-8')
+            write('u'); _write_varint(write, len(data)); write(data)
+        elif item.__class__ is int or item.__class__ is long:
+            write('i'); _write_varint(write, item * 2 if item >= 0 else -item * 2 - 1)
+        else:
+            raise TypeError("can't dump a label or string: %s" % repr(item))
+
+
+def _read_table(read):
+    items = []
+    for _ in xrange(_read_varint(read)):
+        tag = read(1)
+        if tag == 's':
+            items.append(_read_exactly(read, _read_varint(read)))
+        elif tag == 'u':
+            items.append(_read_exactly(read, _read_varint(read)).decode('utf-8'))
+        elif tag == 'i':
+            v = _read_varint(read)
+            items.append(v // 2 if v % 2 == 0 else -(v // 2) - 1)
+        else:
+            raise DumpFormatError("invalid tag of a table item: %s" % repr(tag))
+    return items
+
+
+def _write_column(write, a, compress):
+    if sys.byteorder != 'little':
+        a = _array(a.typecode, a); a.byteswap()
+    data = a.tostring()
+    if compress: data = zlib.compress(data)
+    write(a.typecode); _write_varint(write, _array(a.typecode).itemsize); _write_varint(write, len(data)); write(data)
+
+
+def _read_column(read, typecode, compressed):
+    tc = _read_exactly(read, 1)
+    itemSize = _read_varint(read)
+    if tc not in "Bbhil": raise DumpFormatError("unsupported column type: %s" % repr(tc))
+    if _array(tc).itemsize != itemSize:
+        tcs = [ t for t in ("B" if tc == "B" else "bhil") if _array(t).itemsize == itemSize ]
+        if not tcs: raise DumpFormatError("unsupported column type: %s of size %d" % (repr(tc), itemSize))
+        tc = tcs[0]
+    data = _read_exactly(read, _read_varint(read))
+    if compressed: data = zlib.decompress(data)
+    a = _array(tc, data)
+    if sys.byteorder != 'little': a.byteswap()
+    return a if tc == typecode else _array(typecode, a)
+
+
+def dump(seq, fileobj, compress=True):
+    ''' Writes seq (a nested-list seq or a TreeSeq) to fileobj in a compact binary format. '''
+    ts = seq if seq.__class__ is TreeSeq else TreeSeq.from_nested(seq)
+    write = fileobj.write
+    write(_MAGIC); write(chr(_COMPRESSED if compress else 0))
+    _write_varint(write, len(ts))
+    _write_table(write, ts.labels)
+    _write_table(write, ts.strings)
+    for a in ( ts.kinds, ts.labelIds, ts.offsets, ts.stringIds, ts.ends ):
+        _write_column(write, a, compress)
+
+
+def _validate_columns(columns, labelCount, stringCount):
+    # checks that the columns make a tree, whose ids are in the range of the tables.
+    kinds, labelIds, offsets, stringIds, ends = columns
+    entryCount = len(kinds)
+    if entryCount == 0 or kinds[0] != NODE or ends[0] != entryCount: raise DumpFormatError("broken root node")
+    openEnds = []  # ends of the nodes enclosing the entry
+    for i in xrange(entryCount):
+        while openEnds and openEnds[-1] == i: openEnds.pop()
+        if i > 0 and not openEnds: raise DumpFormatError("broken tree at entry %d" % i)
+        kind, end = kinds[i], ends[i]
+        if kind == NODE:
+            if not (0 <= labelIds[i] < labelCount and stringIds[i] == -1): raise DumpFormatError("broken node at entry %d" % i)
+            if not (i < end and (not openEnds or end <= openEnds[-1])): raise DumpFormatError("broken tree at entry %d" % i)
+            openEnds.append(end)
+        elif kind == LITERAL:
+            if not (0 <= stringIds[i] < stringCount and labelIds[i] == -1 and end == i + 1):
+                raise DumpFormatError("broken literal at entry %d" % i)
+        else:
+            raise DumpFormatError("broken kind at entry %d" % i)
+
+
+def _load(read):
+    if read(len(_MAGIC)) != _MAGIC: raise DumpFormatError("not a dumped seq")
+    flags = ord(_read_exactly(read, 1))
+    compressed = bool(flags & _COMPRESSED)
+    entryCount = _read_varint(read)
+    labels = _read_table(read)
+    strings = _read_table(read)
+    columns = [ _read_column(read, tc, compressed) for tc in _columnTypecodes ]
+    if any(len(a) != entryCount for a in columns): raise DumpFormatError("broken columns")
+    _validate_columns(columns, len(labels), len(strings))
+    return TreeSeq.from_columns(columns, labels, strings)
+
+
+def load(fileobj):
+    ''' Reads a seq written by dump() from fileobj, and returns it as a TreeSeq.
+        Use TreeSeq.to_nested() to get a nested-list seq.
+        Raises DumpFormatError when the data is not a valid dumped seq.
+    '''
+    try:
+        return _load(fileobj.read)
+    except DumpFormatError:
+        raise
+    except (zlib.error, ValueError, UnicodeDecodeError, OverflowError, MemoryError), e:
+        raise DumpFormatError("broken data: %s" % str(e))
+
+
+class TreeSeqReader(object):
+    ''' A reader of a dumped seq, which returns entries one by one in pre-order
+        and can skip a subtree without building lists of it.
+        Each entry is read as ( NODE, label ) or ( LITERAL, ( position, string ) ).
+        Note that the reader is not streaming: it loads (and decompresses) the whole dump by load() at first,
+        since a dump stores columns, not entries.
+    '''
+
+    __slots__ = ['__ts', '__index', '__lastNode']
+
+    def __init__(self, fileobj):
+        self.__ts = load(fileobj)
+        self.__index = 0
+        self.__lastNode = None
+
+    def gettreeseq(self): return self.__ts
+    treeseq = property(gettreeseq)
+
+    def __iter__(self): return self
+
+    def next(self):
+        ts, i = self.__ts, self.__index
+        if i >= len(ts): raise StopIteration
+        self.__index = i + 1
+        if ts.kinds[i] == NODE:
+            self.__lastNode = i
+            return NODE, ts.label_at(i)
+        self.__lastNode = None
+        return LITERAL, ( ts.offsets[i], ts.string_at(i) )
+
+    def skip(self):
+        ''' Skips the subtree of the node just read. '''
+        if self.__lastNode is None: raise ValueError("no node to skip")
+        self.__index = self.__ts.ends[self.__lastNode]
+        self.__lastNode = None
+
+    def read_subtree(self):
+        ''' Returns the node just read as a nested-list seq, and skips its subtree. '''
+        if self.__lastNode is None: raise ValueError("no node to read")
+        node = self.__ts.to_nested(self.__lastNode)
+        self.skip()
+        return node
@@ -18,22 +18,39 @@ def seq_count_leaf_contents(seq):
     return count_i(seq)
 
 
-def seq_visit(seq):  # yields ( curPos, in_or_out, node (or item) )
+def seq_visit(seq, sharedPath=False):  # yields ( curPos, in_or_out, node (or item) )
+    # when sharedPath is true, curPos is a list shared among the yielded values, valid until the next step.
     mark_in, mark_out, mark_item = 1, -1, 0
-    def seq_visit_i(curPos, item):
-        if item.__class__ is not list:
-            yield curPos, mark_item, item
+    if seq.__class__ is not list:
+        yield [], mark_item, seq
+        return
+    assert len(seq) >= 1
+    curPos = []
+    yield (curPos if sharedPath else []), mark_in, seq
+    stack = []
+    node, i, len_node = seq, 1, len(seq)
+    while True:
+        if i < len_node:
+            item = node[i]
+            curPos.append(i)
+            if item.__class__ is list:
+                assert len(item) >= 1
+                yield (curPos if sharedPath else curPos[:]), mark_in, item
+                stack.append((node, i + 1, len_node))
+                node, i, len_node = item, 1, len(item)
+            else:
+                yield (curPos if sharedPath else curPos[:]), mark_item, item
+                curPos.pop()
+                i += 1
         else:
-            assert len(item) >= 1
-            yield curPos, mark_in, item
-            for i in xrange(1, len(item)):
-                for v in seq_visit_i(curPos + [i], item[i]): yield v  # need PEP380
-            yield curPos, mark_out, item
-    return seq_visit_i([], seq)
+            yield (curPos if sharedPath else curPos[:]), mark_out, node
+            if not stack: return
+            curPos.pop()
+            node, i, len_node = stack.pop()
 
 
-def seq_walk(seq):  # yields ( curPos, nodeName, node (or item) )
-    for curPos, in_or_out, node_or_item in seq_visit(seq):
+def seq_walk(seq, sharedPath=False):  # yields ( curPos, nodeName, node (or item) )
+    for curPos, in_or_out, node_or_item in seq_visit(seq, sharedPath):
         if in_or_out == 1:
             # get in to a node
             yield curPos, node_or_item[0], node_or_item
@@ -44,85 +61,146 @@ def seq_walk(seq):  # yields ( curPos, nodeName, node (or item) )
             pass
 
 
-def seq_outermost_node_iter(seq, label):
-    def soni_i(curPos, item):
-        if item.__class__ is not list:
-            assert len(item) >= 1
-            if item[0] == label:
-                yield curPos, item
-            else:
-                for i in xrange(1, len(item)):
-                    for v in soni_i(curPos + [i], item[i]): yield v  # need PEP380
-    return soni_i([], seq)
-
-
-def seq_pretty(seq):
-    def find_type_range(type, seq, beginPos):
-        assert beginPos >= 1
-        len_seq = len(seq)
-        if not(beginPos < len_seq and isinstance(seq[beginPos], type)):
-            return None
-        for i in xrange(beginPos + 1, len_seq):
-            if not isinstance(seq[i], type): return i
-        return len_seq
-    r = []
-
-    def seq_pretty_i(seq, indent):
-        if len(seq) == 1:
-            r.append(indent + "[%s:]" % (seq[0]))
-            return
-        len_seq = len(seq)
-        if find_type_range(str, seq, 1) == len_seq:
-            r.append(indent + "[%s: %s ]" % (seq[0], ",".join(map(repr, islice(seq, 1, None)))))
-            return
-        if find_type_range(unicode, seq, 1) == len_seq:
-            r.append(indent + "[%s: %s ]" % (seq[0], u",".join(map(repr, islice(seq, 1, None)))))
-            return
+def seq_outermost_node_iter(seq, label):  # yields ( curPos, node ) of nodes of label, which are not inside another node of label
+    if seq.__class__ is not list: return
+    assert len(seq) >= 1
+    if seq[0] == label:
+        yield [], seq
+        return
+    curPos = []
+    stack = []
+    node, i, len_node = seq, 1, len(seq)
+    while True:
+        if i < len_node:
+            item = node[i]
+            i += 1
+            if item.__class__ is list:
+                assert len(item) >= 1
+                if item[0] == label:
+                    yield curPos + [i - 1], item
+                else:
+                    stack.append((node, i, len_node))
+                    curPos.append(i - 1)
+                    node, i, len_node = item, 1, len(item)
+        else:
+            if not stack: return
+            curPos.pop()
+            node, i, len_node = stack.pop()
 
-        newIndent = indent + "  "
-        r.append(indent + "[ %s:" % seq[0])
-        i = 1
-        while i < len_seq:
-            item = seq[i]
+
+def seq_visit_labels(seq, labelToCallback):
+    # calls labelToCallback[label](curPos, node) for each node whose label is in labelToCallback, in pre-order.
+    # walks the seq only once, for any number of labels.
+    get_callback = labelToCallback.get
+    assert seq.__class__ is list and len(seq) >= 1
+    callback = get_callback(seq[0])
+    if callback is not None: callback([], seq)
+    curPos = []
+    stack = []
+    node, i, len_node = seq, 1, len(seq)
+    while True:
+        if i < len_node:
+            item = node[i]
+            i += 1
             if item.__class__ is list:
-                seq_pretty_i(item, newIndent)
-                i += 1
-                continue  # while i
-            endPos = find_type_range(str, seq, i)
-            if endPos:
-                r.append(newIndent + ",".join(map(repr, seq[i:endPos])))
-                i = endPos
-                continue  # while i
-            endPos = find_type_range(unicode, seq, i)
+                callback = get_callback(item[0])
+                if callback is not None: callback(curPos + [i - 1], item)
+                stack.append((node, i, len_node))
+                curPos.append(i - 1)
+                node, i, len_node = item, 1, len(item)
+        else:
+            if not stack: return
+            curPos.pop()
+            node, i, len_node = stack.pop()
+
+
+def _find_type_range(type, seq, beginPos, endPos):
+    assert beginPos >= 1
+    if not(beginPos < endPos and isinstance(seq[beginPos], type)):
+        return None
+    for i in xrange(beginPos + 1, endPos):
+        if not isinstance(seq[i], type): return i
+    return endPos
+
+
+def seq_pretty_iter(seq, labelToName=None, maxDepth=None, maxItems=None):  # yields the lines of seq_pretty()
+    # a node deeper than maxDepth is shown as "[label: ... ]", and items of a node after maxItems are omitted.
+    frames = []
+    node, indent, depth = seq, "", 0
+    while True:
+        label = node[0] if labelToName is None else labelToName(node[0])
+        len_node = len(node)
+        end = len_node if maxItems is None or len_node - 1 <= maxItems else 1 + maxItems
+        if len_node == 1:
+            yield indent + "[%s:]" % (label)
+        elif maxDepth is not None and depth >= maxDepth:
+            yield indent + "[%s: ... ]" % (label)
+        elif end == len_node and _find_type_range(str, node, 1, len_node) == len_node:
+            yield indent + "[%s: %s ]" % (label, ",".join(map(repr, islice(node, 1, None))))
+        elif end == len_node and _find_type_range(unicode, node, 1, len_node) == len_node:
+            yield indent + "[%s: %s ]" % (label, u",".join(map(repr, islice(node, 1, None))))
+        else:
+            yield indent + "[ %s:" % label
+            frames.append([ node, indent, 1, end, depth ])
+
+        while frames:
+            f = frames[-1]
+            node, indent, i, end, depth = f
+            newIndent = indent + "  "
+            if i == end:
+                if end < len(node): yield newIndent + "... (%d more items)" % (len(node) - end)
+                yield indent + "]"
+                frames.pop()
+                continue  # while frames
+            item = node[i]
+            if item.__class__ is list:
+                f[2] = i + 1
+                node, indent, depth = item, newIndent, depth + 1
+                break  # while frames
+            endPos = _find_type_range(str, node, i, end) or _find_type_range(unicode, node, i, end)
             if endPos:
-                r.append(newIndent + ",".join(map(repr, seq[i:endPos])))
-                i = endPos
-                continue  # while i
-            r.append(newIndent + repr(item))
-            i += 1
-        r.append(indent + "]")
-    seq_pretty_i(seq, "")
-    return r
+                yield newIndent + ",".join(map(repr, node[i:endPos]))
+                f[2] = endPos
+            else:
+                yield newIndent + repr(item)
+                f[2] = i + 1
+        else:
+            return
+
+
+def seq_pretty(seq, labelToName=None):  # labelToName: e.g. LabelRegistry.name_of, for a seq of label ids
+    return list(seq_pretty_iter(seq, labelToName))
+
+
+def seq_pretty_write(seq, fileobj, maxDepth=None, maxItems=None, labelToName=None):
+    # writes the lines of seq_pretty() to fileobj one by one, without building all of them in memory.
+    write = fileobj.write
+    for line in seq_pretty_iter(seq, labelToName, maxDepth, maxItems):
+        write(line); write("\n")
 
 
 def seq_split_nodes_of_label(seq, label):
     removedItems = []; removedItems_append = removedItems.append
 
-    def _seq_split_nodes_of_label_i(seq):
-        r = []; r_append = r.append
-        q = iter(seq)
-        r_append(q.next())
-        for item in q:
-            if item.__class__ is list:
-                if item[0] == label:
-                    removedItems_append(item)
-                else:
-                    r_append(_seq_split_nodes_of_label_i(item))
+    def _seq_split_nodes_of_label_i(seq):  # returns seq itself when nothing is removed from the subtree
+        r = None
+        for i in xrange(1, len(seq)):
+            item = seq[i]
+            if item.__class__ is not list:
+                if r is not None: r_append(item)
+                continue  # for i
+            if item[0] == label:
+                removedItems_append(item)
+                newItem = None
             else:
-                r_append(item)
-                r_append(q.next())
-        return r
+                newItem = _seq_split_nodes_of_label_i(item)
+                if newItem is item and r is None: continue  # for i
+            if r is None:
+                r = seq[:i]; r_append = r.append
+            if newItem is not None: r_append(newItem)
+        return r if r is not None else seq
     r = _seq_split_nodes_of_label_i(seq)
+    if r is seq: r = seq[:]
     return r, removedItems
 
 
@@ -0,0 +1,100 @@
+#coding: utf-8
+
+from array import array as _array
+
+
+class TreeSeqIndex(object):
+    ''' An index of the nodes of a (nested-list) seq by label, built by one traversal.
+        Each node has an id, the number in pre-order (the root is 0), and the index keeps
+        parent links, the index in the parent and the subtree size (number of nodes) of each node.
+        Valid while the seq is not modified.
+    '''
+
+    __slots__ = ['__nodes', '__parents', '__childIndexes', '__sizes', '__labelToIds']
+
+    def __init__(self, seq):
+        assert seq.__class__ is list and len(seq) >= 1
+        nodes = self.__nodes = [seq]; nodes_append = nodes.append
+        parents = self.__parents = _array('i', [-1])
+        childIndexes = self.__childIndexes = _array('i', [0])
+        sizes = self.__sizes = _array('i', [0])
+        labelToIds = self.__labelToIds = {seq[0]: [0]}
+        stack = [(0, seq, 1)]
+        while stack:
+            nid, node, i = stack.pop()
+            len_node = len(node)
+            while i < len_node:
+                item = node[i]
+                i += 1
+                if item.__class__ is list:
+                    stack.append((nid, node, i))
+                    cid = len(nodes)
+                    nodes_append(item); parents.append(nid); childIndexes.append(i - 1); sizes.append(0)
+                    ids = labelToIds.get(item[0])
+                    if ids is None: labelToIds[item[0]] = [cid]
+                    else: ids.append(cid)
+                    nid, node, i = cid, item, 1
+                    len_node = len(node)
+            sizes[nid] = len(nodes) - nid
+
+    def __len__(self): return len(self.__nodes)
+
+    def getlabels(self): return self.__labelToIds.keys()
+    labels = property(getlabels)
+
+    def ids_of(self, label):
+        ''' Returns ids of the nodes of label, in pre-order. '''
+        return self.__labelToIds.get(label, [])
+
+    def count(self, label):
+        return len(self.__labelToIds.get(label, ()))
+
+    def node_at(self, nodeId): return self.__nodes[nodeId]
+
+    def parent_of(self, nodeId):
+        ''' Returns the id of the parent node, or None for the root. '''
+        p = self.__parents[nodeId]
+        return p if p >= 0 else None
+
+    def subtree_size_of(self, nodeId):
+        ''' Returns the number of nodes in the subtree of the node, including the node itself. '''
+        return self.__sizes[nodeId]
+
+    def path_of(self, nodeId):
+        ''' Returns the path of the node, a list of indices from the root, as curPos of seq_walk(). '''
+        parents, childIndexes = self.__parents, self.__childIndexes
+        path = []
+        while nodeId > 0:
+            path.append(childIndexes[nodeId])
+            nodeId = parents[nodeId]
+        path.reverse()
+        return path
+
+    def is_inside(self, nodeId, ancestorId):
+        ''' Returns True if the node is in the subtree of ancestor (or is ancestor itself). '''
+        return ancestorId <= nodeId < ancestorId + self.__sizes[ancestorId]
+
+    def nodes_of(self, label):
+        ''' Returns the nodes of label, in pre-order. '''
+        nodes = self.__nodes
+        return [ nodes[i] for i in self.__labelToIds.get(label, ()) ]
+
+    def paths_of(self, label):
+        ''' Returns a list of ( path, node ) of the nodes of label, in pre-order. '''
+        nodes, path_of = self.__nodes, self.path_of
+        return [ ( path_of(i), nodes[i] ) for i in self.__labelToIds.get(label, ()) ]
+
+    def outermost_ids_of(self, label):
+        ''' Returns ids of the nodes of label, which are not inside another node of label. '''
+        sizes = self.__sizes
+        r = []; end = 0
+        for i in self.__labelToIds.get(label, ()):
+            if i >= end:
+                r.append(i)
+                end = i + sizes[i]
+        return r
+
+    def outermost_paths_of(self, label):
+        ''' Returns a list of ( path, node ) of the outermost nodes of label, as seq_outermost_node_iter(). '''
+        nodes, path_of = self.__nodes, self.path_of
+        return [ ( path_of(i), nodes[i] ) for i in self.outermost_ids_of(label) ]
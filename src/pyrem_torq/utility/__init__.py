@@ -1,3 +1,6 @@
 from unicode_utility import *
 from iuniq import *
 from split_to_strings import *
+from mmap_token_seq import *
+from labeled_tokenizer import *
+from parallel_tokenize import *
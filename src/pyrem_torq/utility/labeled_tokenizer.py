@@ -0,0 +1,62 @@
+#coding: utf-8
+
+import re
+
+from split_to_strings import _as_sliceable
+
+
+class LabeledTokenizer(object):
+    ''' A tokenizer made from a table of ( label, regex ), which splits a string into nodes [ label, pos, str ]
+        by one finditer loop, i.e. it does both of split_to_strings() and a Search pass labeling each token.
+        The regexes are tried in the order of the table (as alternatives of one regex).
+        Tokens of a label in drop are not included in the result (as dropLabel of TorqExpression.parse()).
+    '''
+
+    __slots__ = ['__table', '__drop', '__pattern', '__groupToLabel']
+
+    def __init__(self, table, drop=(), flags=0):
+        self.__table = tuple(( label, regex ) for label, regex in table)
+        self.__drop = frozenset(drop)
+        groupToLabel = self.__groupToLabel = {}
+        alternatives = []
+        for i, ( label, regex ) in enumerate(self.__table):
+            groupName = "_t%d" % i
+            groupToLabel[groupName] = label if label not in self.__drop else None
+            alternatives.append("(?P<%s>%s)" % ( groupName, regex ))
+        self.__pattern = re.compile("|".join(alternatives), flags)
+
+    def gettable(self): return self.__table
+    table = property(gettable)
+
+    def getdrop(self): return self.__drop
+    drop = property(getdrop)
+
+    def getpattern(self): return self.__pattern
+    pattern = property(getpattern)
+
+    def __reduce__(self):
+        return LabeledTokenizer, ( self.__table, self.__drop, self.__pattern.flags )
+
+    def tokenize(self, s, internTable=None):
+        ''' Returns a list of nodes [ label, pos, str ] of the tokens of s (a str, unicode or bytes-like object).
+            Raises ValueError when a part of s is not matched by any regex of the table.
+        '''
+        return self._tokenize_at(_as_sliceable(s), 0, internTable)
+
+    def _tokenize_at(self, s, offset, internTable=None):
+        # tokenize() of s, a piece of a text at offset.
+        r = []; r_append = r.append
+        groupToLabel = self.__groupToLabel
+        intern = internTable.intern if internTable is not None else None
+        pos = 0
+        for m in self.__pattern.finditer(s):
+            b, e = m.span()
+            if b != pos: break
+            pos = e
+            label = groupToLabel[m.lastgroup]
+            if label is not None:
+                t = s[b:e]
+                r_append([ label, b + offset, intern(t) if intern is not None else t ])
+        if pos != len(s):
+            raise ValueError("pos %d: no token matches: %s" % ( pos + offset, repr(s[pos:pos + 10]) ))
+        return r
@@ -0,0 +1,80 @@
+#coding: utf-8
+
+import re
+import mmap
+from array import array
+
+from split_to_strings import _default_splitting_pattern_arguments, _as_sliceable
+
+
+class MmapTokenSeq(object):
+    ''' A seq of tokens, [ label, pos, str, pos, str, ... ], which stores the positions and lengths of tokens
+        in arrays and makes a token string (a slice of the buffer, such as a mmap) only when it is accessed.
+        Can be an input sequence of TorqExpression.match() / parse(). The output of them is a (usual) list.
+    '''
+
+    __slots__ = ['__label', '__buffer', '__offsets', '__lengths', '__internTable']
+
+    def __init__(self, label, buffer, offsets, lengths, internTable=None):
+        assert len(offsets) == len(lengths)
+        self.__label = label
+        self.__buffer = buffer
+        self.__offsets = offsets
+        self.__lengths = lengths
+        self.__internTable = internTable
+
+    def getbuffer(self): return self.__buffer
+    buffer = property(getbuffer)
+
+    def getoffsets(self): return self.__offsets
+    offsets = property(getoffsets)
+
+    def getlengths(self): return self.__lengths
+    lengths = property(getlengths)
+
+    def __len__(self): return 1 + 2 * len(self.__offsets)
+
+    def __getitem__(self, index):
+        if index.__class__ is slice:
+            return [ self[i] for i in xrange(*index.indices(1 + 2 * len(self.__offsets))) ]
+        if index < 0: index += 1 + 2 * len(self.__offsets)
+        if index == 0: return self.__label
+        i, isString = divmod(index - 1, 2)
+        if i < 0: raise IndexError(index)
+        b = self.__offsets[i]
+        if not isString: return b
+        s = self.__buffer[b:b + self.__lengths[i]]
+        if self.__internTable is not None: s = self.__internTable.intern(s)
+        return s
+
+    def __iter__(self):
+        yield self.__label
+        for i in xrange(len(self.__offsets)):
+            yield self[1 + 2 * i]
+            yield self[2 + 2 * i]
+
+    def to_list(self): return self[:]
+
+
+def split_to_token_seq(label, s, pattern=None, internTable=None):
+    ''' Splits s (a str, unicode, or a bytes-like object such as mmap and bytearray) into tokens, and returns a MmapTokenSeq of them.
+        The returned seq is equal to [ label ] + split_to_strings(s, pattern).
+    '''
+    if s.__class__ is not mmap.mmap: s = _as_sliceable(s)  # slices of a mmap are str
+    pattern = pattern or re.compile(*_default_splitting_pattern_arguments)
+    offsets = array('i' if len(s) < 0x7fffffff else 'l'); offsets_append = offsets.append
+    lengths = array('i'); lengths_append = lengths.append
+    for m in pattern.finditer(s):
+        b, e = m.span()
+        offsets_append(b)
+        lengths_append(e - b)
+    return MmapTokenSeq(label, s, offsets, lengths, internTable)
+
+
+def open_token_seq(filePath, label, pattern=None, internTable=None):
+    ''' Maps a file into memory, and returns a MmapTokenSeq of its tokens. '''
+    with open(filePath, "rb") as f:
+        if f.read(1) == "":  # an empty file can't be mapped
+            return MmapTokenSeq(label, "", array('l'), array('i'), internTable)
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return split_to_token_seq(label, m, pattern, internTable)
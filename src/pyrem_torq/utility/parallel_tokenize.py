@@ -0,0 +1,77 @@
+#coding: utf-8
+
+import re
+import multiprocessing
+
+from split_to_strings import split_to_strings, _default_splitting_pattern_arguments, _as_sliceable
+
+
+def _cut_to_pieces(s, boundaryPattern, pieceCount):
+    # returns positions [ 0, b1, b2, ..., len(s) ], where each bi is the end of a match of boundaryPattern.
+    len_s = len(s)
+    step = len_s // pieceCount
+    positions = [ 0 ]
+    for k in xrange(1, pieceCount):
+        m = boundaryPattern.search(s, max(k * step, positions[-1]))
+        if m is None: break
+        e = m.end()
+        if e >= len_s: break
+        if e > positions[-1]: positions.append(e)
+    positions.append(len_s)
+    return positions
+
+
+def _split_piece(args):
+    piece, offset, pattern = args
+    r = split_to_strings(piece, pattern)
+    if offset: r[0::2] = [ b + offset for b in r[0::2] ]
+    return r
+
+
+def _tokenize_piece(args):
+    piece, offset, tokenizer = args
+    return tokenizer._tokenize_at(piece, offset)
+
+
+def _map_pieces(func, s, boundaryPattern, arg, processes, pieceCount, pool):
+    s = _as_sliceable(s)
+    processes = processes or multiprocessing.cpu_count()
+    if pieceCount is None: pieceCount = 4 * processes
+    positions = _cut_to_pieces(s, boundaryPattern, max(1, pieceCount))
+    tasks = [ ( s[b:e], b, arg ) for b, e in zip(positions, positions[1:]) ]
+    if len(tasks) <= 1 or pool is None and processes == 1:
+        return [ func(t) for t in tasks ]
+    if pool is not None:
+        return pool.map(func, tasks, 1)
+    pool = multiprocessing.Pool(processes)
+    try:
+        return pool.map(func, tasks, 1)
+    finally:
+        pool.terminate(); pool.join()
+
+
+def split_to_strings_parallel(s, boundaryPattern, pattern=None, processes=None, pieceCount=None, pool=None, internTable=None):
+    ''' Returns the same list as split_to_strings(s, pattern), splitting pieces of s in a process pool.
+        s is cut into pieces (about pieceCount ones) at the ends of matches of boundaryPattern,
+        each of which must be a boundary of tokens, e.g. a new line outside of string literals and comments.
+        A pool of processes is created unless pool (a multiprocessing.Pool) is given.
+    '''
+    pattern = pattern or re.compile(*_default_splitting_pattern_arguments)
+    r = []
+    for rp in _map_pieces(_split_piece, s, boundaryPattern, pattern, processes, pieceCount, pool):
+        r.extend(rp)
+    if internTable is not None: r[1::2] = [ internTable.intern(t) for t in r[1::2] ]
+    return r
+
+
+def tokenize_parallel(tokenizer, s, boundaryPattern, processes=None, pieceCount=None, pool=None, internTable=None):
+    ''' Returns the same list as tokenizer.tokenize(s) of a LabeledTokenizer, tokenizing pieces of s in a process pool.
+        For the pieces and pool, see split_to_strings_parallel().
+    '''
+    r = []
+    for rp in _map_pieces(_tokenize_piece, s, boundaryPattern, tokenizer, processes, pieceCount, pool):
+        r.extend(rp)
+    if internTable is not None:
+        intern = internTable.intern
+        for node in r: node[2] = intern(node[2])
+    return r
@@ -1,15 +1,113 @@
 #coding: utf-8
 
 import re
+import sys
 
 _default_splitting_pattern_arguments = (r"\d+|[a-zA-Z]+|\r\n|.", re.DOTALL)
 
 
-def split_to_strings(s, pattern=None):
+class StringInternTable(object):
+    ''' A table to make equal token strings share one object.
+        Pass the same table to split_to_strings() calls to share the strings among them.
+        savedCount and savedBytes tell how many strings were replaced by shared ones and how much memory it saved.
+    '''
+
+    __slots__ = ['strings', 'savedCount', 'savedBytes']
+
+    def __init__(self):
+        self.strings = {}
+        self.savedCount = 0
+        self.savedBytes = 0
+
+    def __len__(self): return len(self.strings)
+
+    def intern(self, s):
+        t = self.strings.setdefault(s, s)
+        if t is s: return s
+        if t.__class__ is not s.__class__: return s  # such as 'a' and u'a', which are equal but of different types
+        self.savedCount += 1
+        self.savedBytes += sys.getsizeof(s)
+        return t
+
+
+def _as_sliceable(s):
+    # returns s, or a buffer of s when s is a bytearray, mmap, etc., which re can scan and whose slices are str.
+    # a memoryview is copied to a str, since re of Python 2 can't scan it.
+    if s.__class__ is str or s.__class__ is unicode: return s
+    if s.__class__ is memoryview: return s.tobytes()
+    return buffer(s)
+
+
+def split_to_strings(s, pattern=None, internTable=None):
+    # s is a str, unicode or a bytes-like object (bytearray, mmap, memoryview, etc.), whose tokens are str.
     r = []; r_append = r.append
+    s = _as_sliceable(s)
     pattern = pattern or re.compile(*_default_splitting_pattern_arguments)
+    if internTable is None:
+        for m in pattern.finditer(s):
+            b, e = m.span()
+            r_append(b)
+            r_append(s[b:e])
+        return r
+
+    setdefault = internTable.strings.setdefault
+    getsizeof = sys.getsizeof
+    savedCount = savedBytes = 0
     for m in pattern.finditer(s):
         b, e = m.span()
+        t = s[b:e]
+        u = setdefault(t, t)
+        if u is not t:
+            if u.__class__ is t.__class__:
+                savedCount += 1
+                savedBytes += getsizeof(t)
+            else:
+                u = t
         r_append(b)
-        r_append(s[b:e])
+        r_append(u)
+    internTable.savedCount += savedCount
+    internTable.savedBytes += savedBytes
     return r
+
+
+_stream_context_length = 64  # characters kept before the resume position, for look-behinds and \b
+
+
+def split_to_strings_iter(fileobj, pattern=None, chunkSize=65536, internTable=None, maxTokenLength=4096):
+    # yields ( position, string ) of the tokens of the text read from fileobj, chunk by chunk.
+    # the tokens are the same to those of split_to_strings(fileobj.read(), pattern),
+    # when no token (including the text the pattern looks at after the token) is longer than maxTokenLength.
+    # a match starting within maxTokenLength from the end of the buffer is held back until more data arrives,
+    # since a longer alternative (e.g. a string literal or a comment continuing in the next chunk) may replace it.
+    # a pattern which looks at the end of text (by $ or \Z) may split differently.
+    assert maxTokenLength >= 1
+    pattern = pattern or re.compile(*_default_splitting_pattern_arguments)
+    intern = internTable.intern if internTable is not None else None
+    read = fileobj.read
+    buf = None
+    base = 0  # position of buf[0] in the text
+    pos = 0  # position in buf to resume the search from
+    while True:
+        chunk = read(chunkSize)
+        if chunk:
+            buf = chunk if buf is None else buf + chunk
+            limit = len(buf) - maxTokenLength
+            ms = []
+            for m in pattern.finditer(buf, pos):
+                if m.start() >= limit: break
+                ms.append(m)
+            if not ms: continue
+        else:
+            if buf is None: buf = chunk  # an empty text
+            ms = pattern.finditer(buf, pos)
+        for m in ms:
+            b, e = m.span()
+            t = buf[b:e]
+            yield base + b, (intern(t) if intern is not None else t)
+        if not chunk: return
+        b, e = ms[-1].span()
+        resume = e if e > b else e + 1  # as finditer, the search after an empty match starts from the next char
+        cut = max(0, resume - _stream_context_length)
+        buf = buf[cut:]
+        base += cut
+        pos = resume - cut
@@ -1,11 +1,10 @@
 import re, collections
 import pyrem_torq
 from pyrem_torq.expression import *
-from pyrem_torq.treeseq import seq_split_nodes_of_label
 
 BtN = BuildToNode
 L = Literal
-def LC(strs): return Or(*map(Literal, strs))
+LC = LiteralSet
 NM = NodeMatch
 
 def tokenize(text):
@@ -90,10 +89,9 @@ usage: calculator <expr>
     seq = tokenize(text)
     for expr in parsing_exprs:
         for L in ts.seq_pretty(ts.seq_remove_strattrs(seq)): print L # prints an seq
-        newSeq = expr.parse(seq)
+        newSeq = expr.parse(seq, dropLabel="null")
         if newSeq is None: sys.exit("Syntax Error")
         seq = newSeq
-        seq = seq_split_nodes_of_label(seq, "null")[0]
     for L in ts.seq_pretty(ts.seq_remove_strattrs(seq)): print L # prints an seq
     result = interpret(ts.seq_remove_strattrs(seq))
     print result
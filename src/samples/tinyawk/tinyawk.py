@@ -11,38 +11,30 @@
 
 from pyrem_torq import *
 from pyrem_torq.expression import *
-from pyrem_torq.treeseq import seq_split_nodes_of_label
 
-def split_to_str(text):
-    p = re.compile("|".join([
-        r"/[^/\r\n]*/", r'"[^"\r\n]*"', r"\d+", # literals (regex, string, integer)
-        r"#[^\r\n]*", # comment
-        r"[ \t]+", r"\r\n|\r|\n", # white spaces, newline
-        r"[a-zA-Z_](\w|_)*", # identifier
-        r"[<>!=]=|&&|[|][|]", r"[-+*/%<>!=()${},;]|\[|\]", # operators
-        r"." # invalid chars
-    ]))
-    return [ 'code' ] + utility.split_to_strings(text, pattern=p)
+tokenizer = utility.LabeledTokenizer([
+    # literals (regex, string, integer)
+    ( "l_regex", r"/[^/\r\n]*/" ), ( "l_string", r'"[^"\r\n]*"' ), ( "l_integer", r"\d+" ),
+    ( "null", r"#[^\r\n]*" ), # comment
+    ( "null", r"[ \t]+" ), ( "newline", r"\r\n|\r|\n" ), # white spaces, newline
+    # reserved words, identifier
+    ( "r_BEGIN", r"BEGIN\b" ), ( "r_END", r"END\b" ),
+    ( "r_next", r"next\b" ), ( "r_print", r"print\b" ), ( "r_if", r"if\b" ), ( "r_else", r"else\b" ), ( "r_while", r"while\b" ),
+    ( "id", r"[a-zA-Z_]\w*" ),
+    # operators
+    ( "op_ge", ">=" ), ( "op_le", "<=" ), ( "op_ne", "!=" ), ( "op_eq", "==" ), ( "op_and", "&&" ), ( "op_or", r"\|\|" ),
+    ( "op_gt", ">" ), ( "op_lt", "<" ),
+    ( "op_plus", r"\+" ), ( "op_minus", "-" ), ( "op_mul", r"\*" ), ( "op_div", "/" ), ( "op_mod", "%" ),
+    ( "op_assign", "=" ), ( "op_not", "!" ), ( "op_dollar", r"\$" ),
+    ( "LP", r"\(" ), ( "RP", r"\)" ), ( "LB", "{" ), ( "RB", "}" ), ( "LK", r"\[" ), ( "RK", r"\]" ),
+    ( "comma", "," ), ( "semicolon", ";" )
+], drop=[ "null" ])
 
-def tokenizing_expr_iter():
+def tokenize(text):
     # identify reserved words, literals, identifiers
-    e = Search(script.compile(r"""
-    (r_BEGIN <- "BEGIN") | (r_END <- "END")
-    | (r_next <- "next") | (r_print <- "print") | (r_if <- "if") | (r_else <- "else") | (r_while <- "while")
-    | (id <- r"^[a-zA-Z_]") 
-    | (l_integer <- r"^[0-9]") | (l_string <- r"^\"") | (l_regex <- r"^/")
-    | (op_gt <- ">") | (op_ge <- ">=") | (op_lt <- "<") | (op_le <- "<=") | (op_ne <- "!=") | (op_eq <- "==")
-    | (op_and <- "&&") | (op_or <- "||")
-    | (op_plus <- "+") | (op_minus <- "-") | (op_mul <- "*") | (op_div <- "/") | (op_mod <- "%")
-    | (op_assign <- "=") | (op_not <- "!") | (op_dollar <- "$")
-    | (LP <- "(") | (RP <- ")") | (LB <- "{") | (RB <- "}") | (LK <- "[") | (RK <- "]")
-    | (comma <- ",") | (semicolon <- ";")
-    | (newline <- "\r\n" | "\r" | "\n")
-    | (null <- r"^[ \t#]")
-    | any, error("unexpected character")
-    ;"""))
-    yield "identify reserved words, literals, identifiers", e
-    
+    return [ 'code' ] + tokenizer.tokenize(text)
+
+def tokenizing_expr_iter():
     # identify statement-terminating new-line chars
     e = Search(script.compile(r"""
     (comma | LB | op_or | op_and | r_else), (null <- newline)
@@ -101,7 +93,7 @@ def expr_parsing_expr_iter():
     def operator_parser_iter():
         def markNull(expr): return BuildToNode("null", expr)
         n = Node
-        kit = extra.operator_builer.OperatorBuilder()
+        kit = extra.operator_builder.OperatorBuilder()
         kit.atomic_term_expr = Or(n("l_integer"), n("l_string"), n("l_regex"), n("id"))
         kit.composed_term_node_labels = ( "expr", )
         kit.generated_term_label = "expr"
@@ -350,20 +342,19 @@ def main(debugTrace=False):
     script = script + "\n" # prepare for missing new-line char at the last line
     
     # parsing
-    seq = split_to_str(script)
+    seq = tokenize(script)
     des = []
     des.extend(tokenizing_expr_iter())
     des.extend(stmt_parsing_expr_iter()) 
     des.extend(expr_parsing_expr_iter())
     for desc, expr in des:
         if debugWrite:
-            debugWrite("\n".join(treeseq.seq_pretty(treeseq.seq_remove_strattrs(seq))) + "\n") # prints a seq
+            treeseq.seq_pretty_write(treeseq.seq_remove_strattrs(seq), sys.stderr) # prints a seq
             debugWrite("step: %s\n" % desc)
-            newSeq = expr.parse(seq)
+        newSeq = expr.parse(seq, dropLabel="null")
         if newSeq is None: sys.exit("parse error")
         seq = newSeq
-        seq = seq_split_nodes_of_label(seq, "null")[0]
-    if debugWrite: debugWrite("\n".join(treeseq.seq_pretty(treeseq.seq_remove_strattrs(seq))) + "\n") # prints a seq
+    if debugWrite: treeseq.seq_pretty_write(treeseq.seq_remove_strattrs(seq), sys.stderr) # prints a seq
     
     seq = treeseq.seq_remove_strattrs(seq)
     
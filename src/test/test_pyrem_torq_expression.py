@@ -469,7 +469,328 @@ class TestTorqExpression(unittest.TestCase):
         posDelta, outSeq = expr.match(seq, 1)
         self.assertEqual(posDelta, 0)
         self.assertEqual(outSeq, [ [ 'hoge' ], [ 'comma' ], [ 'hoge' ], [ 'comma' ], [ 'hoge' ] ])
-        
+
+    def testMemoized(self):
+        table = MemoTable()
+        expr = Memoized(Seq(Literal('a'), InsertNode('x')), table)
+        seq = [ 'text', 0, 'a' ]
+
+        for _ in xrange(2):
+            posDelta, outSeq = expr.match(seq, 1)
+            self.assertEqual(posDelta, 2)
+            self.assertEqual(outSeq, [ 0, 'a', [ 'x' ] ])
+        self.assertEqual((table.hits, table.misses), (1, 1))
+
+        expr = Seq(expr, Literal('b'))
+        seq = [ 'text', 0, 'a', 1, 'c' ]
+        self.assertEqual(expr.match(seq, 1), (0, []))
+
+        table = MemoTable(maxSize=2)
+        expr = Search(Memoized(Literal('a'), table))
+        seq = [ 'text', 0, 'a', 1, 'a', 2, 'a' ]
+        self.assertEqual(expr.parse(seq), seq)
+        self.assertEqual(len(table), 2)
+        self.assertEqual(table.evictions, 2) # 4 results (3 literals and the end of node) are stored
+
+        # the table doesn't keep input sequences whose results are all evicted
+        import weakref
+        class WeakrefableList(list): pass
+        h = Holder('h')
+        h.expr = BuildToNode('a', Literal('a'))
+        h.memo = MemoTable(maxSize=10)
+        refs = []
+        for _ in range(200):
+            seq = WeakrefableList([ 'text', 0, 'a', 1, 'a' ])
+            refs.append(weakref.ref(seq))
+            h.parse(seq)
+        del seq
+        self.assertEqual(len(h.memo), 10)
+        self.assertTrue(sum(1 for r in refs if r() is not None) <= 10)
+
+    def testPackrat(self):
+        h = Holder('h')
+        h.expr = BuildToNode('p', Literal('(') + [0,None] * h + Literal(')')) | Literal('x')
+        # the 2nd alternative backtracks over the same prefix as the 1st one.
+        expr0 = Or(h + Literal(';'), h + Literal(','), h)
+        expr = Packrat(expr0)
+        self.assertEqual(expr.holders, [ h ])
+
+        seq = [ 'text', 0, '(', 1, '(', 2, 'x', 3, ')', 4, ')', 5, ',' ]
+        outSeq = expr.parse(seq)
+        self.assertEqual(outSeq, expr0.parse(seq))
+        self.assertEqual(outSeq, [ 'text', [ 'p', 0, '(', [ 'p', 1, '(', 2, 'x', 3, ')' ], 4, ')' ], 5, ',' ])
+        self.assertTrue(expr.memoTable.hits >= 1)
+        self.assertEqual(len(expr.memoTable), 0) # cleared after parsing
+        self.assertEqual(h.memo, None)
+
+    def testCompileToPython(self):
+        h = Holder('h')
+        h.expr = NodeMatch('p', Search(h)) | BuildToNode('v', Join(Literal(','), Rex(r'^\d'), 1, None)) | Relabeled('q', Node('r'))
+        expr0 = Seq(BeginOfNode(), [0,1] * InsertNode('b'), Search(Or(h, AnyBut(Literal(';')) + Require(Literal(';')), Flattened(Node('f')))),
+                Repeat(Literal(';'), 0, 2), EndOfNode())
+        expr = compile_to_python(expr0)
+        self.assertEqual(expr.expr, expr0)
+        self.assertTrue(expr.source)
+
+        seqs = [
+            [ 'text', 0, '1', 1, ',', 2, '2', 3, 'x', 4, ';' ],
+            [ 'text', [ 'p', 0, '3', 1, ',', 2, '4', [ 'r' ] ], [ 'f', 5, 'a' ], 6, ';', 7, ';' ],
+            [ 'text' ],
+            [ 'text', 0, ';', 1, ';', 2, ';' ],
+        ]
+        for seq in seqs:
+            self.assertEqual(expr.parse(seq), expr0.parse(seq))
+
+        expr0 = Search(NodeMatch('p', Literal('a') | ErrorExpr('not a')))
+        expr = compile_to_python(expr0)
+        seq = [ 'text', 0, 'x', [ 'p', 1, 'b' ] ]
+        with self.assertRaises(InterpretErrorByErrorExpr) as cm:
+            expr.parse(seq)
+        self.assertEqual(cm.exception.message, 'not a')
+        self.assertEqual(cm.exception.stack, [ 3, 1 ])
+
+    def testCompileToVM(self):
+        h = Holder('h')
+        h.expr = NodeMatch('p', Search(h)) | BuildToNode('v', Join(Literal(','), Rex(r'^\d'), 1, None)) | Relabeled('q', Node('r'))
+        expr0 = Seq(BeginOfNode(), [0,1] * InsertNode('b'), Search(Or(h, AnyBut(Literal(';')) + Require(Literal(';')), Flattened(Node('f')))),
+                Repeat(Literal(';'), 0, 2), EndOfNode())
+        expr = compile_to_vm(expr0)
+        self.assertEqual(expr.expr, expr0)
+
+        seqs = [
+            [ 'text', 0, '1', 1, ',', 2, '2', 3, 'x', 4, ';' ],
+            [ 'text', [ 'p', 0, '3', 1, ',', 2, '4', [ 'r' ] ], [ 'f', 5, 'a' ], 6, ';', 7, ';' ],
+            [ 'text' ],
+            [ 'text', 0, ';', 1, ';', 2, ';' ],
+        ]
+        for seq in seqs:
+            self.assertEqual(expr.parse(seq), expr0.parse(seq))
+
+        expr = compile_to_vm(Search(NodeMatch('p', Literal('a') | ErrorExpr('not a'))))
+        seq = [ 'text', 0, 'x', [ 'p', 1, 'b' ] ]
+        with self.assertRaises(InterpretErrorByErrorExpr) as cm:
+            expr.parse(seq)
+        self.assertEqual(cm.exception.stack, [ 3, 1 ])
+
+    def testCompileToVMDeepNesting(self):
+        h = Holder('h')
+        h.expr = NodeMatch('p', Search(h) + Literal('x'))
+        expr0 = Search(h)
+        expr = compile_to_vm(expr0)
+
+        depth = sys.getrecursionlimit() * 2
+        seq = [ 'p', 0, 'x' ]
+        for i in xrange(1, depth): seq = [ 'p', seq, i, 'x' ]
+        seq = [ 'text', seq ]
+        self.assertRaises(RuntimeError, expr0.parse, seq)
+
+        outSeq = expr.parse(seq)
+        node = outSeq[1]
+        for i in xrange(depth - 1, 0, -1):
+            self.assertEqual(node[0], 'p')
+            self.assertEqual(node[2:], [ i, 'x' ])
+            node = node[1]
+        self.assertEqual(node, [ 'p', 0, 'x' ])
+
+    def testLeftRecursion(self):
+        e, t, f = Holder('e'), Holder('t'), Holder('f')
+        e.expr = BuildToNode('add', e + Or(Literal('+'), Literal('-')) + t) | t
+        t.expr = BuildToNode('mul', t + Literal('*') + f) | f
+        f.expr = Rex(r'^\d') | Literal('(') + e + Literal(')')
+        self.assertTrue(e._needs_seed_growing())
+        self.assertFalse(f._needs_seed_growing())
+
+        seq = [ 'code', 0, '1', 1, '-', 2, '2', 3, '-', 4, '3', 5, '*', 6, '4' ]
+        expected = [ 'code', [ 'add', [ 'add', 0, '1', 1, '-', 2, '2' ], 3, '-', [ 'mul', 4, '3', 5, '*', 6, '4' ] ] ]
+        self.assertEqual(e.parse(seq), expected)
+        self.assertEqual(Packrat(e).parse(seq), expected)
+        self.assertEqual(compile_to_python(e).parse(seq), expected)
+        self.assertEqual(compile_to_vm(e).parse(seq), expected)
+
+        seq = [ 'code', 0, '(', 1, '1', 2, '-', 3, '2', 4, ')', 5, '*', 6, '3' ]
+        self.assertEqual(e.parse(seq), [ 'code', [ 'mul', 0, '(', [ 'add', 1, '1', 2, '-', 3, '2' ], 4, ')', 5, '*', 6, '3' ] ])
+
+        # indirect left recursion
+        a, b = Holder('a'), Holder('b')
+        a.expr = BuildToNode('a', b + Literal('x')) | Literal('y')
+        b.expr = a | Literal('z')
+        seq = [ 'code', 0, 'y', 1, 'x', 2, 'x' ]
+        self.assertEqual(a.parse(seq), [ 'code', [ 'a', [ 'a', 0, 'y', 1, 'x' ], 2, 'x' ] ])
+
+        # left recursion made by setting expr of another Holder, after the Holder is evaluated
+        g, h = Holder('g'), Holder('h')
+        g.expr = Literal('y')
+        h.expr = Seq(g, Literal('x')) | Literal('y')
+        seq = [ 'c', 0, 'y', 1, 'x', 2, 'x' ]
+        self.assertEqual(h.match(seq, 1), (4, [ 0, 'y', 1, 'x' ]))
+        g.expr = h
+        self.assertTrue(h._needs_seed_growing())
+        self.assertEqual(h.parse(seq), seq)
+
+    def testRecognize(self):
+        expr = Seq(BuildToNode('v', Join(Literal(','), Rex(r'^\d'), 1, None)), Require(Literal(';')), Search(NodeMatch('p', Any())))
+        seq = [ 'text', 0, '1', 1, ',', 2, '2', 3, ';', [ 'p', 4, 'a' ], [ 'p', 5, 'b' ] ]
+        self.assertEqual(expr.recognize(seq, 1), len(seq) - 1)
+        self.assertEqual(expr.recognize(seq, 1), expr.match(seq, 1)[0])
+        self.assertEqual(expr.recognize(seq, 3), None)
+        self.assertEqual(expr.recognize(seq, 5), 6)
+
+        expr = Repeat(AnyBut(Literal(';')), 0, None) + EndOfNode()
+        self.assertEqual(expr.recognize(seq, 1), None)
+        self.assertEqual(expr.recognize(seq, 9), 2)
+        self.assertEqual(expr.recognize(seq, 11), 0)
+
+        expr = Search(NodeMatch('p', Literal('a') | ErrorExpr('not a')))
+        with self.assertRaises(InterpretErrorByErrorExpr) as cm:
+            expr.recognize(seq, 1)
+        self.assertEqual(cm.exception.stack, [ 10, 1 ])
+
+    def testSearchWithZeroLengthMatch(self):
+        expr = Search(Require(Literal('b')) + InsertNode('m') | Node('n') + InsertNode('e'))
+        seq = [ 'text', 0, 'a', 1, 'b', [ 'n' ], 2, 'c', 3, 'b' ]
+        self.assertEqual(expr.parse(seq), [ 'text', 0, 'a', [ 'm' ], 1, 'b', [ 'n' ], [ 'e' ], 2, 'c', [ 'm' ], 3, 'b' ])
+        self.assertEqual(compile_to_python(expr).parse(seq), expr.parse(seq))
+        self.assertEqual(compile_to_vm(expr).parse(seq), expr.parse(seq))
+
+    def testRexLiteralHeads(self):
+        self.assertEqual(Rex(r'^[a-c_]\w*').getMatchCandidateForLookAhead().literalHeads, frozenset('abc_'))
+        self.assertEqual(Rex(r'(?:x|y)?z', ignoreCase=True).getMatchCandidateForLookAhead().literalHeads, frozenset('xyzXYZ'))
+        self.assertEqual(Rex(r'\d*').getMatchCandidateForLookAhead().literalHeads, None)
+        self.assertEqual(Rex(r'[^"]').getMatchCandidateForLookAhead().literalHeads, None)
+
+        mc4la = Rex(r'^[a-c_]\w*').getMatchCandidateForLookAhead()
+        self.assertEqual(hash(mc4la), hash(Rex(r'^[a-c_]').getMatchCandidateForLookAhead()))
+        self.assertEqual(len(set([ mc4la, mc4la.modified(), MatchCandidateForLookAhead(literals=ANY_ITEM, literalHeads='ab') ])), 2)
+        self.assertEqual(hash(MatchCandidateForLookAhead(nodes=['a'], emptyseq=True)), hash(MatchCandidateForLookAhead(nodes=('a',), emptyseq=1)))
+
+        expr = Or(Literal('1'), Rex(r'^\d+'), Rex(r'^[a-z]') + Literal('='), Any())
+        ntbl, unknown_nlst, ltbl, htbl, unknown_llst, elst = expr._get_tables()
+        self.assertEqual(ltbl['1'], [ expr.exprs[0], expr.exprs[1], expr.exprs[3] ])
+        self.assertEqual(htbl['2'], [ expr.exprs[1], expr.exprs[3] ])
+        self.assertEqual(unknown_llst, [ expr.exprs[3] ])
+        seq = [ 'code', 0, '1', 1, '23', 2, 'x', 3, '=', 4, '+' ]
+        self.assertEqual(Search(BuildToNode('t', expr)).parse(seq), 
+                [ 'code', [ 't', 0, '1' ], [ 't', 1, '23' ], [ 't', 2, 'x', 3, '=' ], [ 't', 4, '+' ] ])
+
+        expr = Search(BuildToNode('n', Rex(r'^\d')))
+        self.assertEqual(expr.getMatchCandidateForLookAhead().literals, ANY_ITEM)
+        self.assertEqual(expr._get_lookahead_sets()[2], frozenset('0123456789'))
+        for e in [ expr, compile_to_python(expr), compile_to_vm(expr) ]:
+            self.assertEqual(e.parse(seq), [ 'code', [ 'n', 0, '1' ], [ 'n', 1, '23' ], 2, 'x', 3, '=', 4, '+' ])
+
+    def testLiteralSet(self):
+        expr = Literal('+') | Literal('-') | LiteralSet(['*', '/'])
+        self.assertEqual(expr, LiteralSet('+-*/'))
+        self.assertEqual(expr.getMatchCandidateForLookAhead().literals, frozenset('+-*/'))
+
+        expr = Or(Literal('a'), Literal('b'), Rex(r'^[a-z]'), Literal('c'))
+        self.assertEqual(expr.exprs, [ LiteralSet('ab'), Rex(r'^[a-z]'), Literal('c') ])
+
+        expr = Search(BuildToNode('op', LiteralSet([ '+', '-', '==' ])))
+        seq = [ 'code', 0, 'a', 1, '==', 2, 'b', 3, '-', 4, '=' ]
+        for e in [ expr, compile_to_python(expr), compile_to_vm(expr) ]:
+            self.assertEqual(e.parse(seq), [ 'code', 0, 'a', [ 'op', 1, '==' ], 2, 'b', [ 'op', 3, '-' ], 4, '=' ])
+
+    def testIndexedSearch(self):
+        def token(i): return [ [ 'c', i, '#' ] ] if i % 50 == 7 else [ i, 'x' if i % 50 == 6 else 'y' ]
+        seq = [ 'code' ]
+        for i in xrange(200): seq.extend(token(i))
+        expr = Search(BuildToNode('p', Node('c') + Literal('y')) | Literal('x') + Require(Node('c')) + InsertNode('b'))
+        expected = [ 'code' ]
+        for i in xrange(200):
+            if i % 50 == 6: expected.extend([ i, 'x', [ 'b' ] ])
+            elif i % 50 == 7: expected.append([ 'p', [ 'c', i, '#' ], i + 1, 'y' ])
+            elif i % 50 != 8: expected.extend(token(i))
+        self.assertEqual(expr.parse(seq), expected)
+        self.assertEqual(expr.recognize(seq, 1), len(seq) - 1)
+
+        from pyrem_torq.expression.base_expression import _PositionIndex
+        cands = _PositionIndex(seq).candidates(frozenset([ 'c' ]), frozenset([ 'x' ]))
+        self.assertEqual(len(cands), 8)
+        self.assertEqual(cands, sorted(cands))
+        for i in cands:
+            self.assertTrue(seq[i][0] == 'c' if seq[i].__class__ is list else seq[i + 1] == 'x')
+
+    def testRelabeledNotModifyingInput(self):
+        seq = [ 'code', [ 'a', 0, 'x' ] ]
+        expr = Relabeled('b', Node('a'))
+        for e in [ expr, compile_to_python(expr), compile_to_vm(expr) ]:
+            self.assertEqual(e.parse(seq), [ 'code', [ 'b', 0, 'x' ] ])
+            self.assertEqual(seq, [ 'code', [ 'a', 0, 'x' ] ])
+
+    def testNodeMatchSharingUnchangedNode(self):
+        seq = [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'a', 2, 'z' ] ]
+        expr = Search(NodeMatch('a', Search(BuildToNode('c', Literal('z')))))
+        for e in [ expr, compile_to_python(expr), compile_to_vm(expr) ]:
+            r = e.parse(seq)
+            self.assertEqual(r, [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'a', [ 'c', 2, 'z' ] ] ])
+            self.assertTrue(r[1] is seq[1])
+            self.assertFalse(r[2] is seq[2])
+            self.assertEqual(seq[2], [ 'a', 2, 'z' ])
+
+    def testBuildToNodeDrop(self):
+        seq = [ 'code', 0, 'a', 1, ' ', 2, 'b', [ 'null', 3, ' ' ] ]
+        expr = Search(BuildToNode('id', Rex(r'^[a-z]')) | BuildToNode('null', Literal(' ')))
+        expected = seq_split_nodes_of_label(expr.parse(seq), 'null')[0]
+        self.assertEqual(expected, [ 'code', [ 'id', 0, 'a' ], [ 'id', 2, 'b' ] ])
+        for e in [ expr, compile_to_python(expr), compile_to_vm(expr), Packrat(expr) ]:
+            r = e.parse(seq, dropLabel='null')
+            self.assertEqual(r, [ 'code', [ 'id', 0, 'a' ], [ 'id', 2, 'b' ], [ 'null', 3, ' ' ] ])  # a node in the input is kept
+            self.assertEqual(e.match(seq, 3), (5, [ [ 'null', 1, ' ' ], [ 'id', 2, 'b' ], [ 'null', 3, ' ' ] ]))  # only parse() drops nodes
+
+        exprDrop = Search(BuildToNode('id', Rex(r'^[a-z]')) | BuildToNode('null', Literal(' '), drop=True))
+        self.assertNotEqual(exprDrop, expr)
+        self.assertTrue(repr(BuildToNode('null', Literal(' '), drop=True)).endswith(",drop=True)"))
+        for e in [ exprDrop, compile_to_python(exprDrop), compile_to_vm(exprDrop) ]:
+            self.assertEqual(e.match(seq, 3), (5, [ [ 'id', 2, 'b' ], [ 'null', 3, ' ' ] ]))
+            self.assertEqual(e.parse(seq), [ 'code', [ 'id', 0, 'a' ], [ 'id', 2, 'b' ], [ 'null', 3, ' ' ] ])
+
+    def testCompileOrOfNotCompiledExprs(self):
+        # an Or whose child (SubApply, a left-recursive Holder, Memoized) is not compiled, but called as an expression object
+        def upper(o): return [ o[0], o[1].upper() ]
+        h = Holder()
+        h.expr = BuildToNode('add', h + Literal('+') + Literal('x')) | Literal('x')
+        exprs = [
+            Or(SubApply(upper, Literal('x')), Any()),
+            h | Any(),
+            Search(h | Any()),
+            Search(Memoized(BuildToNode('y', Literal('y')), MemoTable()) | Any()),
+        ]
+        seq = [ 'code', 0, 'x', 1, '+', 2, 'x', 3, 'y', 4, 'x' ]
+        for expr in exprs:
+            expected = expr.match(seq, 1)
+            self.assertEqual(compile_to_python(expr).match(seq, 1), expected)
+            self.assertEqual(compile_to_vm(expr).match(seq, 1), expected)
+        self.assertEqual(compile_to_python(Search(h | Any())).parse(seq), Search(h | Any()).parse(seq))
+
+    def testBuildToNodeDropWithMemo(self):
+        h = Holder('h')
+        h.expr = [0,None] * (BuildToNode('null', Literal(' ')) | BuildToNode('w', Rex(r'^[a-z]')))
+        h.memo = MemoTable()
+        seq = [ 'code', 0, 'a', 1, ' ', 2, 'b' ]
+        withNull = [ 'code', [ 'w', 0, 'a' ], [ 'null', 1, ' ' ], [ 'w', 2, 'b' ] ]
+        dropped = [ 'code', [ 'w', 0, 'a' ], [ 'w', 2, 'b' ] ]
+        for _ in range(2):
+            self.assertEqual(h.parse(seq, dropLabel='null'), dropped)
+            self.assertEqual(h.parse(seq), withNull)
+        self.assertTrue(h.memo.hits >= 2)
+
+    def testRepeatAndJoinOfItems(self):
+        seq = [ 'code', 0, ' ', 1, '\t', [ 'c', 2, '#' ], 3, 'x', 4, ',', 5, 'y', 6, ',', [ 'n' ] ]
+        expr = [1, None] * (Rex(r'^\s$') | Node('c'))
+        self.assertEqual(expr, Repeat(Or(Rex(r'^\s$'), Node('c')), 1, None))
+        self.assertEqual(expr.match(seq, 1), (5, seq[1:6]))
+        self.assertEqual(expr.match(seq, 6), (0, []))
+        self.assertEqual(([0, None] * AnyBut(Literal(','))).match(seq, 1), (7, seq[1:8]))
+        self.assertEqual(Repeat(AnyLiteral(), 2, 3).recognize(seq, 6), 6)
+
+        expr = Join(Literal(','), Rex(r'^[a-z]') | AnyNode(), 2, None)
+        self.assertEqual(expr.match(seq, 6), (9, seq[6:]))
+        self.assertEqual(expr.match(seq, 12), (0, []))
+        self.assertEqual(Join(Literal(','), Rex(r'^[a-z]'), 1, 1).match(seq, 6), (2, seq[6:8]))
+        for e in [ compile_to_python(expr), compile_to_vm(expr) ]:
+            self.assertEqual(e.match(seq, 6), expr.match(seq, 6))
+
 def TestSuite(TestTorqExpression):
     return unittest.makeSuite(TestTorqExpression)
 
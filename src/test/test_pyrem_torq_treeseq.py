@@ -58,7 +58,249 @@ class TestTorqTreeseq(unittest.TestCase):
         self.assertEquals(atrSeq, [ 'a', [ 'B', 1 ], 2 ])
         mergedSeq = seq_merge_strattrs(atrSeq, strSeq)
         self.assertEquals(mergedSeq, seq)
+    
+    def testTreeSeq(self):
+        seq = [ 'code', 0, 'a', [ 'id', 1, 'b', [ 'x' ], 2, u'b' ], 3, 'a', [ 'id' ] ]
+        ts = TreeSeq.from_nested(seq)
+        self.assertEquals(len(ts), 8)
+        self.assertEquals(ts.to_nested(), seq)
+        self.assertEquals(ts.to_nested(2), [ 'id', 1, 'b', [ 'x' ], 2, u'b' ])
+        self.assertEquals(list(ts.kinds), [ NODE, LITERAL, NODE, LITERAL, NODE, LITERAL, LITERAL, NODE ])
+        self.assertEquals(list(ts.ends), [ 8, 2, 6, 4, 5, 6, 7, 8 ])
+        self.assertEquals(ts.labels, [ 'code', 'id', 'x' ])
+        self.assertEquals(ts.strings, [ 'a', 'b', u'b' ])
+        self.assertEquals((ts.label_at(2), ts.string_at(2), ts.label_at(3), ts.string_at(3), ts.offsets[3]), ( 'id', None, None, 'b', 1 ))
+        self.assertTrue(ts.to_nested()[3][5].__class__ is unicode)
+        
+        self.assertEquals(TreeSeq.from_nested([ 'code' ]).to_nested(), [ 'code' ])
+        
+    def testParseTreeSeq(self):
+        from pyrem_torq.expression import Search, BuildToNode, Literal
+        ts = TreeSeq.from_nested([ 'code', 0, 'a', 1, 'b', 2, 'a' ])
+        r = Search(BuildToNode('A', Literal('a'))).parse(ts)
+        self.assertTrue(r.__class__ is TreeSeq)
+        self.assertEquals(r.to_nested(), [ 'code', [ 'A', 0, 'a' ], 1, 'b', [ 'A', 2, 'a' ] ])
+
+    def testLabelRegistry(self):
+        reg = LabelRegistry([ 'code' ])
+        self.assertEquals(reg.intern('code'), 1)
+        self.assertEquals(reg.intern('id'), 2)
+        self.assertEquals(reg.intern('code'), 1)
+        self.assertEquals(len(reg), 2)
+        self.assertEquals(reg.names, [ 'code', 'id' ])
+        self.assertEquals(reg.name_of(2), 'id')
+        self.assertRaises(KeyError, reg.name_of, 0)
+        self.assertRaises(KeyError, reg.id_of, 'op')
+        self.assertFalse('op' in reg)
+
+        seq = [ 'code', [ 'id', 0, 'a' ], 1, '+', [ 'op' ] ]
+        idSeq = reg.seq_to_ids(seq)
+        self.assertEquals(idSeq, [ 1, [ 2, 0, 'a' ], 1, '+', [ 3 ] ])
+        self.assertEquals(reg.seq_to_names(idSeq), seq)
+        self.assertEquals(seq_pretty(idSeq, reg.name_of), seq_pretty(seq))
+
+        from pyrem_torq.expression import Search, BuildToNode, NodeMatch, Literal, Any
+        ID, OP = reg.intern('id'), reg.intern('op')
+        r = Search(BuildToNode(OP, Literal('+')) | NodeMatch(ID, Any())).parse(idSeq)
+        self.assertEquals(r, [ 1, [ 2, 0, 'a' ], [ 3, 1, '+' ], [ 3 ] ])
+        self.assertEquals(seq_split_nodes_of_label(r, OP)[1], [ [ 3, 1, '+' ], [ 3 ] ])
          
+    def testSplitNodesOfLabelSharingSubtrees(self):
+        seq = [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'c', [ 'null', 2, ' ' ], 3, 'z' ] ]
+        r, removed = seq_split_nodes_of_label(seq, 'null')
+        self.assertEquals(r, [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'c', 3, 'z' ] ])
+        self.assertEquals(removed, [ [ 'null', 2, ' ' ] ])
+        self.assertTrue(r[1] is seq[1])
+        self.assertEquals(seq[2], [ 'c', [ 'null', 2, ' ' ], 3, 'z' ])
+
+        r, removed = seq_split_nodes_of_label(seq, 'd')
+        self.assertEquals(r, seq)
+        self.assertFalse(r is seq)
+        self.assertTrue(r[2] is seq[2])
+
+    def testDumpAndLoad(self):
+        from cStringIO import StringIO
+        seq = [ 'code', 0, 'a', [ u'id', 1, u'b\u3042', [ 7 ] ], 300, 'a', [ 'id' ] ]
+        for compress in [ True, False ]:
+            f = StringIO()
+            dump(seq, f, compress=compress)
+            ts = load(StringIO(f.getvalue()))
+            self.assertTrue(ts.__class__ is TreeSeq)
+            self.assertEquals(ts.to_nested(), seq)
+            self.assertEquals(ts, TreeSeq.from_nested(seq))
+        self.assertRaises(DumpFormatError, load, StringIO("XXXX"))
+        self.assertRaises(DumpFormatError, load, StringIO(f.getvalue()[:-1]))
+        self.assertRaises(TypeError, dump, [ 'code', 0, None ], StringIO())
+
+    def testLoadBrokenData(self):
+        import random
+        from cStringIO import StringIO
+        seq = [ 'code', 0, 'a', [ 'id', 1, 'b', [ 'x' ] ], 3, 'c' ]
+        def dumped(ts, compress=True):
+            f = StringIO(); dump(ts, f, compress=compress); return f.getvalue()
+        for modify in [ lambda ts: ts.ends.__setitem__(0, 99), lambda ts: ts.ends.__setitem__(3, 7),
+                lambda ts: ts.labelIds.__setitem__(3, 5), lambda ts: ts.stringIds.__setitem__(1, -1),
+                lambda ts: ts.kinds.__setitem__(2, 7) ]:
+            ts = TreeSeq.from_nested(seq)
+            modify(ts)
+            self.assertRaises(DumpFormatError, load, StringIO(dumped(ts)))
+
+        # randomly broken data raises only DumpFormatError
+        rnd = random.Random(0)
+        for compress in [ True, False ]:
+            data = dumped(seq, compress)
+            for _ in xrange(300):
+                b = bytearray(data)
+                for _ in xrange(rnd.randint(1, 3)): b[rnd.randrange(len(b))] = rnd.randrange(256)
+                try: load(StringIO(str(b))).to_nested()
+                except DumpFormatError: pass
+
+    def testTreeSeqReader(self):
+        from cStringIO import StringIO
+        seq = [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'c', 2, 'z' ], 3, 'w' ]
+        f = StringIO()
+        dump(seq, f)
+        reader = TreeSeqReader(StringIO(f.getvalue()))
+        self.assertEquals(reader.next(), ( NODE, 'code' ))
+        self.assertEquals(reader.next(), ( NODE, 'a' ))
+        reader.skip()
+        self.assertEquals(reader.next(), ( NODE, 'c' ))
+        self.assertEquals(reader.read_subtree(), [ 'c', 2, 'z' ])
+        self.assertEquals(reader.next(), ( LITERAL, ( 3, 'w' ) ))
+        self.assertRaises(ValueError, reader.skip)
+        self.assertEquals(list(reader), [])
+
+    def testTreeSeqIndex(self):
+        seq = [ 'code', [ 'e', 0, 'a', [ 'e', 1, 'b' ] ], 2, 'c', [ 's', [ 'e', [ 'id', 3, 'd' ] ] ] ]
+        idx = TreeSeqIndex(seq)
+        self.assertEquals(len(idx), 6)
+        self.assertEquals(sorted(idx.labels), [ 'code', 'e', 'id', 's' ])
+        self.assertEquals(idx.ids_of('e'), [ 1, 2, 4 ])
+        self.assertEquals(idx.count('e'), 3)
+        self.assertEquals(idx.count('x'), 0)
+        self.assertEquals(idx.nodes_of('id'), [ [ 'id', 3, 'd' ] ])
+        self.assertEquals(idx.paths_of('e'), [ ( p, n ) for p, lbl, n in seq_walk(seq) if lbl == 'e' ])
+        self.assertEquals(idx.outermost_paths_of('e'), [ ( [ 1 ], seq[1] ), ( [ 4, 1 ], seq[4][1] ) ])
+        self.assertEquals(( idx.parent_of(5), idx.parent_of(0) ), ( 4, None ))
+        self.assertEquals([ idx.subtree_size_of(i) for i in xrange(len(idx)) ], [ 6, 2, 1, 3, 2, 1 ])
+        self.assertTrue(idx.is_inside(5, 3))
+        self.assertFalse(idx.is_inside(2, 3))
+        self.assertTrue(idx.node_at(3) is seq[4])
+
+    def testSeqVisitAndWalk(self):
+        seq = [ 'code', [ 'e', 0, 'a' ], 1, 'b' ]
+        self.assertEquals(list(seq_visit(seq)), [ ( [], 1, seq ), ( [ 1 ], 1, seq[1] ), ( [ 1, 1 ], 0, 0 ), ( [ 1, 2 ], 0, 'a' ),
+                ( [ 1 ], -1, seq[1] ), ( [ 2 ], 0, 1 ), ( [ 3 ], 0, 'b' ), ( [], -1, seq ) ])
+        self.assertEquals([ ( p[:], m ) for p, m, n in seq_visit(seq, sharedPath=True) ], [ ( p, m ) for p, m, n in seq_visit(seq) ])
+        self.assertEquals(list(seq_walk(seq)), [ ( [], 'code', seq ), ( [ 1 ], 'e', seq[1] ), ( [ 1, 1 ], None, 0 ), ( [ 1, 2 ], None, 'a' ),
+                ( [ 2 ], None, 1 ), ( [ 3 ], None, 'b' ) ])
+
+        deep = [ 'a', 0, 'x' ]
+        for i in xrange(3000): deep = [ 'a', deep ]
+        self.assertEquals(sum(1 for _ in seq_visit(deep, sharedPath=True)), 3001 * 2 + 2)
+
+    def testSeqOutermostNodeIter(self):
+        seq = [ 'code', [ 'e', 0, 'a', [ 'e', 1, 'b' ] ], [ 's', [ 'e', 2, 'c' ] ] ]
+        self.assertEquals(list(seq_outermost_node_iter(seq, 'e')), [ ( [ 1 ], seq[1] ), ( [ 2, 1 ], seq[2][1] ) ])
+        self.assertEquals(list(seq_outermost_node_iter(seq, 'code')), [ ( [], seq ) ])
+        self.assertEquals(list(seq_outermost_node_iter(seq, 'x')), [])
+
+    def testSeqVisitLabels(self):
+        seq = [ 'code', [ 'e', 0, 'a', [ 'e', 1, 'b' ] ], [ 's', [ 'e', 2, 'c' ] ] ]
+        found = []
+        seq_visit_labels(seq, { 'e': lambda curPos, node: found.append(( 'e', curPos )),
+                's': lambda curPos, node: found.append(( 's', curPos )) })
+        self.assertEquals(found, [ ( 'e', [ 1 ] ), ( 'e', [ 1, 3 ] ), ( 's', [ 2 ] ), ( 'e', [ 2, 1 ] ) ])
+
+    def testSeqPrettyWrite(self):
+        from cStringIO import StringIO
+        seq = [ 'code', [ 'a', 0, 'x', [ 'b', 1, 'y' ] ], [ 'c', 'p', 'q', 'r' ], [ 'd' ] ]
+        self.assertEquals(seq_pretty(seq), [ '[ code:', '  [ a:', '    0', "    'x'", "    [ b:", '      1', "      'y'", '    ]', '  ]',
+                "  [c: 'p','q','r' ]", '  [d:]', ']' ])
+        f = StringIO()
+        seq_pretty_write(seq, f)
+        self.assertEquals(f.getvalue(), "\n".join(seq_pretty(seq)) + "\n")
+        f = StringIO()
+        seq_pretty_write(seq, f, maxDepth=1, maxItems=2)
+        self.assertEquals(f.getvalue().split("\n"), [ '[ code:', '  [a: ... ]', '  [c: ... ]', '  ... (1 more items)', ']', '' ])
+        self.assertEquals(list(seq_pretty_iter(seq[2], maxItems=2)), [ '[ c:', "  'p','q'", '  ... (1 more items)', ']' ])
+
+    def testTreeSeqCache(self):
+        import tempfile, shutil, time
+        directory = tempfile.mkdtemp()
+        try:
+            cache = TreeSeqCache(os.path.join(directory, "cache"))
+            key = TreeSeqCache.key_of("a = 1", "grammar-1", "tokens")
+            self.assertNotEquals(key, TreeSeqCache.key_of("a = 1", "grammar-2", "tokens"))
+            self.assertNotEquals(key, TreeSeqCache.key_of("a = 1", "grammar-1", "ast"))
+            self.assertNotEquals(key, TreeSeqCache.key_of(u"a = 1", "grammar-1", "tokens"))
+            self.assertEquals(cache.get(key), None)
+
+            seq = [ 'code', [ 'id', 0, 'a' ], [ 'op', 2, '=' ], [ 'num', 4, '1' ] ]
+            built = []
+            def build(): built.append(1); return seq
+            self.assertEquals(cache.get_or_build(key, build), seq)
+            self.assertEquals(cache.get_or_build(key, build), seq)
+            self.assertEquals(len(built), 1)
+            self.assertEquals(cache.get(key), seq)
+
+            with open(os.path.join(cache.directory, key + ".tqs"), "wb") as f: f.write("TQS1")  # a broken entry
+            self.assertEquals(cache.get(key), None)
+
+            # a corrupted entry is a miss, not an error nor a wrong seq
+            import random
+            rnd = random.Random(0)
+            cache.put(key, seq)
+            path = os.path.join(cache.directory, key + ".tqs")
+            with open(path, "rb") as f: data = f.read()
+            for _ in xrange(200):
+                b = bytearray(data)
+                for _ in xrange(rnd.randint(1, 3)): b[rnd.randrange(len(b))] ^= rnd.randrange(1, 256)
+                with open(path, "wb") as f: f.write(str(b))
+                self.assertEquals(cache.get(key), None)
+
+            # a TreeSeq returned by build is converted to a nested-list seq, as a seq got from the cache
+            key2 = TreeSeqCache.key_of("b", "grammar-1", "tokens")
+            r = cache.get_or_build(key2, lambda: TreeSeq.from_nested(seq))
+            self.assertTrue(r.__class__ is list)
+            self.assertEquals(r, seq)
+            self.assertEquals(cache.get_or_build(key2, lambda: None), seq)
+
+            # the least recently used entries are evicted
+            cache.clear()
+            keys = [ TreeSeqCache.key_of(str(i), "g", "s") for i in range(3) ]
+            for i, k in enumerate(keys):
+                cache.put(k, seq)
+                os.utime(os.path.join(cache.directory, k + ".tqs"), ( time.time() - 100 + i, time.time() - 100 + i ))
+            cache.get(keys[0])
+            cache.evict(cache.total_bytes() * 2 // 3)
+            self.assertEquals([ cache.get(k) is not None for k in keys ], [ True, False, True ])
+            cache.clear()
+            self.assertEquals(cache.total_bytes(), 0)
+
+            # put() scans the directory only when the counted total exceeds maxBytes
+            capped = TreeSeqCache(cache.directory, maxBytes=3000)
+            listdir = os.listdir
+            scans = []
+            def counting_listdir(path): scans.append(path); return listdir(path)
+            os.listdir = counting_listdir
+            try:
+                for i in range(200): capped.put(TreeSeqCache.key_of(str(i), "g", "s"), seq)
+            finally:
+                os.listdir = listdir
+            self.assertTrue(2 <= len(scans) <= 200 // 2)
+            self.assertTrue(capped.total_bytes() <= 3000)
+
+            # temporary files left by interrupted writes are removed by evict(), when they are old
+            stale, fresh = os.path.join(cache.directory, "a.tmp"), os.path.join(cache.directory, "b.tmp")
+            for path in ( stale, fresh ):
+                with open(path, "wb") as f: f.write("x")
+            os.utime(stale, ( time.time() - 7200, time.time() - 7200 ))
+            cache.evict(0)
+            self.assertEquals(( os.path.exists(stale), os.path.exists(fresh) ), ( False, True ))
+        finally:
+            shutil.rmtree(directory)
+
 #def TestSuite(TestTorqTreeseq):
 #    return unittest.makeSuite(TestTorqTreeseq)
 
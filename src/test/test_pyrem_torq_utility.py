@@ -0,0 +1,147 @@
+import sys, os
+import unittest
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from pyrem_torq.utility import *
+
+class TestTorqUtility(unittest.TestCase):
+    def testSplitToStrings(self):
+        self.assertEquals(split_to_strings("ab 12"), [ 0, 'ab', 2, ' ', 3, '12' ])
+        self.assertEquals(split_to_strings(u"ab\r\n"), [ 0, u'ab', 2, u'\r\n' ])
+
+    def testSplitToStringsWithInternTable(self):
+        text = "abc = abc + abc"
+        r = split_to_strings(text)
+        table = StringInternTable()
+        ri = split_to_strings(text, internTable=table)
+        self.assertEquals(ri, r)
+        self.assertTrue(ri[1] is ri[9] is ri[17])
+        self.assertFalse(r[1] is r[9])
+        self.assertEquals(table.savedCount, 2)
+        self.assertEquals(table.savedBytes, 2 * sys.getsizeof('abc'))
+
+        # a table can be shared among calls
+        ri2 = split_to_strings("x = abc", internTable=table)
+        self.assertTrue(ri2[9] is ri[1])
+        self.assertEquals(table.savedCount, 3)
+
+        # str and unicode strings are not mixed up
+        ru = split_to_strings(u"abc", internTable=table)
+        self.assertTrue(ru[1].__class__ is unicode)
+        self.assertEquals(table.savedCount, 3)
+
+        self.assertTrue(table.intern('abc' + '') is ri[1])
+        self.assertTrue(table.intern(u'abc').__class__ is unicode)
+
+    def testMmapTokenSeq(self):
+        import tempfile
+        text = "if x then\r\n  y = 12"
+        seq = [ 'code' ] + split_to_strings(text)
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, "wb") as f: f.write(text)
+            ts = open_token_seq(path, 'code')
+            self.assertEquals(len(ts), len(seq))
+            self.assertEquals(list(ts), seq)
+            self.assertEquals(ts[:], seq)
+            self.assertEquals(( ts[0], ts[1], ts[2], ts[-1], ts[3:5] ), ( 'code', 0, 'if', '12', [ 2, ' ' ] ))
+            self.assertRaises(IndexError, lambda: ts[len(seq)])
+
+            from pyrem_torq.expression import Search, BuildToNode, Rex, Literal
+            expr = Search(BuildToNode('id', Rex(r"^[a-z]")) | BuildToNode('num', Rex(r"^\d")) | BuildToNode('eq', Literal('=')))
+            self.assertEquals(expr.parse(ts), expr.parse(seq))
+        finally:
+            os.remove(path)
+
+        table = StringInternTable()
+        ts = split_to_token_seq('code', "a a", internTable=table)
+        self.assertTrue(ts[2] is ts[6])
+
+    def testSplitToStringsIter(self):
+        import re
+        from StringIO import StringIO
+        text = "if abc123 then\r\n  xyz = 12 \r\n"
+        for pattern in ( None, re.compile(r"\b\w+\b|\s+|.", re.DOTALL), re.compile(r"x*") ):
+            expected = split_to_strings(text, pattern)
+            for chunkSize in ( 1, 2, 3, 7, 1000 ):
+                r = []
+                for pos, s in split_to_strings_iter(StringIO(text), pattern, chunkSize): r.extend(( pos, s ))
+                self.assertEquals(r, expected)
+        self.assertEquals(list(split_to_strings_iter(StringIO(""))), [])
+
+        # string literals and block comments crossing chunk boundaries
+        text = 'x = "a b c"; /* a comment */ y = "" + "d e";/**/\n' * 30
+        for pattern in ( re.compile(r'"[^"]*"|\w+|.', re.DOTALL), re.compile(r'/\*.*?\*/|"[^"\n]*"|\w+|\s+|.', re.DOTALL) ):
+            expected = split_to_strings(text, pattern)
+            for chunkSize in ( 1, 2, 3, 5, 7, 11, 64 ):
+                r = []
+                for pos, s in split_to_strings_iter(StringIO(text), pattern, chunkSize, maxTokenLength=20): r.extend(( pos, s ))
+                self.assertEquals(r, expected)
+
+        table = StringInternTable()
+        r = list(split_to_strings_iter(StringIO("ab ab"), chunkSize=2, internTable=table))
+        self.assertEquals(r, [ ( 0, 'ab' ), ( 2, ' ' ), ( 3, 'ab' ) ])
+        self.assertTrue(r[0][1] is r[2][1])
+
+    def testLabeledTokenizer(self):
+        tokenizer = LabeledTokenizer([ ( 'if', r"if\b" ), ( 'id', r"[a-z]\w*" ), ( 'num', r"\d+" ),
+            ( 'null', r"[ \t]+" ), ( 'op', r"[-+=]" ) ], drop=[ 'null' ])
+        self.assertEquals(tokenizer.tokenize("if ifx = 12+x1"),
+            [ [ 'if', 0, 'if' ], [ 'id', 3, 'ifx' ], [ 'op', 7, '=' ], [ 'num', 9, '12' ], [ 'op', 11, '+' ], [ 'id', 12, 'x1' ] ])
+        self.assertEquals(tokenizer.tokenize(""), [])
+        self.assertRaises(ValueError, tokenizer.tokenize, "x * y")
+
+        # the same to splitting and then labeling each token by an expression
+        from pyrem_torq.expression import Search, BuildToNode, Rex, Literal
+        expr = Search(BuildToNode('if', Literal('if')) | BuildToNode('id', Rex(r"^[a-z]")) | BuildToNode('num', Rex(r"^\d"))
+            | BuildToNode('null', Rex(r"^\s")) | BuildToNode('op', Rex(r"^[-+=]")))
+        text = "x = ab + 2 - if"
+        self.assertEquals([ 'code' ] + tokenizer.tokenize(text), expr.parse([ 'code' ] + split_to_strings(text), dropLabel='null'))
+
+    def testParallelTokenize(self):
+        import re, multiprocessing
+        text = "abc = 12\r\n\r\nif x then\r\n  y = \"a b\"\r\n" * 20
+        newLine = re.compile(r"\n")
+        tokenizer = LabeledTokenizer([ ( 'id', r"[a-z]+" ), ( 'num', r"\d+" ), ( 'str', r'"[^"]*"' ),
+            ( 'null', r"[ \t]+" ), ( 'newline', r"\r\n" ), ( 'op', r"=" ) ], drop=[ 'null' ])
+        pool = multiprocessing.Pool(2)
+        try:
+            for pieceCount in ( 1, 3, 16, 1000 ):
+                self.assertEquals(split_to_strings_parallel(text, newLine, pieceCount=pieceCount, pool=pool), split_to_strings(text))
+                self.assertEquals(tokenize_parallel(tokenizer, text, newLine, pieceCount=pieceCount, pool=pool), tokenizer.tokenize(text))
+        finally:
+            pool.terminate(); pool.join()
+        self.assertEquals(split_to_strings_parallel(text, newLine, processes=1, pieceCount=5), split_to_strings(text))
+        self.assertEquals(split_to_strings_parallel("", newLine), [])
+
+        table = StringInternTable()
+        r = split_to_strings_parallel(text, newLine, processes=1, internTable=table)
+        self.assertTrue(r[1] is r[r.index('abc', 2)])
+        try:
+            tokenize_parallel(tokenizer, text + "x = ?\r\n", newLine, processes=1, pieceCount=20)
+            self.fail()
+        except ValueError, e:
+            self.assertTrue(str(e).startswith("pos %d:" % ( len(text) + 4 )))
+
+    def testBytesLikeSources(self):
+        import re
+        from pyrem_torq.expression import Search, BuildToNode, Rex, Literal
+        text = "int x = 12;"
+        seq = [ 'code' ] + split_to_strings(text)
+        tokenizer = LabeledTokenizer([ ( 'type', r"int\b" ), ( 'id', r"[a-z]+" ), ( 'num', r"\d+" ),
+            ( 'null', r" " ), ( 'op', r"[=;]" ) ], drop=[ 'null' ])
+        expr = Search(BuildToNode('type', Literal('int')) | BuildToNode('num', Rex(r"^\d")))
+        for src in ( bytearray(text), memoryview(text), buffer(text) ):
+            r = [ 'code' ] + split_to_strings(src)
+            self.assertEquals(r, seq)
+            self.assertTrue(all(s.__class__ is str for s in r[2::2]))
+            self.assertEquals(split_to_token_seq('code', src)[:], seq)
+            self.assertEquals(tokenizer.tokenize(src), tokenizer.tokenize(text))
+            self.assertEquals(tokenize_parallel(tokenizer, src, re.compile(";"), processes=1), tokenizer.tokenize(text))
+            self.assertEquals(expr.parse(r), expr.parse(seq))
+
+#def TestSuite(TestTorqUtility):
+#    return unittest.makeSuite(TestTorqUtility)
+
+if __name__ == '__main__':
+    unittest.main()